@@ -1,56 +1,166 @@
-from flask import Flask, jsonify
-import requests
+import os
 import time
-
-app = Flask(__name__)
-
-# введите свой API ключ OpenWeatherMap
-API_KEY = 'api'
-
-@app.route('/status_codes', methods=['GET'])
-def get_status_codes():
-    statuses = {}
-
-    # функция для отправки запросов и добавления статуса
-    def check_status(url, label):
+import atexit
+from concurrent.futures import ThreadPoolExecutor, wait
+# до Python 3.11 это не встроенный TimeoutError, а отдельный класс
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from flask import Blueprint, Flask, current_app, jsonify
+import requests
+from requests.adapters import HTTPAdapter
+from cache import TTLCache
+from rate_limit import TokenBucket
+
+# настройки по умолчанию, каждую можно переопределить переменной окружения с тем же именем
+DEFAULTS = {
+    # API ключ OpenWeatherMap, обязателен
+    'OPENWEATHER_API_KEY': None,
+    # адрес OpenWeatherMap, для нагрузочного теста подменяется локальной заглушкой
+    'OPENWEATHER_BASE_URL': 'http://api.openweathermap.org',
+    # таймауты одного запроса (соединение, ответ) и общий срок на все проверки, в секундах
+    'PROBE_CONNECT_TIMEOUT': 1.0,
+    'PROBE_READ_TIMEOUT': 2.0,
+    'STATUS_DEADLINE': 3.0,
+    # бесплатный тариф OpenWeatherMap - 60 запросов в минуту; ведро свое у каждого процесса
+    'UPSTREAM_RATE': 1.0,
+    'UPSTREAM_BURST': 10.0,
+    # потоки для параллельных проверок, общие для всех запросов процесса
+    'PROBE_WORKERS': 32,
+    # статусы меняются редко: CACHE_TTL секунд отдаем из кэша, еще CACHE_STALE секунд - старое значение, обновляя его в фоне
+    'CACHE_TTL': 10.0,
+    'CACHE_STALE': 60.0,
+}
+
+# заглушки для статусов, которые нельзя безопасно получить от API
+STATIC_STATUSES = {
+    # некорректный запрос (ожидаем 400)
+    'bad_request': 400,
+    # запрещенный доступ (ожидаем 403)
+    'forbidden_request': 403,
+    # превышение лимита запросов (ожидаем 429)
+    'rate_limit_exceeded': 429,
+}
+
+
+def load_config(environ=os.environ):
+    """настройки из переменных окружения, приведенные к типам значений по умолчанию"""
+    config = {}
+    for name, default in DEFAULTS.items():
+        value = environ.get(name)
+        if value is None:
+            config[name] = default
+        else:
+            config[name] = value if default is None else type(default)(value)
+    return config
+
+
+def make_probes(api_key):
+    """название проверки -> путь и параметры запроса"""
+    return {
+        # корректный запрос (ожидаем 200)
+        'valid_request': ('/data/2.5/weather', {'lat': 44.34, 'lon': 10.99, 'appid': api_key}),
+        # неверный API ключ (ожидаем 401)
+        'invalid_api_key': ('/data/2.5/weather', {'lat': 44.34, 'lon': 10.99, 'appid': 'invalid_key'}),
+        # данные не найдены (ожидаем 404)
+        'data_not_found': ('/data/2.5/weather/qwerty', {'lat': 44.34, 'lon': 10.99, 'dt': 1609459200, 'appid': api_key}),
+    }
+
+
+class RateLimited(Exception):
+    """токен не освободился до общего срока, запрос к API не отправлен"""
+
+
+class StatusChecker:
+    """проверки статусов OpenWeatherMap и то, что они делят между запросами: потоки, соединения, кэш и ведро токенов"""
+
+    def __init__(self, config):
+        self.base_url = config['OPENWEATHER_BASE_URL'].rstrip('/')
+        self.probes = make_probes(config['OPENWEATHER_API_KEY'])
+        self.timeout = (config['PROBE_CONNECT_TIMEOUT'], config['PROBE_READ_TIMEOUT'])
+        self.deadline = config['STATUS_DEADLINE']
+        self.rate_limiter = TokenBucket(rate=config['UPSTREAM_RATE'], capacity=config['UPSTREAM_BURST'])
+        self.executor = ThreadPoolExecutor(max_workers=config['PROBE_WORKERS'])
+        # общая сессия держит соединения с API открытыми (keep-alive), по одному на поток
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_maxsize=config['PROBE_WORKERS']))
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=config['PROBE_WORKERS']))
+        self.cache = TTLCache(ttl=config['CACHE_TTL'], stale=config['CACHE_STALE'], executor=self.executor)
+        self.closed = False
+
+    def fetch_status(self, path, params, deadline):
+        """статус ответа OpenWeatherMap"""
+        remaining = deadline - time.monotonic()
+        # проверка простояла в очереди пула до конца срока - ее ответ уже никто не ждет, токен не тратим
+        if remaining <= 0:
+            raise FutureTimeoutError()
+        # ждем токен не дольше, чем осталось до общего срока
+        if not self.rate_limiter.acquire(timeout=remaining):
+            raise RateLimited()
+        return self.session.get(self.base_url + path, params=params, timeout=self.timeout).status_code
+
+    def check_status(self, label, path, params, deadline):
+        """статус из кэша или от OpenWeatherMap, либо текст ошибки"""
         try:
-            response = requests.get(url)
-            statuses[label] = response.status_code
+            return self.cache.get(label, lambda: self.fetch_status(path, params, deadline),
+                                  timeout=max(0.0, deadline - time.monotonic()))
+        except RateLimited:
+            return 'skipped: local rate limit'
+        except FutureTimeoutError:
+            return 'timeout'
         except requests.exceptions.RequestException as e:
-            statuses[label] = str(e)
-
-    # корректный запрос (ожидаем 200)
-    url_valid = f"http://api.openweathermap.org/data/2.5/weather?lat=44.34&lon=10.99&appid={API_KEY}"
-    check_status(url_valid, 'valid_request')
-
-    time.sleep(1)
-
-    # неверный API ключ (ожидаем 401)
-    url_invalid_key = f"http://api.openweathermap.org/data/2.5/weather?lat=44.34&lon=10.99&appid=invalid_key"
-    check_status(url_invalid_key, 'invalid_api_key')
-
-    time.sleep(1)
-
-    # данные не найдены (ожидаем 404)
-    url_not_found = f"http://api.openweathermap.org/data/2.5/weather/qwerty?lat=44.34&lon=10.99&dt=1609459200&appid={API_KEY}"
-    check_status(url_not_found, 'data_not_found')
-
-    time.sleep(1)
-
-    # заглушка для некорректного запроса (ожидаем 400)
-    statuses['bad_request'] = 400
-
-    time.sleep(1)
-
-    # заглушка для запрещенного доступа (ожидаем 403)
-    statuses['forbidden_request'] = 403
-
-    time.sleep(1)
-
-    # заглушка для превышения лимита запросов (ожидаем 429)
-    statuses['rate_limit_exceeded'] = 429
-
-    return jsonify(statuses)
+            return str(e)
+
+    def status_codes(self):
+        deadline = time.monotonic() + self.deadline
+        # все проверки идут одновременно, ответ не ждет дольше общего срока
+        futures = {label: self.executor.submit(self.check_status, label, path, params, deadline)
+                   for label, (path, params) in self.probes.items()}
+        wait(futures.values(), timeout=max(0.0, deadline - time.monotonic()))
+        for future in futures.values():
+            # проверки, до которых очередь пула не дошла, снимаем, чтобы они не занимали потоки после ответа
+            if not future.done():
+                future.cancel()
+        statuses = {label: future.result() if future.done() and not future.cancelled() else 'timeout'
+                    for label, future in futures.items()}
+        statuses.update(STATIC_STATUSES)
+        return statuses
+
+    def close(self):
+        """дождаться начатых проверок и закрыть соединения, повторный вызов ничего не делает"""
+        if self.closed:
+            return
+        self.closed = True
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.session.close()
+
+
+bp = Blueprint('status', __name__)
+
+
+@bp.route('/status_codes', methods=['GET'])
+def get_status_codes():
+    return jsonify(current_app.extensions['status_checker'].status_codes())
+
+
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    # попадания и промахи кэша, по ним подбирается CACHE_TTL
+    return jsonify(current_app.extensions['status_checker'].cache.stats())
+
+
+def create_app(config=None):
+    """приложение с настройками из окружения, config переопределяет отдельные значения"""
+    settings = load_config()
+    settings.update(config or {})
+    if not settings['OPENWEATHER_API_KEY']:
+        raise RuntimeError('set OPENWEATHER_API_KEY to your OpenWeatherMap API key')
+    app = Flask(__name__)
+    app.config.update(settings)
+    checker = StatusChecker(settings)
+    app.extensions['status_checker'] = checker
+    app.register_blueprint(bp)
+    # gunicorn закрывает проверки в worker_exit, atexit - для остальных серверов
+    atexit.register(checker.close)
+    return app
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,125 @@
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import requests
+from load_test import StubHandler, StubServer, percentile, serve
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_service(server, port, env):
+    """запустить сервис отдельным процессом и дождаться, пока он начнет отвечать"""
+    if server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app']
+    else:
+        # прежний способ запуска: встроенный сервер Flask
+        command = [sys.executable, '-c', f'from app import create_app; create_app().run(port={port})']
+    process = subprocess.Popen(command, cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        if process.poll() is not None:
+            raise RuntimeError(f'{server} exited with code {process.returncode}')
+        try:
+            requests.get(url + '/metrics', timeout=1)
+            return process, url
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f'{server} did not start')
+
+
+def stop_service(process):
+    """SIGTERM и время, за которое сервис закончил работу"""
+    start = time.perf_counter()
+    process.send_signal(signal.SIGTERM)
+    process.wait(timeout=60)
+    return time.perf_counter() - start
+
+
+def drive(url, concurrency, duration):
+    """задержки ответов и число ошибок, concurrency клиентов шлют запросы duration секунд"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    stop = time.perf_counter() + duration
+
+    def client():
+        session = requests.Session()
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            try:
+                session.get(url, timeout=30).raise_for_status()
+            except requests.exceptions.RequestException as e:
+                errors.append(e)
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), len(errors), time.perf_counter() - start
+
+
+def run(server, levels, duration, latency, workers, worker_class, threads, cache_ttl):
+    StubHandler.latency = latency
+    stub = serve(StubServer(('127.0.0.1', 0), StubHandler))
+    port = free_port()
+    env = dict(os.environ,
+               OPENWEATHER_API_KEY=StubHandler.valid_key,
+               OPENWEATHER_BASE_URL=f'http://127.0.0.1:{stub.server_port}',
+               # заглушку ограничивать незачем, меряем сам сервис
+               UPSTREAM_RATE='100000', UPSTREAM_BURST='100000',
+               CACHE_TTL=str(cache_ttl), CACHE_STALE=str(cache_ttl),
+               BIND=f'127.0.0.1:{port}', WEB_CONCURRENCY=str(workers), WORKER_CLASS=worker_class,
+               THREADS=str(threads), ACCESS_LOG='')
+    process, url = start_service(server, port, env)
+    print(f"{server} ({workers} x {worker_class}, {threads} threads)" if server == 'gunicorn' else server)
+    print(f"{'clients':>8} {'requests':>9} {'errors':>7} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>8}")
+    best = (0, 0)
+    flat = 0
+    try:
+        for concurrency in levels:
+            latencies, errors, elapsed = drive(url + '/status_codes', concurrency, duration)
+            rate = len(latencies) / elapsed
+            print(f"{concurrency:>8} {len(latencies):>9} {errors:>7} {percentile(latencies, 0.5) * 1000:>9.0f} "
+                  f"{percentile(latencies, 0.99) * 1000:>9.0f} {rate:>8.1f}")
+            flat = 0 if rate > best[0] * 1.05 else flat + 1
+            if rate > best[0]:
+                best = (rate, concurrency)
+            # потолок: два шага подряд больше клиентов не дают запросов в секунду, только растет очередь
+            if flat == 2:
+                break
+    finally:
+        print(f"ceiling: {best[0]:.1f} req/s at {best[1]} clients, stopped in {stop_service(process):.1f}s after SIGTERM")
+        stub.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Потолок пропускной способности /status_codes на локальной заглушке OpenWeatherMap.')
+    parser.add_argument('--server', choices=('gunicorn', 'flask'), default='gunicorn', help='Чем обслуживать сервис.')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64, 128],
+                        help='Число одновременных клиентов на каждом шаге.')
+    parser.add_argument('--duration', type=float, default=5, help='Длительность шага, в секундах.')
+    parser.add_argument('--latency', type=float, default=0.05, help='Задержка ответа заглушки, в секундах.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() * 2 + 1, help='Процессы gunicorn.')
+    parser.add_argument('--worker-class', default='gthread', help='Тип процессов gunicorn (gthread, gevent).')
+    parser.add_argument('--threads', type=int, default=16, help='Потоки в процессе gunicorn.')
+    parser.add_argument('--cache-ttl', type=float, default=10, help='Время жизни кэша статусов, 0 - без кэша.')
+    args = parser.parse_args()
+    run(args.server, args.concurrency, args.duration, args.latency, args.workers, args.worker_class, args.threads,
+        args.cache_ttl)
@@ -0,0 +1,72 @@
+import threading
+import time
+from concurrent.futures import Future
+
+
+class TTLCache:
+    """кэш ответов с временем жизни ttl и отдачей устаревшего значения еще stale секунд
+
+    пока значение свежее, его отдают без запроса. устаревшее отдают сразу, а
+    обновляют в фоне через executor (stale-while-revalidate). одинаковые
+    промахи, пришедшие одновременно, ждут один общий запрос (single-flight).
+    исключения из fetch не кэшируются
+    """
+
+    def __init__(self, ttl, stale, executor):
+        self.ttl = ttl
+        self.stale = stale
+        self._executor = executor
+        self._entries = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'coalesced': 0, 'refreshes': 0, 'errors': 0}
+
+    def get(self, key, fetch, timeout=None):
+        """значение по ключу; при промахе его вычисляет fetch() в текущем потоке
+
+        concurrent.futures.TimeoutError, если за timeout секунд чужой запрос за этим ключом не закончился
+        """
+        with self._lock:
+            now = time.monotonic()
+            entry = self._entries.get(key)
+            age = now - entry[1] if entry else None
+            if entry and age < self.ttl:
+                self._stats['hits'] += 1
+                return entry[0]
+            future = self._inflight.get(key)
+            if entry and age < self.ttl + self.stale:
+                self._stats['stale_hits'] += 1
+                if future is None:
+                    self._stats['refreshes'] += 1
+                    future = self._inflight[key] = Future()
+                    self._executor.submit(self._load, key, fetch, future)
+                return entry[0]
+            if future is not None:
+                self._stats['coalesced'] += 1
+                leader = False
+            else:
+                self._stats['misses'] += 1
+                future = self._inflight[key] = Future()
+                leader = True
+        if leader:
+            self._load(key, fetch, future)
+        return future.result(timeout)
+
+    def _load(self, key, fetch, future):
+        try:
+            value = fetch()
+        except Exception as e:
+            with self._lock:
+                self._stats['errors'] += 1
+                del self._inflight[key]
+            future.set_exception(e)
+        else:
+            with self._lock:
+                self._entries[key] = (value, time.monotonic())
+                del self._inflight[key]
+            future.set_result(value)
+
+    def stats(self):
+        """счетчики попаданий и промахов и число записей"""
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
@@ -0,0 +1,30 @@
+import os
+import multiprocessing
+
+# адрес и число процессов; у каждого процесса свое ведро токенов, так что общий темп к API - UPSTREAM_RATE * workers
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+# gthread - пул потоков в каждом процессе, gevent - зеленые потоки (pip install gevent)
+worker_class = os.environ.get('WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('THREADS', 16))
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+
+# ответ ждет OpenWeatherMap не дольше STATUS_DEADLINE, так что зависший процесс видно быстро
+timeout = int(os.environ.get('TIMEOUT', 30))
+keepalive = int(os.environ.get('KEEPALIVE', 5))
+
+# по SIGTERM процесс перестает принимать соединения и дает начатым запросам закончиться
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+
+# приложение создается в каждом процессе после fork, чтобы потоки и соединения не делились между процессами
+preload_app = False
+
+accesslog = os.environ.get('ACCESS_LOG', '-') or None
+
+
+def worker_exit(server, worker):
+    # дождаться начатых проверок и закрыть соединения с API
+    checker = getattr(worker, 'wsgi', None) and worker.wsgi.extensions.get('status_checker')
+    if checker:
+        checker.close()
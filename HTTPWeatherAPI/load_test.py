@@ -0,0 +1,155 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import requests
+
+
+# заглушка OpenWeatherMap: 200 для верного ключа, 401 для неверного, 404 для неизвестного пути
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1, чтобы клиент мог держать соединение открытым
+    protocol_version = 'HTTP/1.1'
+    latency = 0.05
+    valid_key = 'api'
+    requests_seen = 0
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with StubHandler.lock:
+            StubHandler.connections += 1
+
+    def do_GET(self):
+        with StubHandler.lock:
+            StubHandler.requests_seen += 1
+        time.sleep(self.latency)
+        url = urlparse(self.path)
+        appid = parse_qs(url.query).get('appid', [''])[0]
+        if url.path != '/data/2.5/weather':
+            status, body = 404, {'cod': '404', 'message': 'Internal error'}
+        elif appid != self.valid_key:
+            status, body = 401, {'cod': 401, 'message': 'Invalid API key.'}
+        else:
+            status, body = 200, {'cod': 200, 'name': 'Zocca', 'main': {'temp': 298.48}}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    # очередь по умолчанию в 5 соединений теряет SYN под нагрузкой, а повтор через секунду портит p99
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def legacy_status_codes():
+    """прежний обработчик: проверки по очереди, без таймаутов, с паузами по секунде"""
+    from flask import current_app, jsonify
+    from app import STATIC_STATUSES
+    checker = current_app.extensions['status_checker']
+    statuses = {}
+    for label, (path, params) in checker.probes.items():
+        try:
+            statuses[label] = requests.get(checker.base_url + path, params=params).status_code
+        except requests.exceptions.RequestException as e:
+            statuses[label] = str(e)
+        time.sleep(1)
+    for label, status in STATIC_STATUSES.items():
+        statuses[label] = status
+        time.sleep(1)
+    return jsonify(statuses)
+
+
+def run_load(url, total, concurrency):
+    """задержки всех ответов и общее время, запросы шлют concurrency потоков"""
+    latencies = []
+    errors = []
+    counter = iter(range(total))
+    lock = threading.Lock()
+
+    def client():
+        session = requests.Session()
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            start = time.perf_counter()
+            try:
+                session.get(url, timeout=60).raise_for_status()
+            except requests.exceptions.RequestException as e:
+                errors.append(e)
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), len(errors), time.perf_counter() - start
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(share * len(values)))] if values else float('nan')
+
+
+def main(total, concurrency, latency, upstream_rate, upstream_burst, cache_ttl, cache_stale):
+    StubHandler.latency = latency
+    stub = serve(StubServer(('127.0.0.1', 0), StubHandler))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from app import create_app
+    from werkzeug.serving import make_server
+    app = create_app({'OPENWEATHER_API_KEY': StubHandler.valid_key,
+                      'OPENWEATHER_BASE_URL': f'http://127.0.0.1:{stub.server_port}',
+                      'UPSTREAM_RATE': upstream_rate, 'UPSTREAM_BURST': upstream_burst,
+                      'CACHE_TTL': cache_ttl, 'CACHE_STALE': cache_stale})
+    # журнал каждого запроса werkzeug заглушил бы таблицу
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    app.add_url_rule('/legacy_status_codes', 'legacy_status_codes', legacy_status_codes)
+    service = serve(make_server('127.0.0.1', 0, app, threaded=True))
+    base = f'http://127.0.0.1:{service.server_port}'
+
+    print(f"{'handler':<22} {'requests':>9} {'errors':>7} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>8} {'upstream/s':>11} {'connections':>12}")
+    for name, path in (('before (serial)', '/legacy_status_codes'), ('after (concurrent)', '/status_codes')):
+        seen, connections = StubHandler.requests_seen, StubHandler.connections
+        latencies, errors, elapsed = run_load(base + path, total, concurrency)
+        upstream = (StubHandler.requests_seen - seen) / elapsed
+        print(f"{name:<22} {len(latencies):>9} {errors:>7} {percentile(latencies, 0.5) * 1000:>9.0f} "
+              f"{percentile(latencies, 0.99) * 1000:>9.0f} {len(latencies) / elapsed:>8.1f} {upstream:>11.1f} {StubHandler.connections - connections:>12}")
+    print('metrics:', requests.get(base + '/metrics').json())
+    service.shutdown()
+    stub.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Нагрузочный тест /status_codes на локальной заглушке OpenWeatherMap.')
+    parser.add_argument('--requests', type=int, default=40, help='Сколько запросов отправить каждому обработчику.')
+    parser.add_argument('--concurrency', type=int, default=10, help='Сколько клиентов шлют запросы одновременно.')
+    parser.add_argument('--latency', type=float, default=0.05, help='Задержка ответа заглушки, в секундах.')
+    parser.add_argument('--upstream-rate', type=float, default=1000, help='Запросов к заглушке в секунду (ведро токенов).')
+    parser.add_argument('--upstream-burst', type=float, default=1000, help='Запас токенов ведра.')
+    parser.add_argument('--cache-ttl', type=float, default=10, help='Время жизни кэша статусов, 0 - без кэша.')
+    parser.add_argument('--cache-stale', type=float, default=60, help='Сколько еще отдавать устаревший статус.')
+    args = parser.parse_args()
+    main(args.requests, args.concurrency, args.latency, args.upstream_rate, args.upstream_burst, args.cache_ttl,
+         args.cache_stale)
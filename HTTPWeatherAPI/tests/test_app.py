@@ -0,0 +1,134 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from unittest import mock
+
+# модули сервиса лежат уровнем выше и импортируются без пакета, как в app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import DEFAULTS, STATIC_STATUSES, StatusChecker, create_app, load_config
+
+
+def make_config(**overrides):
+    config = dict(DEFAULTS, OPENWEATHER_API_KEY='key', OPENWEATHER_BASE_URL='http://upstream.invalid')
+    config.update(overrides)
+    return config
+
+
+class TestLoadConfig(unittest.TestCase):
+
+    def test_defaults(self):
+        self.assertEqual(load_config({}), DEFAULTS)
+
+    def test_values_take_the_type_of_the_default(self):
+        config = load_config({'OPENWEATHER_API_KEY': 'key', 'PROBE_WORKERS': '8', 'CACHE_TTL': '2.5',
+                              'OPENWEATHER_BASE_URL': 'http://localhost:8080'})
+        self.assertEqual(config['OPENWEATHER_API_KEY'], 'key')
+        self.assertEqual(config['PROBE_WORKERS'], 8)
+        self.assertIsInstance(config['PROBE_WORKERS'], int)
+        self.assertEqual(config['CACHE_TTL'], 2.5)
+        self.assertEqual(config['OPENWEATHER_BASE_URL'], 'http://localhost:8080')
+        # остальные не заданы и остались по умолчанию
+        self.assertEqual(config['STATUS_DEADLINE'], DEFAULTS['STATUS_DEADLINE'])
+
+    def test_bad_values(self):
+        for name, value in (('PROBE_WORKERS', 'many'), ('PROBE_WORKERS', '2.5'), ('CACHE_TTL', 'soon')):
+            with self.subTest(name=name, value=value), self.assertRaises(ValueError):
+                load_config({name: value})
+
+
+class TestApp(unittest.TestCase):
+
+    def setUp(self):
+        # настройки только из теста, а не из окружения машины
+        patcher = mock.patch.dict(os.environ, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.statuses = {'/data/2.5/weather': 200, '/data/2.5/weather/qwerty': 404}
+        self.calls = []
+
+        def fetch_status(checker, path, params, deadline):
+            self.calls.append((path, params['appid']))
+            return 401 if params['appid'] == 'invalid_key' else self.statuses[path]
+
+        patcher = mock.patch.object(StatusChecker, 'fetch_status', fetch_status)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_app(self, **config):
+        app = create_app(config)
+        self.addCleanup(app.extensions['status_checker'].close)
+        return app
+
+    def test_api_key_is_required(self):
+        with self.assertRaises(RuntimeError):
+            create_app()
+
+    def test_config_overrides_the_environment(self):
+        os.environ['CACHE_TTL'] = '5'
+        os.environ['OPENWEATHER_API_KEY'] = 'from env'
+        app = self.make_app(OPENWEATHER_API_KEY='key', PROBE_WORKERS=4)
+        self.assertEqual((app.config['OPENWEATHER_API_KEY'], app.config['PROBE_WORKERS'], app.config['CACHE_TTL']),
+                         ('key', 4, 5.0))
+        self.assertEqual(app.extensions['status_checker'].executor._max_workers, 4)
+
+    def test_status_codes(self):
+        client = self.make_app(OPENWEATHER_API_KEY='key').test_client()
+        response = client.get('/status_codes')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), dict({'valid_request': 200, 'invalid_api_key': 401,
+                                                    'data_not_found': 404}, **STATIC_STATUSES))
+        self.assertEqual(sorted(self.calls), [('/data/2.5/weather', 'invalid_key'), ('/data/2.5/weather', 'key'),
+                                              ('/data/2.5/weather/qwerty', 'key')])
+
+    def test_metrics_count_the_cache(self):
+        client = self.make_app(OPENWEATHER_API_KEY='key').test_client()
+        client.get('/status_codes')
+        client.get('/status_codes')
+        metrics = client.get('/metrics').get_json()
+        # второй запрос целиком из кэша, к API ходили только за первым
+        self.assertEqual((metrics['misses'], metrics['hits']), (3, 3))
+        self.assertEqual(len(self.calls), 3)
+
+
+class TestStatusChecker(unittest.TestCase):
+
+    def make_checker(self, **overrides):
+        checker = StatusChecker(make_config(**overrides))
+        self.addCleanup(checker.close)
+        return checker
+
+    def test_expired_deadline_skips_the_token_and_the_request(self):
+        checker = self.make_checker()
+        with mock.patch.object(checker.rate_limiter, 'acquire') as acquire, \
+                mock.patch.object(checker.session, 'get') as get:
+            with self.assertRaises(FutureTimeoutError):
+                checker.fetch_status('/data/2.5/weather', {}, time.monotonic() - 1)
+        acquire.assert_not_called()
+        get.assert_not_called()
+
+    def test_queued_checks_are_cancelled_after_the_deadline(self):
+        # один поток: первая проверка висит, остальные ждут в очереди пула
+        checker = self.make_checker(PROBE_WORKERS=1, STATUS_DEADLINE=0.2)
+        release = threading.Event()
+        calls = []
+
+        def fetch_status(path, params, deadline):
+            calls.append(path)
+            release.wait(5)
+            return 200
+
+        with mock.patch.object(checker, 'fetch_status', fetch_status):
+            statuses = checker.status_codes()
+            release.set()
+            checker.executor.shutdown(wait=True)
+        self.assertEqual({label: statuses[label] for label in checker.probes}, dict.fromkeys(checker.probes, 'timeout'))
+        self.assertEqual({label: statuses[label] for label in STATIC_STATUSES}, STATIC_STATUSES)
+        # снятые проверки так и не начались
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from unittest import mock
+
+# модули сервиса лежат уровнем выше и импортируются без пакета, как в app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cache import TTLCache
+
+
+class Fetch:
+    """fetch, который считает вызовы и может ждать разрешения закончить"""
+
+    def __init__(self, values, release=None):
+        self.values = iter(values)
+        self.release = release
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.calls += 1
+            value = next(self.values)
+        if self.release is not None:
+            self.release.wait(5)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+
+def wait_for(condition, timeout=5):
+    # time.monotonic подменен в тестах, срок считаем по perf_counter
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise AssertionError('condition not met in time')
+        time.sleep(0.005)
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('cache.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.executor = ThreadPoolExecutor(4)
+        self.addCleanup(self.executor.shutdown)
+        self.cache = TTLCache(ttl=10, stale=60, executor=self.executor)
+
+    def test_fresh_value_is_not_fetched_again(self):
+        fetch = Fetch([200, 500])
+        self.assertEqual(self.cache.get('k', fetch), 200)
+        self.now += 9
+        self.assertEqual(self.cache.get('k', fetch), 200)
+        self.assertEqual(fetch.calls, 1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_stale_value_is_served_while_revalidating(self):
+        self.cache.get('k', Fetch([200]))
+        self.now += 20
+        release = threading.Event()
+        fetch = Fetch([401], release)
+        # устаревшее значение отдается сразу, а не после нового запроса
+        self.assertEqual(self.cache.get('k', fetch), 200)
+        self.assertEqual(self.cache.get('k', fetch), 200)
+        release.set()
+        wait_for(lambda: self.cache.get('k', fetch) == 401)
+        # второй устаревший запрос не начал второе обновление
+        self.assertEqual(fetch.calls, 1)
+        stats = self.cache.stats()
+        self.assertEqual(stats['refreshes'], 1)
+        self.assertGreaterEqual(stats['stale_hits'], 2)
+
+    def test_value_past_stale_is_fetched_in_place(self):
+        self.cache.get('k', Fetch([200]))
+        self.now += 71
+        self.assertEqual(self.cache.get('k', Fetch([404])), 404)
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+    def test_concurrent_misses_share_one_fetch(self):
+        release = threading.Event()
+        fetch = Fetch([200], release)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.get('k', fetch, timeout=5)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        # все пятеро пришли, пока первый запрос еще идет
+        wait_for(lambda: self.cache.stats()['coalesced'] == 4)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [200] * 5)
+        self.assertEqual(fetch.calls, 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_errors_are_shared_but_not_cached(self):
+        release = threading.Event()
+        fetch = Fetch([ConnectionError('down'), 200], release)
+        errors = []
+
+        def get():
+            try:
+                self.cache.get('k', fetch, timeout=5)
+            except ConnectionError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=get) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        wait_for(lambda: self.cache.stats()['coalesced'] == 2)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(self.cache.get('k', fetch), 200)
+        self.assertEqual(self.cache.stats()['errors'], 1)
+
+    def test_waiting_for_another_fetch_times_out(self):
+        release = threading.Event()
+        leader = threading.Thread(target=self.cache.get, args=('k', Fetch([200], release)))
+        leader.start()
+        wait_for(lambda: self.cache.stats()['misses'] == 1)
+        with self.assertRaises(FutureTimeoutError):
+            self.cache.get('k', Fetch([500]), timeout=0.01)
+        release.set()
+        leader.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
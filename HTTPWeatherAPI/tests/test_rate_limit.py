@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+# модули сервиса лежат уровнем выше и импортируются без пакета, как в app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rate_limit import TokenBucket
+
+
+class FakeClock:
+    """time.monotonic, который двигается только вручную"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('rate_limit.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_up_to_capacity(self):
+        bucket = TokenBucket(rate=1, capacity=3)
+        # полный запас уходит сразу, следующий токен - только через секунду
+        self.assertEqual([bucket.try_acquire() for _ in range(4)], [True, True, True, False])
+
+    def test_refill_at_rate(self):
+        bucket = TokenBucket(rate=4, capacity=10)
+        while bucket.try_acquire():
+            pass
+        self.clock.now += 0.5
+        self.assertEqual([bucket.try_acquire() for _ in range(3)], [True, True, False])
+
+    def test_refill_stops_at_capacity(self):
+        bucket = TokenBucket(rate=100, capacity=2)
+        bucket.try_acquire()
+        self.clock.now += 60
+        self.assertEqual([bucket.try_acquire() for _ in range(3)], [True, True, False])
+
+    def test_acquire_gives_up_before_deadline(self):
+        bucket = TokenBucket(rate=0.1, capacity=1)
+        bucket.try_acquire()
+        # токен появится только через 10 секунд, ждать его нет смысла
+        with mock.patch('rate_limit.time.sleep') as sleep:
+            self.assertFalse(bucket.acquire(timeout=1))
+        sleep.assert_not_called()
+
+
+class TestTokenBucketWaits(unittest.TestCase):
+
+    def test_acquire_waits_for_next_token(self):
+        bucket = TokenBucket(rate=20, capacity=1)
+        self.assertTrue(bucket.try_acquire())
+        start = time.monotonic()
+        self.assertTrue(bucket.acquire(timeout=1))
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,4 @@
+from app import create_app
+
+# точка входа для gunicorn: gunicorn -c gunicorn.conf.py wsgi:app
+app = create_app()
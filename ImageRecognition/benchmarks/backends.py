@@ -0,0 +1,84 @@
+"""throughput, memory and duplicate agreement of the embedding backends
+
+every backend runs in its own process so peak memory is measured separately,
+agreement is compared with the vgg16 output on the same images
+
+run from the repository root:
+    python -m ImageRecognition.benchmarks.backends --backends vgg16 vgg16-int8 mobilenet_v2 mobilenet_v3_small efficientnet_b0
+"""
+import argparse
+import multiprocessing
+import resource
+import tempfile
+import time
+import numpy as np
+from ImageRecognition.benchmarks.common import write_near_duplicates
+from ImageRecognition.utils.feature_index import FeatureIndex
+
+
+def _measure(backend, paths, batch_size, results):
+    from ImageRecognition.image_processing.decode import decode_image
+    from ImageRecognition.image_processing.features import image_to_array, images_to_feature_matrix
+    from ImageRecognition.model.model import initialize_model
+    arrays = [image_to_array(decode_image(path)) for path in paths]
+    start = time.perf_counter()
+    initialize_model(backend)
+    load_seconds = time.perf_counter() - start
+    images_to_feature_matrix(arrays[:batch_size], batch_size=batch_size)
+    start = time.perf_counter()
+    features = images_to_feature_matrix(arrays, batch_size=batch_size)
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results.put((load_seconds, len(paths) / seconds, peak_mb, features))
+
+
+def measure(backend, paths, batch_size):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_measure, args=(backend, paths, batch_size, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def nearest_neighbours(features):
+    normalized = features / np.linalg.norm(features, axis=1, keepdims=True)
+    similarities = normalized @ normalized.T
+    np.fill_diagonal(similarities, -np.inf)
+    return similarities.argmax(axis=1)
+
+
+def recall(features, truth, threshold):
+    index = FeatureIndex(threshold=threshold)
+    index.add(features)
+    left, right, _ = index.pairs()
+    return len(set(zip(left.tolist(), right.tolist())) & truth) / len(truth)
+
+
+def run(backends, count, batch_size, threshold):
+    with tempfile.TemporaryDirectory() as folder:
+        paths, truth = write_near_duplicates(folder, count)
+        reference = None
+        print(f"{'backend':<22} {'load s':>7} {'img/s':>8} {'peak MB':>8} {'recall':>7} {'nn agree':>9}")
+        for backend in ['vgg16'] + [name for name in backends if name != 'vgg16']:
+            load_seconds, rate, peak_mb, features = measure(backend, paths, batch_size)
+            neighbours = nearest_neighbours(features)
+            if reference is None:
+                reference = neighbours
+            # share of images whose closest other image is the same as with vgg16
+            agreement = float(np.mean(neighbours == reference))
+            print(f"{backend:<22} {load_seconds:>7.1f} {rate:>8.1f} {peak_mb:>8.0f} "
+                  f"{recall(features, truth, threshold):>7.3f} {agreement:>9.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare embedding backends.')
+    parser.add_argument('--backends', nargs='+', default=['vgg16', 'vgg16-int8', 'mobilenet_v2', 'mobilenet_v3_small', 'efficientnet_b0'],
+                        help='Backends to compare, vgg16 is always measured as the reference.')
+    parser.add_argument('--images', type=int, default=200, help='Number of originals, each gets one near-duplicate.')
+    parser.add_argument('--batch-size', type=int, default=32, help='Images per predict call.')
+    parser.add_argument('--threshold', type=float, default=0.95, help='Cosine similarity threshold for the recall column.')
+    args = parser.parse_args()
+    run(args.backends, args.images, args.batch_size, args.threshold)
@@ -0,0 +1,34 @@
+"""images/sec of batched feature extraction for different batch sizes
+
+run from the repository root:
+    python -m ImageRecognition.benchmarks.batch_inference --images 256
+"""
+import argparse
+import time
+from ImageRecognition.benchmarks.common import make_images
+from ImageRecognition.image_processing.features import images_to_feature_matrix
+from ImageRecognition.model.model import initialize_model
+
+BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64, 128]
+
+
+def run(count, batch_sizes):
+    images = make_images(count)
+    initialize_model()
+    # warm up the model so graph building is not measured
+    images_to_feature_matrix(images[:2], batch_size=2)
+    print(f"{'batch':>6} {'seconds':>9} {'images/sec':>11}")
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        features = images_to_feature_matrix(images, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        assert len(features) == count
+        print(f"{batch_size:>6} {elapsed:>9.2f} {count / elapsed:>11.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark batched feature extraction.')
+    parser.add_argument('--images', type=int, default=256, help='Number of images to extract features from.')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=BATCH_SIZES, help='Batch sizes to measure.')
+    args = parser.parse_args()
+    run(args.images, args.batch_sizes)
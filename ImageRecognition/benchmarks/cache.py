@@ -0,0 +1,45 @@
+"""time of a second scan of an unchanged tree that is fully cached
+
+run from the repository root:
+    python -m ImageRecognition.benchmarks.cache --files 100000
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import imagehash
+from ImageRecognition.utils.cache import FeatureCache
+
+
+def run(count):
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as folder:
+        # the files only need a size and mtime, their content is never decoded
+        paths = []
+        for i in range(count):
+            path = os.path.join(folder, f'img{i:07d}.jpg')
+            with open(path, 'wb') as f:
+                f.write(b'x')
+            paths.append(path)
+        cache_path = os.path.join(folder, 'cache.sqlite3')
+        with FeatureCache(cache_path) as cache:
+            start = time.perf_counter()
+            for path in paths:
+                img_hash = imagehash.ImageHash(rng.integers(0, 2, (8, 8)).astype(bool))
+                cache.store(path, img_hash, rng.random(512, dtype=np.float32))
+            cache.commit()
+            print(f"filled {count} entries in {time.perf_counter() - start:.2f} s")
+        with FeatureCache(cache_path) as cache:
+            start = time.perf_counter()
+            cached, missing = cache.split(paths)
+            elapsed = time.perf_counter() - start
+        assert len(cached) == count and not missing
+        print(f"second scan of {count} files: {elapsed:.2f} s ({count / elapsed:.0f} files/sec)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the hash and feature cache.')
+    parser.add_argument('--files', type=int, default=100000, help='Number of cached files.')
+    args = parser.parse_args()
+    run(args.files)
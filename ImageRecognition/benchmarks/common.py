@@ -0,0 +1,112 @@
+import os
+import numpy as np
+from PIL import Image, ImageEnhance
+
+
+def make_images(count, size=(640, 480), seed=0):
+    """create random rgb images in memory"""
+    rng = np.random.default_rng(seed)
+    return [Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8))
+            for _ in range(count)]
+
+
+def write_images(folder, count, size=(320, 240), seed=0):
+    """write `count` random jpeg images to folder and return their paths"""
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f'img{i:06d}.jpg')
+        pixels = rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(path, quality=85)
+        paths.append(path)
+    return paths
+
+
+def smooth_image(rng, size=(320, 240)):
+    """random image with smooth regions, closer to a photo than pure noise"""
+    small = rng.integers(0, 256, (6, 8, 3), dtype=np.uint8)
+    return Image.fromarray(small).resize(size, Image.BICUBIC)
+
+
+def write_near_duplicates(folder, count, seed=0):
+    """write `count` originals plus a resized and recompressed copy of each
+
+    returns the paths and the set of (original, copy) index pairs
+    """
+    rng = np.random.default_rng(seed)
+    paths = []
+    truth = set()
+    for i in range(count):
+        img = smooth_image(rng)
+        original = os.path.join(folder, f'orig{i:06d}.png')
+        copy = os.path.join(folder, f'copy{i:06d}.jpg')
+        img.save(original)
+        img.resize((200, 150)).save(copy, quality=70)
+        paths += [original, copy]
+        truth.add((len(paths) - 2, len(paths) - 1))
+    return paths, truth
+
+
+def _resize(img, rng):
+    scale = rng.uniform(0.5, 0.9)
+    return img.resize((int(img.width * scale), int(img.height * scale)), Image.BICUBIC), '.jpg', {'quality': 90}
+
+
+def _recompress(img, rng):
+    return img, '.jpg', {'quality': int(rng.integers(30, 61))}
+
+
+def _crop(img, rng):
+    left, top, right, bottom = (rng.uniform(0.0, 0.06, 4) * [img.width, img.height, img.width, img.height]).astype(int)
+    return img.crop((left, top, img.width - right, img.height - bottom)), '.jpg', {'quality': 90}
+
+
+def _brightness(img, rng):
+    return ImageEnhance.Brightness(img).enhance(rng.uniform(0.8, 1.2)), '.jpg', {'quality': 90}
+
+
+def _format(img, rng):
+    return img, '.png', {}
+
+
+# near-duplicate transformations, each returns (image, extension, save options)
+TRANSFORMS = {
+    'resize': _resize,
+    'recompress': _recompress,
+    'crop': _crop,
+    'brightness': _brightness,
+    'format': _format,
+}
+
+
+def write_corpus(folder, count, duplicate_ratio=0.2, max_copies=3, size=(320, 240), seed=0):
+    """write `count` images, some originals followed by near-duplicate copies
+
+    a `duplicate_ratio` share of the originals gets 1 to `max_copies` copies,
+    each made with a different transformation from TRANSFORMS. files go into
+    subfolders of 1000 and a copy always comes right after its original, so
+    the first n paths form a smaller corpus of their own
+
+    returns the paths and the ground truth groups as lists of path indices
+    """
+    rng = np.random.default_rng(seed)
+    paths = []
+    groups = []
+    while len(paths) < count:
+        img = smooth_image(rng, size)
+        variants = [('orig', img, '.jpg', {'quality': 90})]
+        if rng.random() < duplicate_ratio:
+            names = rng.choice(list(TRANSFORMS), int(rng.integers(1, max_copies + 1)), replace=False)
+            variants += [(name, *TRANSFORMS[name](img, rng)) for name in names]
+        variants = variants[:count - len(paths)]
+        group = []
+        for name, variant, extension, options in variants:
+            subfolder = os.path.join(folder, f'{len(paths) // 1000:04d}')
+            os.makedirs(subfolder, exist_ok=True)
+            path = os.path.join(subfolder, f'img{len(paths):06d}_{name}{extension}')
+            variant.save(path, **options)
+            group.append(len(paths))
+            paths.append(path)
+        if len(group) > 1:
+            groups.append(group)
+    return paths, groups
@@ -0,0 +1,60 @@
+"""decode time per image of large jpegs - full decode vs decode_image
+
+run from the repository root:
+    python -m ImageRecognition.benchmarks.decode --images 10 --width 6000 --height 4000
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import imagehash
+from PIL import Image
+from ImageRecognition.image_processing.decode import decode_image
+
+
+def full_decode(path):
+    """what process_image did before - decode at native resolution"""
+    with Image.open(path) as img:
+        img.load()
+        imagehash.average_hash(img)
+        return img.convert('RGB').resize((224, 224))
+
+
+def small_decode(path):
+    img = decode_image(path)
+    imagehash.average_hash(img)
+    return img.resize((224, 224))
+
+
+def write_photos(folder, count, size):
+    """jpegs with smooth content, closer to camera photos than pure noise"""
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        small = rng.integers(0, 256, (size[1] // 100, size[0] // 100, 3), dtype=np.uint8)
+        path = os.path.join(folder, f'photo{i}.jpg')
+        Image.fromarray(small).resize(size, Image.BILINEAR).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def run(count, size):
+    with tempfile.TemporaryDirectory() as folder:
+        paths = write_photos(folder, count, size)
+        print(f"{count} jpegs of {size[0]}x{size[1]}")
+        for name, func in (('full decode', full_decode), ('decode_image', small_decode)):
+            start = time.perf_counter()
+            for path in paths:
+                func(path)
+            elapsed = time.perf_counter() - start
+            print(f"{name:>13}: {1000 * elapsed / count:8.1f} ms per image")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark image decoding.')
+    parser.add_argument('--images', type=int, default=10, help='Number of jpegs.')
+    parser.add_argument('--width', type=int, default=6000, help='Width of the jpegs.')
+    parser.add_argument('--height', type=int, default=4000, help='Height of the jpegs.')
+    args = parser.parse_args()
+    run(args.images, (args.width, args.height))
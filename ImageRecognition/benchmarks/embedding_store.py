@@ -0,0 +1,55 @@
+"""query time and memory of the embedding store as the reference set grows
+
+fills a store with random vectors and queries it with a batch of new ones.
+the peak is what numpy allocates during the query (tracemalloc), it should
+depend on --chunk-size and not on the size of the store. the memory mapped
+rows are page cache the kernel can drop, they are not counted
+
+run from the repository root:
+    python -m ImageRecognition.benchmarks.embedding_store --rows 100000 1000000 --queries 1000
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from ImageRecognition.utils.embedding_store import EmbeddingStore, DEFAULT_CHUNK_SIZE
+
+
+def fill(store, rows, dim, seed=0, batch=65536):
+    rng = np.random.default_rng(seed)
+    while len(store) < rows:
+        count = min(batch, rows - len(store))
+        start = len(store)
+        vectors = rng.standard_normal((count, dim), dtype=np.float32)
+        store.add((f'/archive/{start + i:09d}.jpg', start + i, vector) for i, vector in enumerate(vectors))
+
+
+def run(sizes, queries, dim, chunk_size, dtype):
+    rng = np.random.default_rng(1)
+    query = rng.standard_normal((queries, dim), dtype=np.float32)
+    print(f"{'rows':>9} {'store MB':>9} {'seconds':>9} {'rows/sec':>12} {'peak MB':>8}")
+    with tempfile.TemporaryDirectory() as folder:
+        store = EmbeddingStore(os.path.join(folder, 'store'), dtype=dtype)
+        for rows in sorted(sizes):
+            fill(store, rows, dim)
+            size = sum(os.path.getsize(os.path.join(store.directory, name)) for name in os.listdir(store.directory))
+            tracemalloc.start()
+            start = time.perf_counter()
+            store.query(query, chunk_size=chunk_size)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{rows:>9} {size / 2**20:>9.0f} {elapsed:>9.2f} {rows * queries / elapsed:>12.3g} {peak / 2**20:>8.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark queries against the embedding store.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000], help='Store sizes to measure.')
+    parser.add_argument('--queries', type=int, default=1000, help='Number of query vectors.')
+    parser.add_argument('--dim', type=int, default=512, help='Size of the vectors.')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Store rows compared at once.')
+    parser.add_argument('--dtype', choices=('float32', 'float16'), default='float16', help='How the store keeps the vectors.')
+    args = parser.parse_args()
+    run(args.rows, args.queries, args.dim, args.chunk_size, args.dtype)
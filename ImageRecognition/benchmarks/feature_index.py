@@ -0,0 +1,55 @@
+"""recall and speed of the exact and lsh feature indexes
+
+run from the repository root:
+    python -m ImageRecognition.benchmarks.feature_index --sizes 10000 100000 1000000
+"""
+import argparse
+import time
+import numpy as np
+from ImageRecognition.utils.feature_index import FeatureIndex
+
+
+def make_vectors(count, dim=512, duplicate_ratio=0.1, noise=0.15, seed=0):
+    """non-negative vectors like pooled cnn features, with noisy copies appended
+
+    returns the vectors and the set of (original, copy) pairs
+    """
+    rng = np.random.default_rng(seed)
+    copies = int(count * duplicate_ratio)
+    vectors = np.empty((count, dim), dtype=np.float32)
+    vectors[:count - copies] = np.abs(rng.standard_normal((count - copies, dim), dtype=np.float32))
+    originals = rng.choice(count - copies, copies, replace=False)
+    vectors[count - copies:] = vectors[originals] + noise * np.abs(rng.standard_normal((copies, dim), dtype=np.float32))
+    truth = set(zip(originals.tolist(), range(count - copies, count)))
+    return vectors, truth
+
+
+def measure(vectors, truth, mode, threshold):
+    start = time.perf_counter()
+    index = FeatureIndex(threshold=threshold, mode=mode)
+    index.add(vectors)
+    left, right, _ = index.pairs()
+    elapsed = time.perf_counter() - start
+    found = set(zip(left.tolist(), right.tolist()))
+    recall = len(found & truth) / len(truth) if truth else 1.0
+    return elapsed, recall, len(found)
+
+
+def run(sizes, dim, threshold, exact_max):
+    print(f"{'vectors':>8} {'mode':>6} {'seconds':>9} {'pairs':>8} {'recall':>7}")
+    for size in sizes:
+        vectors, truth = make_vectors(size, dim)
+        modes = ['exact', 'lsh'] if size <= exact_max else ['lsh']
+        for mode in modes:
+            elapsed, recall, found = measure(vectors, truth, mode, threshold)
+            print(f"{size:>8} {mode:>6} {elapsed:>9.2f} {found:>8} {recall:>7.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the feature similarity index.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000], help='Numbers of vectors.')
+    parser.add_argument('--dim', type=int, default=512, help='Vector dimension.')
+    parser.add_argument('--threshold', type=float, default=0.95, help='Cosine similarity threshold.')
+    parser.add_argument('--exact-max', type=int, default=100000, help='Largest size to also run the exact mode on.')
+    args = parser.parse_args()
+    run(args.sizes, args.dim, args.threshold, args.exact_max)
@@ -0,0 +1,74 @@
+"""memory of the scan results, the old dicts keyed by tuple(features) against the catalog
+
+run from the repository root:
+    python -m ImageRecognition.benchmarks.memory --images 10000 100000
+"""
+import argparse
+import gc
+import tracemalloc
+from collections import defaultdict
+import numpy as np
+import imagehash
+from ImageRecognition.utils.catalog import Catalog
+
+
+def make_results(count, dim=512, seed=0):
+    """(path, hash, features) like the workers return them"""
+    rng = np.random.default_rng(seed)
+    for i in range(count):
+        img_hash = imagehash.ImageHash(rng.integers(0, 2, (8, 8)).astype(bool))
+        yield f'/photos/2024/{i // 1000:04d}/IMG_{i:07d}.jpg', img_hash, rng.random(dim, dtype=np.float32)
+
+
+def dict_store(results):
+    """how find_duplicates used to keep the results"""
+    hash_dict = defaultdict(list)
+    feature_dict = defaultdict(list)
+    for path, img_hash, features in results:
+        hash_dict[img_hash].append(path)
+        feature_dict[tuple(features)].append(path)
+    return hash_dict, feature_dict
+
+
+def catalog_store(results, dtype, chunk=1024):
+    catalog = Catalog(feature_dtype=dtype)
+    batch = []
+    for result in results:
+        batch.append(result)
+        if len(batch) == chunk:
+            catalog.add(batch)
+            batch = []
+    catalog.add(batch)
+    return catalog
+
+
+def measure(build):
+    """peak and retained bytes allocated while building a store"""
+    gc.collect()
+    tracemalloc.start()
+    store = build()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del store
+    return retained, peak
+
+
+def run(sizes, dim):
+    print(f"{'images':>8} {'store':<16} {'retained MB':>12} {'peak MB':>9} {'bytes/image':>12}")
+    stores = {
+        'dicts': lambda count: dict_store(make_results(count, dim)),
+        'catalog float32': lambda count: catalog_store(make_results(count, dim), np.float32),
+        'catalog float16': lambda count: catalog_store(make_results(count, dim), np.float16),
+    }
+    for count in sizes:
+        for name, build in stores.items():
+            retained, peak = measure(lambda: build(count))
+            print(f"{count:>8} {name:<16} {retained / 2**20:>12.1f} {peak / 2**20:>9.1f} {retained / count:>12.0f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the memory of the result stores.')
+    parser.add_argument('--images', type=int, nargs='+', default=[10000, 100000], help='Numbers of images.')
+    parser.add_argument('--dim', type=int, default=512, help='Feature dimension.')
+    args = parser.parse_args()
+    run(args.images, args.dim)
@@ -0,0 +1,177 @@
+"""end-to-end throughput, memory and accuracy of find_duplicate_ids on a synthetic corpus
+
+the corpus is written once per --corpus folder and seed (see write_corpus) and
+reused by later runs. every run prints a summary and appends one json line to
+--results, so the numbers can be compared between commits. the default
+'pixels' backend needs no model download, use --backend to measure a network
+
+run from the repository root:
+    python -m ImageRecognition.benchmarks.pipeline --images 1000 10000 --results benchmark_results.jsonl
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from multiprocessing import cpu_count
+from ImageRecognition.benchmarks.common import write_corpus
+from ImageRecognition.utils import instrumentation
+from ImageRecognition.utils.feature_index import DEFAULT_THRESHOLD
+from ImageRecognition.utils.find_duplicates import find_duplicate_ids
+from ImageRecognition.utils.hash_index import DEFAULT_MAX_DISTANCE
+from ImageRecognition.utils.worker_pool import FeatureExtractor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def load_corpus(folder, count, duplicate_ratio, seed):
+    """paths and truth groups of the corpus in folder, written first if it is missing or different"""
+    manifest = os.path.join(folder, 'manifest.json')
+    settings = {'count': count, 'duplicate_ratio': duplicate_ratio, 'seed': seed}
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            saved = json.load(f)
+        if saved['settings'] == settings:
+            return [os.path.join(folder, path) for path in saved['paths']], saved['groups']
+    start = time.perf_counter()
+    paths, groups = write_corpus(folder, count, duplicate_ratio, seed=seed)
+    print(f"Wrote {count} images in {time.perf_counter() - start:.1f}s to {folder}", file=sys.stderr)
+    with open(manifest, 'w') as f:
+        json.dump({'settings': settings, 'paths': [os.path.relpath(path, folder) for path in paths],
+                   'groups': groups}, f)
+    return paths, groups
+
+
+def _pairs(groups):
+    return {(a, b) for group in groups for a in group for b in group if a < b}
+
+
+def pair_scores(found, truth):
+    """precision and recall over the pairs of images placed in one group"""
+    found, truth = _pairs(found), _pairs(truth)
+    hits = len(found & truth)
+    return {
+        'pairs_found': len(found),
+        'pairs_true': len(truth),
+        'precision': hits / len(found) if found else 1.0,
+        'recall': hits / len(truth) if truth else 1.0,
+    }
+
+
+def recall_by_transform(found, truth):
+    """share of (original, copy) pairs found for every transformation in TRANSFORMS"""
+    found = _pairs(found)
+    totals, hits = {}, {}
+    for group in truth:
+        # the original comes first, the file names end in the transformation
+        original = group[0]
+        for copy in group[1:]:
+            name = os.path.splitext(os.path.basename(copy))[0].rpartition('_')[2]
+            totals[name] = totals.get(name, 0) + 1
+            hits[name] = hits.get(name, 0) + ((min(original, copy), max(original, copy)) in found)
+    return {name: hits[name] / totals[name] for name in sorted(totals)}
+
+
+def _max_rss_mb(who):
+    # linux reports kilobytes
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_once(paths, groups, backend, workers, feature_mode, hash_distance, feature_threshold):
+    """one scan of paths, returns the result record"""
+    truth = [[paths[i] for i in group if i < len(paths)] for group in groups]
+    truth = [group for group in truth if len(group) > 1]
+    instrumentation.enable()
+    start = time.perf_counter()
+    with FeatureExtractor(workers=workers, backend=backend) as extractor:
+        catalog, hash_groups, feature_groups = find_duplicate_ids(
+            paths, extractor=extractor, feature_mode=feature_mode,
+            hash_distance=hash_distance, feature_threshold=feature_threshold)
+    elapsed = time.perf_counter() - start
+    stats = instrumentation.snapshot()
+    instrumentation.disable()
+    hash_groups = [catalog.paths_of(group) for group in hash_groups]
+    feature_groups = [catalog.paths_of(group) for group in feature_groups]
+    return {
+        'images': len(paths),
+        'seconds': elapsed,
+        'images_per_sec': len(paths) / elapsed,
+        # the workers are joined by now, so their peak is in RUSAGE_CHILDREN
+        'peak_rss_mb': _max_rss_mb(resource.RUSAGE_SELF),
+        'worker_peak_rss_mb': _max_rss_mb(resource.RUSAGE_CHILDREN),
+        'stages': {name: {'calls': timer['calls'], 'seconds': timer['seconds'],
+                          'mean_ms': 1000 * timer['seconds'] / timer['calls'] if timer['calls'] else 0.0}
+                   for name, timer in stats['timers'].items()},
+        'counters': stats['counters'],
+        'accuracy': {
+            'hash': pair_scores(hash_groups, truth),
+            'feature': pair_scores(feature_groups, truth),
+            'either': pair_scores(hash_groups + feature_groups, truth),
+        },
+        'recall_by_transform': recall_by_transform(hash_groups + feature_groups, truth),
+    }
+
+
+def print_record(record):
+    accuracy = record['accuracy']
+    print(f"{record['images']:>7} images {record['seconds']:>8.2f}s {record['images_per_sec']:>8.1f} img/s "
+          f"rss {record['peak_rss_mb']:.0f} MB (workers {record['worker_peak_rss_mb']:.0f} MB)")
+    for kind, scores in accuracy.items():
+        print(f"        {kind:<8} precision {scores['precision']:.3f} recall {scores['recall']:.3f} "
+              f"({scores['pairs_found']} pairs found, {scores['pairs_true']} true)")
+    print('        recall by transformation: ' + ', '.join(
+        f"{name} {recall:.3f}" for name, recall in record['recall_by_transform'].items()))
+    for name, stage in sorted(record['stages'].items(), key=lambda item: -item[1]['seconds']):
+        print(f"        {name:<18} {stage['calls']:>8} calls {stage['seconds']:>8.2f}s {stage['mean_ms']:>9.2f} ms/call")
+
+
+def run(args):
+    folder = args.corpus or tempfile.mkdtemp(prefix='duplicates_corpus_')
+    paths, groups = load_corpus(folder, max(args.images), args.duplicate_ratio, args.seed)
+    for size in sorted(args.images):
+        record = run_once(paths[:size], groups, args.backend, args.workers, args.feature_mode,
+                          args.hash_distance, args.feature_threshold)
+        record.update({
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'cpus': cpu_count(),
+            'backend': args.backend,
+            'workers': args.workers,
+            'feature_mode': args.feature_mode,
+            'hash_distance': args.hash_distance,
+            'feature_threshold': args.feature_threshold,
+            'duplicate_ratio': args.duplicate_ratio,
+            'seed': args.seed,
+        })
+        print_record(record)
+        if args.results:
+            with open(args.results, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark duplicate detection on a synthetic corpus.')
+    parser.add_argument('--images', type=int, nargs='+', default=[1000], help='Corpus sizes to scan (1000 to 100000).')
+    parser.add_argument('--corpus', type=str, default=None, help='Folder to keep the corpus in between runs (default: a new temp folder).')
+    parser.add_argument('--duplicate-ratio', type=float, default=0.2, help='Share of originals that get near-duplicate copies.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the corpus.')
+    parser.add_argument('--backend', type=str, default='pixels', help='Embedding backend, see main.py --backend.')
+    parser.add_argument('--workers', type=int, default=cpu_count(), help='Number of worker processes.')
+    parser.add_argument('--feature-mode', choices=('exact', 'lsh'), default='exact', help='How features are compared.')
+    parser.add_argument('--hash-distance', type=int, default=DEFAULT_MAX_DISTANCE, help='Max Hamming distance between hashes of duplicates.')
+    parser.add_argument('--feature-threshold', type=float, default=DEFAULT_THRESHOLD, help='Min cosine similarity of duplicate features.')
+    parser.add_argument('--results', type=str, default=None, help='Append one json line per run to this file.')
+    run(parser.parse_args())
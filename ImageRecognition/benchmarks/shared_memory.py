@@ -0,0 +1,152 @@
+"""cost of moving decoded batches between processes, pickled through queues vs a shared memory ring
+
+the ipc part sends ready (batch, 224, 224, 3) float32 tensors from a producer
+to a consumer process and (batch, 512) embeddings back to the parent, with a
+trivial stand-in for the model, so only the transfer is measured. the end to
+end part runs FeatureExtractor and SharedMemoryExtractor on real files with
+the offline 'pixels' backend
+
+run from the repository root:
+    python -m ImageRecognition.benchmarks.shared_memory --batches 200 --images 2000
+"""
+import argparse
+import tempfile
+import time
+from multiprocessing import get_context, shared_memory
+import numpy as np
+from ImageRecognition.benchmarks.common import write_images
+from ImageRecognition.utils.shared_pipeline import SharedMemoryExtractor
+from ImageRecognition.utils.worker_pool import FeatureExtractor
+
+SHAPE = (224, 224, 3)
+DIM = 512
+
+
+def _embed(batch):
+    # stand-in for the model, reads every pixel once
+    return np.resize(batch.mean(axis=(1, 2)), (len(batch), DIM))
+
+
+def _pickled_producer(filled, batches, batch_size):
+    batch = np.random.default_rng(0).random((batch_size, *SHAPE), dtype=np.float32)
+    for _ in range(batches):
+        filled.put(batch)
+    filled.put(None)
+
+
+def _pickled_consumer(filled, results):
+    while (batch := filled.get()) is not None:
+        results.put(_embed(batch))
+    results.put(None)
+
+
+def _shared_producer(free, filled, name, shape, batches):
+    block = shared_memory.SharedMemory(name)
+    inputs = np.ndarray(shape, dtype=np.float32, buffer=block.buf)
+    batch = np.random.default_rng(0).random(shape[1:], dtype=np.float32)
+    for _ in range(batches):
+        slot = free.get()
+        # what a decoder does, one image after the other into the slot
+        inputs[slot] = batch
+        filled.put(slot)
+    filled.put(None)
+    del inputs
+    block.close()
+
+
+def _shared_consumer(filled, results, inputs_name, inputs_shape, outputs_name, outputs_shape):
+    input_block = shared_memory.SharedMemory(inputs_name)
+    output_block = shared_memory.SharedMemory(outputs_name)
+    inputs = np.ndarray(inputs_shape, dtype=np.float32, buffer=input_block.buf)
+    outputs = np.ndarray(outputs_shape, dtype=np.float32, buffer=output_block.buf)
+    while (slot := filled.get()) is not None:
+        outputs[slot] = _embed(inputs[slot])
+        results.put(slot)
+    results.put(None)
+    del inputs, outputs
+    input_block.close()
+    output_block.close()
+
+
+def pickled(batches, batch_size):
+    context = get_context('spawn')
+    filled, results = context.Queue(4), context.Queue()
+    processes = [context.Process(target=_pickled_producer, args=(filled, batches, batch_size)),
+                 context.Process(target=_pickled_consumer, args=(filled, results))]
+    for process in processes:
+        process.start()
+    # timed from the first batch on, so starting the processes is left out
+    results.get()
+    start = time.perf_counter()
+    while results.get() is not None:
+        pass
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.join()
+    return elapsed
+
+
+def shared(batches, batch_size, slots=4):
+    context = get_context('spawn')
+    inputs_shape, outputs_shape = (slots, batch_size, *SHAPE), (slots, batch_size, DIM)
+    blocks = [shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 4)
+              for shape in (inputs_shape, outputs_shape)]
+    outputs = np.ndarray(outputs_shape, dtype=np.float32, buffer=blocks[1].buf)
+    free, filled, results = context.Queue(), context.Queue(), context.Queue()
+    for slot in range(slots):
+        free.put(slot)
+    processes = [
+        context.Process(target=_shared_producer, args=(free, filled, blocks[0].name, inputs_shape, batches)),
+        context.Process(target=_shared_consumer,
+                        args=(filled, results, blocks[0].name, inputs_shape, blocks[1].name, outputs_shape)),
+    ]
+    for process in processes:
+        process.start()
+    slot = results.get()
+    start = time.perf_counter()
+    while slot is not None:
+        outputs[slot].copy()
+        free.put(slot)
+        slot = results.get()
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.join()
+    del outputs
+    for block in blocks:
+        block.close()
+        block.unlink()
+    return elapsed
+
+
+def end_to_end(count, workers):
+    with tempfile.TemporaryDirectory() as folder:
+        paths = write_images(folder, count)
+        for name, extractor in (('pickled', FeatureExtractor(workers=workers, backend='pixels')),
+                                ('shared memory', SharedMemoryExtractor(workers=workers, backend='pixels'))):
+            with extractor:
+                # the first call pays for starting the processes and loading the model
+                list(extractor.map(paths[:extractor.batch_size]))
+                start = time.perf_counter()
+                assert len(list(extractor.map(paths))) == count
+                elapsed = time.perf_counter() - start
+            print(f"{name:>14} {count:>8} images {elapsed:>8.2f}s {count / elapsed:>9.1f} img/s")
+
+
+def run(batches, batch_size, images, workers):
+    megabytes = (batches - 1) * batch_size * np.prod(SHAPE) * 4 / 2**20
+    print(f"{'transfer':>14} {'batches':>8} {'seconds':>9} {'ms/batch':>9} {'MB/s':>8}")
+    for name, func in (('pickled', pickled), ('shared memory', shared)):
+        elapsed = func(batches, batch_size)
+        print(f"{name:>14} {batches:>8} {elapsed:>9.2f} {1000 * elapsed / (batches - 1):>9.2f} {megabytes / elapsed:>8.0f}")
+    if images:
+        end_to_end(images, workers)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark pickled vs shared memory transfer of decoded batches.')
+    parser.add_argument('--batches', type=int, default=200, help='Number of batches to transfer.')
+    parser.add_argument('--batch-size', type=int, default=32, help='Images per batch.')
+    parser.add_argument('--images', type=int, default=0, help='Also compare both extractors end to end on this many files.')
+    parser.add_argument('--workers', type=int, default=1, help='Worker (decoder) processes for the end to end comparison.')
+    args = parser.parse_args()
+    run(args.batches, args.batch_size, args.images, args.workers)
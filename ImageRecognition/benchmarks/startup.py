@@ -0,0 +1,74 @@
+"""import time of the cli and the gui modules, tracked with python -X importtime
+
+exits with status 1 when a heavy framework is imported at startup or the
+total import time is over budget, so it can run as a regression check
+
+run from the repository root:
+    python -m ImageRecognition.benchmarks.startup --budget-ms 1500
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# frameworks that must only be imported once extraction or display starts
+HEAVY_MODULES = ('tensorflow', 'keras', 'matplotlib')
+
+# name -> (command, working directory)
+TARGETS = {
+    'main.py --help': ([sys.executable, '-X', 'importtime', 'main.py', '--help'], os.path.join(ROOT, 'ImageRecognition')),
+    'import pipeline': ([sys.executable, '-X', 'importtime', '-c',
+                         'import ImageRecognition.image_processing, ImageRecognition.utils.find_duplicates, ImageRecognition.model'], ROOT),
+    'import gui': ([sys.executable, '-X', 'importtime', '-c', 'import ImageRecognition.gui'], ROOT),
+}
+
+
+def import_times(command, cwd):
+    """(total microseconds, {module: cumulative microseconds}) of one run, None if it failed"""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    process = subprocess.run(command, cwd=cwd, env=env, capture_output=True, text=True)
+    if process.returncode != 0:
+        return None
+    stderr = process.stderr
+    modules = {}
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(cumulative)
+        # top level imports are not indented
+        if not name.startswith('  '):
+            total += int(cumulative)
+    return total, modules
+
+
+def run(budget_ms, top):
+    failed = False
+    for target, (command, cwd) in TARGETS.items():
+        measured = import_times(command, cwd)
+        if measured is None:
+            print(f"{target}: could not be measured (missing dependency?)")
+            continue
+        total, modules = measured
+        heavy = sorted({name.split('.')[0] for name in modules if name.split('.')[0] in HEAVY_MODULES})
+        print(f"{target}: {total / 1000:.0f} ms")
+        for name, cumulative in sorted(modules.items(), key=lambda item: -item[1])[:top]:
+            print(f"    {cumulative / 1000:8.1f} ms  {name.strip()}")
+        if heavy:
+            print(f"    heavy modules imported at startup: {', '.join(heavy)}")
+            failed = True
+        if budget_ms and total / 1000 > budget_ms:
+            print(f"    over the budget of {budget_ms} ms")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure startup import time.')
+    parser.add_argument('--budget-ms', type=float, default=None, help='Fail if a target takes longer to import.')
+    parser.add_argument('--top', type=int, default=5, help='Number of slowest modules to list per target.')
+    args = parser.parse_args()
+    sys.exit(run(args.budget_ms, args.top))
@@ -0,0 +1,80 @@
+"""directory traversal speed, the single-threaded iter_images against the parallel Scanner
+
+builds a tree of --entries files (1M by default) spread over --roots roots,
+`--fanout` files and a few subfolders per directory. a fifth of the files
+start with image magic bytes, half of those without an image extension. the
+tree is kept in --tree between runs since writing a million files is slow
+
+run from the repository root:
+    python -m ImageRecognition.benchmarks.traversal --entries 1000000 --tree /tmp/traversal_tree
+"""
+import argparse
+import os
+import tempfile
+import time
+from ImageRecognition.image_processing.load_images import iter_images
+from ImageRecognition.image_processing.scanner import Scanner
+
+PNG_HEADER = b'\x89PNG\r\n\x1a\n' + bytes(8)
+
+
+def build_tree(folder, entries, roots, fanout, subfolders=4):
+    """write the tree unless a complete one is already there, returns the roots"""
+    marker = os.path.join(folder, f'.complete-{entries}-{roots}-{fanout}')
+    root_paths = [os.path.join(folder, f'root{i}') for i in range(roots)]
+    if os.path.exists(marker):
+        return root_paths
+    start = time.perf_counter()
+    written = 0
+    # breadth first, so every root gets a deep tree of about the same size
+    pending = list(root_paths)
+    per_root = entries // roots
+    counts = {root: 0 for root in root_paths}
+    while pending:
+        current = pending.pop(0)
+        root = next(root for root in root_paths if current.startswith(root))
+        os.makedirs(current, exist_ok=True)
+        for i in range(min(fanout, per_root - counts[root])):
+            number = written + i
+            if number % 5 == 0:
+                # an image, every second one with a misleading name
+                name = f'img{number}.png' if number % 10 == 0 else f'img{number}.bin'
+                content = PNG_HEADER
+            else:
+                name, content = f'doc{number}.txt', b'text'
+            with open(os.path.join(current, name), 'wb') as f:
+                f.write(content)
+        done = min(fanout, per_root - counts[root])
+        counts[root] += done
+        written += done
+        if counts[root] < per_root:
+            pending.extend(os.path.join(current, f'd{i}') for i in range(subfolders))
+    open(marker, 'w').close()
+    print(f"Wrote {written} files in {time.perf_counter() - start:.0f}s")
+    return root_paths
+
+
+def run(entries, roots, fanout, tree, workers):
+    folder = tree or tempfile.mkdtemp(prefix='traversal_')
+    root_paths = build_tree(folder, entries, roots, fanout)
+    modes = [('iter_images (extension)', lambda: (record for root in root_paths for record in iter_images(root)))]
+    for count in workers:
+        modes.append((f'scanner {count} threads (extension)', lambda count=count: Scanner(root_paths, sniff=False, workers=count).scan()))
+        modes.append((f'scanner {count} threads (magic bytes)', lambda count=count: Scanner(root_paths, workers=count).scan()))
+    print(f"{'mode':<36} {'images':>9} {'seconds':>9} {'entries/sec':>12}")
+    for name, scan in modes:
+        start = time.perf_counter()
+        found = sum(1 for _ in scan())
+        elapsed = time.perf_counter() - start
+        print(f"{name:<36} {found:>9} {elapsed:>9.2f} {entries / elapsed:>12.0f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark directory traversal on a large tree.')
+    parser.add_argument('--entries', type=int, default=1000000, help='Number of files in the tree.')
+    parser.add_argument('--roots', type=int, default=4, help='Number of roots the files are spread over.')
+    parser.add_argument('--fanout', type=int, default=200, help='Files per directory.')
+    parser.add_argument('--tree', type=str, default=None, help='Folder to keep the tree in between runs (default: a new temp folder).')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 8], help='Scanner thread counts to measure.')
+    args = parser.parse_args()
+    run(args.entries, args.roots, args.fanout, args.tree, args.workers)
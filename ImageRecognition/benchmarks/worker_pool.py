@@ -0,0 +1,54 @@
+"""per-batch Pool (old behaviour) vs the persistent FeatureExtractor
+
+run from the repository root:
+    python -m ImageRecognition.benchmarks.worker_pool --sizes 1000 10000 50000
+"""
+import argparse
+import tempfile
+import time
+from multiprocessing import Pool, cpu_count
+from ImageRecognition.benchmarks.common import write_images
+from ImageRecognition.image_processing.hash_images import process_image
+from ImageRecognition.model.model import initialize_model
+from ImageRecognition.utils.worker_pool import FeatureExtractor
+
+
+def per_batch_pool(paths, workers, batch_size=64):
+    """old find_duplicates loop - a new pool (and model load) for every 64 images"""
+    results = []
+    for i in range(0, len(paths), batch_size):
+        with Pool(workers, initializer=initialize_model) as pool:
+            results.extend(pool.map(process_image, paths[i:i+batch_size]))
+    return results
+
+
+def persistent_pool(paths, workers, threads):
+    with FeatureExtractor(workers=workers, threads_per_worker=threads) as extractor:
+        return list(extractor.map(paths))
+
+
+def run(sizes, workers, threads, skip_old):
+    print(f"{'images':>7} {'mode':>11} {'seconds':>9} {'images/sec':>11}")
+    with tempfile.TemporaryDirectory() as folder:
+        all_paths = write_images(folder, max(sizes))
+        for size in sizes:
+            paths = all_paths[:size]
+            modes = [('persistent', lambda: persistent_pool(paths, workers, threads))]
+            if not skip_old:
+                modes.insert(0, ('per-batch', lambda: per_batch_pool(paths, workers)))
+            for name, func in modes:
+                start = time.perf_counter()
+                results = func()
+                elapsed = time.perf_counter() - start
+                assert len(results) == size
+                print(f"{size:>7} {name:>11} {elapsed:>9.2f} {size / elapsed:>11.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the persistent worker pool.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000], help='Numbers of images to process.')
+    parser.add_argument('--workers', type=int, default=cpu_count(), help='Number of worker processes.')
+    parser.add_argument('--threads', type=int, default=None, help='Intra-op threads per worker.')
+    parser.add_argument('--skip-old', action='store_true', help='Only measure the persistent pool.')
+    args = parser.parse_args()
+    run(args.sizes, args.workers, args.threads, args.skip_old)
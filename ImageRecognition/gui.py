@@ -1,9 +1,14 @@
 import sys
-from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QPushButton, QLabel, QVBoxLayout, QWidget, QListWidget, QMessageBox, QHBoxLayout
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QPixmap
-from ImageRecognition.image_processing.load_images import load_images_from_folder
-from ImageRecognition.utils.find_duplicates import find_duplicates
+import time
+import threading
+from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QPushButton, QLabel, QVBoxLayout, QWidget, QListView, QMessageBox, QHBoxLayout, QProgressBar, QScrollArea, QGridLayout, QListWidget
+from PyQt5.QtCore import Qt, QThread, pyqtSignal, QAbstractListModel, QModelIndex
+from PyQt5.QtGui import QPixmap, QImage
+from ImageRecognition.image_processing.scanner import scan_images
+from ImageRecognition.utils.cache import FeatureCache
+from ImageRecognition.utils.find_duplicates import find_duplicates, ScanCancelled
+from ImageRecognition.utils.thumbnails import ThumbnailCache, DEFAULT_THUMBNAIL_DIR
+from ImageRecognition.utils.worker_pool import FeatureExtractor
 
 # css stylesheet to make the app look little better
 STYLESHEET = """
@@ -28,7 +33,7 @@ STYLESHEET = """
     QPushButton:pressed {
         background-color: #81a1c1;
     }
-    QListWidget {
+    QListView {
         background-color: #3b4252;
         color: #d8dee9;
         border: 1px solid #d8dee9;
@@ -36,12 +41,78 @@ STYLESHEET = """
     }
 """
 
+def to_pixmap(thumbnail):
+    """QPixmap of an rgb PIL image"""
+    data = thumbnail.tobytes()
+    image = QImage(data, thumbnail.width, thumbnail.height, 3 * thumbnail.width, QImage.Format_RGB888)
+    # QImage does not own `data`, copy before it goes away
+    return QPixmap.fromImage(image.copy())
+
+class GroupListModel(QAbstractListModel):
+    """duplicate groups for a QListView, one line per group so huge lists stay fast"""
+
+    def __init__(self):
+        super().__init__()
+        self.groups = []
+        self.keys = []
+        self.rows = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.groups)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        kind, paths = self.groups[index.row()]
+        if role == Qt.DisplayRole:
+            return f"{kind}: {len(paths)} images - {paths[0]}"
+        if role == Qt.ToolTipRole:
+            return "\n".join(paths)
+        return None
+
+    def clear(self):
+        self.beginResetModel()
+        self.groups, self.keys, self.rows = [], [], {}
+        self.endResetModel()
+
+    def set_group(self, key, kind, paths):
+        """add a group or replace the paths of a known one"""
+        row = self.rows.get(key)
+        if row is None:
+            row = len(self.groups)
+            self.beginInsertRows(QModelIndex(), row, row)
+            self.groups.append((kind, paths))
+            self.keys.append(key)
+            self.rows[key] = row
+            self.endInsertRows()
+        else:
+            self.groups[row] = (kind, paths)
+            self.dataChanged.emit(self.index(row), self.index(row))
+
+    def remove_group(self, key):
+        """remove a group in constant time, the last group takes its row"""
+        row = self.rows.pop(key, None)
+        if row is None:
+            return
+        last = len(self.groups) - 1
+        if row != last:
+            # deleting from the middle would renumber every later row
+            self.groups[row] = self.groups[last]
+            self.keys[row] = self.keys[last]
+            self.rows[self.keys[row]] = row
+            self.dataChanged.emit(self.index(row), self.index(row))
+        self.beginRemoveRows(QModelIndex(), last, last)
+        self.groups.pop()
+        self.keys.pop()
+        self.endRemoveRows()
+
 class DuplicateViewer(QMainWindow):
-    def __init__(self, duplicates):
+    def __init__(self, duplicates, thumbnails, index=0):
         super().__init__()
         self.setStyleSheet(STYLESHEET)
         self.duplicates = duplicates
-        self.index = 0
+        self.thumbnails = thumbnails
+        self.index = index
 
         self.initUI()
 
@@ -55,12 +126,10 @@ class DuplicateViewer(QMainWindow):
 
         layout = QVBoxLayout(central_widget)
 
-        self.image_label1 = QLabel(self)
-        self.image_label2 = QLabel(self)
-
-        # center the image labels
-        self.image_label1.setAlignment(Qt.AlignCenter)
-        self.image_label2.setAlignment(Qt.AlignCenter)
+        # every member of the group, in a grid that scrolls for big groups
+        self.scroll_area = QScrollArea(self)
+        self.scroll_area.setWidgetResizable(True)
+        self.title_label = QLabel(self)
 
         btn_layout = QHBoxLayout()
 
@@ -74,47 +143,108 @@ class DuplicateViewer(QMainWindow):
         btn_layout.addWidget(self.btn_prev)
         btn_layout.addWidget(self.btn_next)
 
-        layout.addWidget(self.image_label1)
-        layout.addWidget(self.image_label2)
+        layout.addWidget(self.title_label)
+        layout.addWidget(self.scroll_area)
         layout.addLayout(btn_layout)
 
         self.show_images()
 
     def show_images(self):
-        # display current pair of duplicate images
+        # display every image of the current group
         if not self.duplicates:
             return
 
         # wrap around the index if out of bounds
-        if self.index < 0:
-            self.index = len(self.duplicates) - 1
-        elif self.index >= len(self.duplicates):
-            self.index = 0
-
-        dup_pair = self.duplicates[self.index]
-        pixmap1 = QPixmap(dup_pair[0])
-        pixmap2 = QPixmap(dup_pair[1])
-
-        # scale images to fit the labels
-        self.image_label1.setPixmap(pixmap1.scaled(350, 350, Qt.KeepAspectRatio))
-        self.image_label2.setPixmap(pixmap2.scaled(350, 350, Qt.KeepAspectRatio))
+        self.index %= len(self.duplicates)
+        group = self.duplicates[self.index]
+        self.title_label.setText(f'Group {self.index + 1} of {len(self.duplicates)}, {len(group)} images')
+
+        grid_widget = QWidget()
+        grid = QGridLayout(grid_widget)
+        columns = 2
+        for i, path in enumerate(group):
+            label = QLabel()
+            label.setAlignment(Qt.AlignCenter)
+            thumbnail = self.thumbnails.get(path)
+            if thumbnail is None:
+                label.setText(f'Can not open\n{path}')
+            else:
+                label.setPixmap(to_pixmap(thumbnail))
+                label.setToolTip(path)
+            grid.addWidget(label, i // columns, i % columns)
+        self.scroll_area.setWidget(grid_widget)
+
+        # decode the neighbouring groups while the user looks at this one
+        for step in (1, -1):
+            self.thumbnails.prefetch(self.duplicates[(self.index + step) % len(self.duplicates)])
 
     def show_previous(self):
-        # show the previous pair
+        # show the previous group
         self.index -= 1
         self.show_images()
 
     def show_next(self):
-        # show the next pair
+        # show the next group
         self.index += 1
         self.show_images()
 
+class ScanWorker(QThread):
+    """runs find_duplicates off the gui thread and reports back through signals"""
+
+    # done, total, images per second, seconds left
+    progress = pyqtSignal(int, int, float, float)
+    # kind, group id, paths, ids of groups merged into it
+    group_found = pyqtSignal(str, int, list, list)
+    scan_finished = pyqtSignal(list, list)
+    scan_cancelled = pyqtSignal()
+    scan_failed = pyqtSignal(str)
+
+    def __init__(self, folders, extractor):
+        super().__init__()
+        self.folders = folders
+        self.extractor = extractor
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        try:
+            # walking is cheap compared to the model and gives the total for the eta
+            images = list(scan_images(self.folders))
+            start = time.perf_counter()
+
+            def report(done):
+                rate = done / max(time.perf_counter() - start, 1e-6)
+                self.progress.emit(done, len(images), rate, (len(images) - done) / rate)
+
+            self.progress.emit(0, len(images), 0.0, 0.0)
+            # unchanged files come from the cache
+            with FeatureCache() as cache:
+                hash_duplicates, feature_duplicates = find_duplicates(
+                    images, extractor=self.extractor, cache=cache,
+                    progress=report, on_group=self.group_found.emit, cancel=self.cancel_event,
+                )
+                cache.cleanup(self.folders)
+        except ScanCancelled:
+            self.scan_cancelled.emit()
+        except Exception as e:
+            self.scan_failed.emit(str(e))
+        else:
+            self.scan_finished.emit(hash_duplicates, feature_duplicates)
+
 class ImageDuplicateFinderGUI(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setStyleSheet(STYLESHEET)
+        # thumbnails are shared by every viewer window and kept on disk between runs
+        self.thumbnails = ThumbnailCache(disk_dir=DEFAULT_THUMBNAIL_DIR)
         self.initUI()
 
+        # load the model in the background while the user picks folders
+        self.extractor = FeatureExtractor()
+        threading.Thread(target=self.extractor.start, daemon=True).start()
+
     def initUI(self):
         # setting up the main window
         self.setWindowTitle('Image Duplicate Finder')
@@ -126,87 +256,138 @@ class ImageDuplicateFinderGUI(QMainWindow):
         layout = QVBoxLayout(central_widget)
 
         # create labels and buttons
-        self.label1 = QLabel('Selected Folder 1: None', self)
-        self.label2 = QLabel('Selected Folder 2: None', self)
+        self.folder_label = QLabel('Folders (searched recursively):', self)
+        self.folder_list = QListWidget(self)
 
-        self.btn_select_folder1 = QPushButton('Select Folder 1', self)
-        self.btn_select_folder1.clicked.connect(self.select_folder1)
+        self.btn_add_folder = QPushButton('Add Folder', self)
+        self.btn_add_folder.clicked.connect(self.add_folder)
 
-        self.btn_select_folder2 = QPushButton('Select Folder 2', self)
-        self.btn_select_folder2.clicked.connect(self.select_folder2)
+        self.btn_remove_folder = QPushButton('Remove Folder', self)
+        self.btn_remove_folder.clicked.connect(self.remove_folder)
 
         self.btn_find_duplicates = QPushButton('Find Duplicates', self)
         self.btn_find_duplicates.clicked.connect(self.find_duplicates)
 
-        self.result_list = QListWidget(self)
+        self.btn_cancel = QPushButton('Cancel', self)
+        self.btn_cancel.clicked.connect(self.cancel_scan)
+        self.btn_cancel.setEnabled(False)
+
+        self.progress_bar = QProgressBar(self)
+        self.status_label = QLabel('', self)
+
+        # a model/view list only creates rows that are visible
+        self.groups = GroupListModel()
+        self.result_list = QListView(self)
+        self.result_list.setModel(self.groups)
+        self.result_list.setUniformItemSizes(True)
+        self.result_list.doubleClicked.connect(self.open_group)
 
         # add widgets to the layout
-        layout.addWidget(self.label1)
-        layout.addWidget(self.btn_select_folder1)
-        layout.addWidget(self.label2)
-        layout.addWidget(self.btn_select_folder2)
-        layout.addWidget(self.btn_find_duplicates)
+        layout.addWidget(self.folder_label)
+        layout.addWidget(self.folder_list)
+        folder_layout = QHBoxLayout()
+        folder_layout.addWidget(self.btn_add_folder)
+        folder_layout.addWidget(self.btn_remove_folder)
+        layout.addLayout(folder_layout)
+        scan_layout = QHBoxLayout()
+        scan_layout.addWidget(self.btn_find_duplicates)
+        scan_layout.addWidget(self.btn_cancel)
+        layout.addLayout(scan_layout)
+        layout.addWidget(self.progress_bar)
+        layout.addWidget(self.status_label)
         layout.addWidget(self.result_list)
 
-        self.folder1 = None
-        self.folder2 = None
+        self.folders = []
+        self.scan_worker = None
 
-    def select_folder1(self):
-        # open a dialog to select folder 1
-        folder = QFileDialog.getExistingDirectory(self, 'Select Folder 1')
-        if folder:
-            self.folder1 = folder
-            self.label1.setText(f'Selected Folder 1: {folder}')
+    def add_folder(self):
+        # any number of folders, nested or on different drives
+        folder = QFileDialog.getExistingDirectory(self, 'Add Folder')
+        if folder and folder not in self.folders:
+            self.folders.append(folder)
+            self.folder_list.addItem(folder)
 
-    def select_folder2(self):
-        # open a dialog to select folder 2
-        folder = QFileDialog.getExistingDirectory(self, 'Select Folder 2')
-        if folder:
-            self.folder2 = folder
-            self.label2.setText(f'Selected Folder 2: {folder}')
+    def remove_folder(self):
+        row = self.folder_list.currentRow()
+        if row >= 0:
+            self.folder_list.takeItem(row)
+            del self.folders[row]
 
     def find_duplicates(self):
         # check if at least one folder is selected
-        if not self.folder1:
+        if not self.folders:
             QMessageBox.warning(self, 'Error', 'Please select at least one folder.')
             return
 
-        # load images from the selected folders
-        images1 = load_images_from_folder(self.folder1)
-        all_images = images1
-
-        if self.folder2:
-            images2 = load_images_from_folder(self.folder2)
-            all_images += images2
+        self.groups.clear()
+        self.btn_find_duplicates.setEnabled(False)
+        self.btn_cancel.setEnabled(True)
+        self.status_label.setText('Walking folders...')
+
+        # scan in the background so the window stays responsive
+        self.scan_worker = ScanWorker(list(self.folders), self.extractor)
+        self.scan_worker.progress.connect(self.show_progress)
+        self.scan_worker.group_found.connect(self.show_group)
+        self.scan_worker.scan_finished.connect(self.scan_finished)
+        self.scan_worker.scan_cancelled.connect(lambda: self.scan_stopped('Scan cancelled.'))
+        self.scan_worker.scan_failed.connect(lambda error: self.scan_stopped(f'Scan failed: {error}'))
+        self.scan_worker.start()
+
+    def cancel_scan(self):
+        # the worker stops after the chunk it is waiting for
+        if self.scan_worker is not None:
+            self.scan_worker.cancel()
+            self.btn_cancel.setEnabled(False)
+            self.status_label.setText('Cancelling...')
+
+    def show_progress(self, done, total, rate, eta):
+        self.progress_bar.setMaximum(max(total, 1))
+        self.progress_bar.setValue(done)
+        if done:
+            self.status_label.setText(f'{done} / {total} images, {rate:.1f} images/s, {eta:.0f} s left')
+        else:
+            self.status_label.setText(f'{total} images found, loading the model...')
 
-        # find duplicates using hash and feature methods
-        hash_duplicates, feature_duplicates = find_duplicates(all_images)
+    def show_group(self, kind, group, paths, absorbed):
+        # groups grow while the scan runs, merged groups are replaced by the new one
+        for old in absorbed:
+            self.groups.remove_group((kind, old))
+        self.groups.set_group((kind, group), kind, paths)
 
-        self.result_list.clear()
+    def scan_finished(self, hash_duplicates, feature_duplicates):
+        self.scan_stopped(f'Found {len(hash_duplicates)} hash and {len(feature_duplicates)} feature duplicate groups.')
 
-        # display found hash duplicates
+        # display found hash duplicates, feature duplicates can be opened from the list
         if hash_duplicates:
-            self.result_list.addItem("Found hash duplicates:")
-            for dup in hash_duplicates:
-                self.result_list.addItem("\n".join(dup))
             self.show_duplicates(hash_duplicates)
-        else:
-            self.result_list.addItem("No hash duplicates found.")
-
-        # display found feature duplicates
-        if feature_duplicates:
-            self.result_list.addItem("Found feature duplicates:")
-            for dup in feature_duplicates:
-                self.result_list.addItem("\n".join(dup))
+        elif feature_duplicates:
             self.show_duplicates(feature_duplicates)
-        else:
-            self.result_list.addItem("No feature duplicates found.")
 
-    def show_duplicates(self, duplicates):
+    def scan_stopped(self, message):
+        self.status_label.setText(message)
+        self.btn_find_duplicates.setEnabled(True)
+        self.btn_cancel.setEnabled(False)
+        self.scan_worker = None
+
+    def show_duplicates(self, duplicates, index=0):
         # open the duplicate viewer window
-        self.viewer = DuplicateViewer(duplicates)
+        self.viewer = DuplicateViewer(duplicates, self.thumbnails, index)
         self.viewer.show()
 
+    def open_group(self, index):
+        # browse all groups of the list, starting with the clicked one
+        self.show_duplicates([paths for _, paths in self.groups.groups], index.row())
+
+    def closeEvent(self, event):
+        # the scan leaves extractor.map within one poll once cancelled, even
+        # while the workers still load the model, only then are they stopped
+        if self.scan_worker is not None:
+            self.scan_worker.cancel()
+            self.scan_worker.wait()
+        self.extractor.terminate()
+        self.thumbnails.close()
+        super().closeEvent(event)
+
 def main():
     app = QApplication(sys.argv)
     ex = ImageDuplicateFinderGUI()
@@ -1,4 +1,6 @@
-from ImageRecognition.image_processing.load_images import load_images_from_folder
-from ImageRecognition.image_processing.features import image_to_feature_vector
-from ImageRecognition.image_processing.hash_images import process_image
+from ImageRecognition.image_processing.decode import decode_image
+from ImageRecognition.image_processing.load_images import load_images_from_folder, iter_images, ImageRecord
+from ImageRecognition.image_processing.scanner import Scanner, scan_images, sniff_format
+from ImageRecognition.image_processing.features import image_to_feature_vector, images_to_feature_matrix
+from ImageRecognition.image_processing.hash_images import process_image, process_images, hash_image
 from ImageRecognition.image_processing.display import display_duplicates
\ No newline at end of file
@@ -0,0 +1,35 @@
+import os
+from PIL import Image
+from ImageRecognition.utils import instrumentation
+
+# the model input is the largest size any consumer of the decoded image needs
+DECODE_SIZE = (224, 224)
+
+# modes reduce() works on, palette, 1-bit and 16-bit images are converted first
+REDUCIBLE_MODES = ('RGB', 'RGBA', 'L')
+
+def decode_image(img_path, size=DECODE_SIZE):
+    """decode an image once, straight to a small rgb image not smaller than `size`
+
+    jpegs are decoded with draft mode, which lets the decoder scale by 1/2,
+    1/4 or 1/8 while decoding, other formats are shrunk with reduce(). the
+    result feeds both the hash and the model
+    """
+    if instrumentation.enabled():
+        instrumentation.count('bytes read', os.path.getsize(img_path))
+    with instrumentation.stage('decode'), Image.open(img_path) as img:
+        # only has an effect on jpegs, picks the largest scale that stays >= size
+        img.draft('RGB', size)
+        factor = min(img.width // size[0], img.height // size[1])
+        if factor >= 2:
+            if img.mode not in REDUCIBLE_MODES:
+                img = img.convert('RGB')
+            # fast box downscale by an integer factor, still >= size
+            small = img.reduce(factor)
+        else:
+            img.load()
+            small = img
+        if small.mode != 'RGB':
+            small = small.convert('RGB')
+        # detach from the file so it can be closed
+        return small.copy() if small is img else small
@@ -1,10 +1,12 @@
 import os
 from PIL import Image
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import NavigationToolbar2Tk
 
 def display_duplicates(duplicates):
     """display the found duplicates"""
+    # matplotlib takes a noticeable time to import, so only load it when something is shown
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_tkagg import NavigationToolbar2Tk
+
     fig, axes = plt.subplots(1, 2, figsize=(15, 5))
     index = 0
     def update_display():
@@ -33,4 +35,4 @@ def display_duplicates(duplicates):
     NavigationToolbar2Tk.back = custom_back
 
     update_display()
-    plt.show()
\ No newline at end of file
+    plt.show()
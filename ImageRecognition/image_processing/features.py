@@ -1,19 +1,46 @@
 import numpy as np
-from tensorflow.keras.preprocessing import image
-from tensorflow.keras.applications.vgg16 import preprocess_input
-from ImageRecognition.model.model import get_model
+from PIL import Image
+from ImageRecognition.model.model import get_model, embedding_dim
+from ImageRecognition.utils import instrumentation
+
+# size of the model input and of the vgg16 feature vector
+INPUT_SIZE = (224, 224)
+FEATURE_DIM = 512
+# number of images sent to the model in one predict call
+DEFAULT_BATCH_SIZE = 32
+
+def image_to_array(img):
+    """resize an image (or a path to it) to a 224x224x3 float32 array"""
+    if isinstance(img, np.ndarray):
+        # already converted
+        return img
+    if isinstance(img, str):
+        with Image.open(img) as opened:
+            return image_to_array(opened)
+    # the model expects 3 channels, grayscale and rgba images are converted
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    # resize the image to 224x224 and convert it to an array
+    with instrumentation.stage('resize'):
+        return np.asarray(img.resize(INPUT_SIZE), dtype=np.float32)
+
+def images_to_feature_matrix(images, batch_size=DEFAULT_BATCH_SIZE):
+    """convert many images (paths or arrays) to an (N, dim) float32 feature matrix
+
+    dim is 512 for the default vgg16 backend, see ImageRecognition.model.backends
+    """
+    images = list(images)
+    if not images:
+        return np.empty((0, embedding_dim()), dtype=np.float32)
+    model = get_model()
+    features = np.empty((len(images), model.dim), dtype=np.float32)
+    for start in range(0, len(images), batch_size):
+        # stack the arrays into one (batch, 224, 224, 3) tensor
+        batch = np.stack([image_to_array(img) for img in images[start:start + batch_size]])
+        # one predict call per batch instead of one per image
+        features[start:start + len(batch)] = model.embed(batch)
+    return features
 
 def image_to_feature_vector(img):
     """convert an image to a feature vector using the model"""
-    # resize the image to 224x224
-    img = img.resize((224, 224))
-    # convert the image to an array
-    img_array = image.img_to_array(img)
-    # expand the dimensions to match the model input
-    img_array = np.expand_dims(img_array, axis=0)
-    # preprocess the image array
-    img_array = preprocess_input(img_array)
-    model = get_model()
-    # predict the features using the model
-    features = model.predict(img_array)
-    return features.flatten()
\ No newline at end of file
+    return images_to_feature_matrix([img], batch_size=1)[0]
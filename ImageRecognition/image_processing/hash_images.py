@@ -1,18 +1,62 @@
-from PIL import Image
 import imagehash
-from ImageRecognition.image_processing.features import image_to_feature_vector
+from ImageRecognition.utils import instrumentation
+from ImageRecognition.image_processing.decode import decode_image
+from ImageRecognition.image_processing.features import image_to_array, images_to_feature_matrix, image_to_feature_vector, DEFAULT_BATCH_SIZE
 
 def process_image(img_path):
     """process a single image - extract hash and features"""
     try:
-        # open the image
-        img = Image.open(img_path)
+        # decode the image once, close to the model input size
+        img = decode_image(img_path)
         # compute the image hash
-        img_hash = imagehash.average_hash(img)
+        with instrumentation.stage('hash'):
+            img_hash = imagehash.average_hash(img)
         # extract features using the model
         features = image_to_feature_vector(img)
+        instrumentation.count('images')
         return img_path, img_hash, features
     except Exception as e:
         # print error message if the image cannot be processed
         print(f"Error processing image {img_path}: {e}")
-        return img_path, None, None
\ No newline at end of file
+        instrumentation.count('errors')
+        return img_path, None, None
+
+def hash_image(img_path):
+    """compute only the average hash of an image, without the model"""
+    try:
+        img = decode_image(img_path)
+        with instrumentation.stage('hash'):
+            return img_path, imagehash.average_hash(img)
+    except Exception as e:
+        # print error message if the image cannot be processed
+        print(f"Error processing image {img_path}: {e}")
+        instrumentation.count('errors')
+        return img_path, None
+
+def process_images(img_paths, batch_size=DEFAULT_BATCH_SIZE):
+    """process many images - hash them one by one and extract features in batches"""
+    hashed = []
+    arrays = []
+    for img_path in img_paths:
+        try:
+            # one small decode feeds both the hash and the model
+            img = decode_image(img_path)
+            with instrumentation.stage('hash'):
+                img_hash = imagehash.average_hash(img)
+            arrays.append(image_to_array(img))
+            hashed.append((img_path, img_hash))
+        except Exception as e:
+            # print error message if the image cannot be processed
+            print(f"Error processing image {img_path}: {e}")
+            instrumentation.count('errors')
+            hashed.append((img_path, None))
+    instrumentation.count('images', len(arrays))
+    try:
+        # extract features for all images with batched predict calls
+        features = iter(images_to_feature_matrix(arrays, batch_size=batch_size))
+    except Exception as e:
+        print(f"Error extracting features: {e}")
+        instrumentation.count('errors', len(arrays))
+        features = iter([None] * len(arrays))
+    return [(path, img_hash, next(features) if img_hash is not None else None)
+            for path, img_hash in hashed]
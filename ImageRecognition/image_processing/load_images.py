@@ -1,18 +1,54 @@
 import os
+from collections import namedtuple
 from PIL import Image
+from ImageRecognition.utils import instrumentation
+
+IMAGE_EXTENSIONS = ('.jpeg', '.jpg', '.png', '.bmp', '.gif')
+
+# what the pipeline knows about a file before anything is decoded
+ImageRecord = namedtuple('ImageRecord', ['path', 'size', 'mtime_ns'])
+
+def iter_images(folder, recursive=True):
+    """walk the folder and yield an ImageRecord for every image file
+
+    nothing is opened here, the pixels are decoded later by the worker that
+    needs them, so memory and file handles do not grow with the folder size
+    """
+    stack = [folder]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            stack.append(entry.path)
+                    elif entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file():
+                        stat = entry.stat()
+                        instrumentation.count('files listed')
+                        yield ImageRecord(entry.path, stat.st_size, stat.st_mtime_ns)
+        except OSError as e:
+            # print error message if the folder cannot be read
+            print(f"Could not read folder {current}: {e}")
 
 def load_images_from_folder(folder):
-    """load images from the specified folder"""
+    """load images from the specified folder
+
+    opens every image up front, prefer iter_images for large folders
+    """
     images = []
-    for filename in os.listdir(folder):
+    with instrumentation.stage('load'):
+        filenames = os.listdir(folder)
+    for filename in filenames:
         # check if the file is an image
-        if filename.lower().endswith(('.jpeg', '.jpg', '.png', '.bmp', '.gif')):
+        if filename.lower().endswith(IMAGE_EXTENSIONS):
             img_path = os.path.join(folder, filename)
             try:
                 # try to open the image
-                img = Image.open(img_path)
+                with instrumentation.stage('load'):
+                    img = Image.open(img_path)
                 images.append((img, img_path))
             except (IOError, SyntaxError) as e:
                 # print error message if the image cannot be opened
                 print(f"Could not open image {img_path}: {e}")
-    return images
\ No newline at end of file
+    return images
@@ -0,0 +1,221 @@
+import os
+import re
+import queue
+import fnmatch
+import threading
+from ImageRecognition.image_processing.load_images import IMAGE_EXTENSIONS, ImageRecord
+from ImageRecognition.utils import instrumentation
+
+# leading bytes of the formats pillow can decode, webp is checked separately
+MAGIC_NUMBERS = (
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+    (b'II*\x00', 'tiff'),
+    (b'MM\x00*', 'tiff'),
+)
+
+# bytes read from every file to recognize its format
+SNIFF_BYTES = 12
+
+_DONE = object()
+
+
+def sniff_format(path):
+    """image format of a file from its first bytes, None if it is not an image"""
+    try:
+        # a raw descriptor, a buffered file object costs more than the read
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            head = os.read(fd, SNIFF_BYTES)
+        finally:
+            os.close(fd)
+    except OSError:
+        return None
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    for magic, name in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def _compile(patterns):
+    """one regex matching any of the globs, None for no globs"""
+    if not patterns:
+        return None
+    return re.compile('|'.join(f'(?:{fnmatch.translate(pattern)})' for pattern in patterns))
+
+
+class Scanner:
+    """walks any number of roots in parallel threads and streams ImageRecords
+
+    every directory is listed by one of `workers` threads, so deep trees and
+    separate mounts are read concurrently (os.scandir and stat release the
+    gil). images are recognized by their first bytes, not their extension,
+    unless sniff is False. a file or directory reached twice through hard
+    links, symlinks or overlapping roots is only reported once.
+
+    globs are matched against the file name and the path relative to its
+    root. `include` only applies to files, `exclude` also prunes directories.
+    records come in directory batches and in no particular order
+    """
+
+    def __init__(self, roots, include=(), exclude=(), sniff=True, follow_symlinks=True, workers=8, queue_size=256):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.include = _compile(include)
+        self.exclude = _compile(exclude)
+        self.sniff = sniff
+        self.follow_symlinks = follow_symlinks
+        self.workers = workers
+        self.queue_size = queue_size
+
+    def __iter__(self):
+        return self.scan()
+
+    def _matches(self, pattern, root, name, path):
+        # every path below a root starts with the root and a separator, the
+        # roots are normalized, only a filesystem root like / ends with one
+        start = len(root) if root.endswith(os.sep) else len(root) + 1
+        return pattern.match(name) is not None or pattern.match(path[start:]) is not None
+
+    def excluded(self, root, name, path):
+        """whether a file or folder below root is skipped by the exclude globs"""
+        return self.exclude is not None and self._matches(self.exclude, root, name, path)
+
+    def included(self, root, name, path):
+        """whether a file below root passes the include globs"""
+        return self.include is None or self._matches(self.include, root, name, path)
+
+    def is_image(self, name, path):
+        """whether a file is an image, by its first bytes or by its extension"""
+        if self.sniff:
+            return sniff_format(path) is not None
+        return name.lower().endswith(IMAGE_EXTENSIONS)
+
+    def _list(self, root, folder, seen, lock):
+        """image records and subfolders of one folder"""
+        found = []
+        folders = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if self.excluded(root, entry.name, entry.path):
+                    continue
+                try:
+                    # is_dir, is_file and is_symlink come with the listing, no stat needed
+                    if not self.follow_symlinks and entry.is_symlink():
+                        continue
+                    if entry.is_dir():
+                        folders.append(entry.path)
+                        continue
+                    if not entry.is_file():
+                        continue
+                    if not self.included(root, entry.name, entry.path):
+                        continue
+                    if not self.is_image(entry.name, entry.path):
+                        continue
+                    found.append((entry.path, entry.stat()))
+                except OSError:
+                    # broken symlink or removed while listing
+                    continue
+        records = []
+        # one lock per folder instead of one per file
+        with lock:
+            for path, stat in found:
+                key = (stat.st_dev, stat.st_ino)
+                if key not in seen:
+                    seen.add(key)
+                    records.append(ImageRecord(path, stat.st_size, stat.st_mtime_ns))
+        return records, folders
+
+    def scan(self):
+        """generator of ImageRecords, stops the threads when it is closed early"""
+        tasks = queue.Queue()
+        results = queue.Queue(self.queue_size)
+        stopped = threading.Event()
+        lock = threading.Lock()
+        # (st_dev, st_ino) of every file and folder seen so far
+        seen = set()
+        pending = 0
+
+        def identify(folders):
+            # (folder, (st_dev, st_ino)) pairs, stat runs before the lock is taken
+            keys = []
+            for folder in folders:
+                try:
+                    stat = os.stat(folder)
+                except OSError as e:
+                    print(f"Could not read folder {folder}: {e}")
+                    continue
+                keys.append((folder, (stat.st_dev, stat.st_ino)))
+            return keys
+
+        def add_folders(root, keys):
+            # called with the lock held
+            nonlocal pending
+            for folder, key in keys:
+                if key not in seen:
+                    seen.add(key)
+                    pending += 1
+                    tasks.put((root, folder))
+
+        def put(item):
+            # blocks while the consumer is behind, gives up once it stopped reading
+            while not stopped.is_set():
+                try:
+                    results.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
+
+        def work():
+            nonlocal pending
+            while True:
+                task = tasks.get()
+                if task is None:
+                    return
+                root, folder = task
+                records, folders = [], []
+                if not stopped.is_set():
+                    try:
+                        records, folders = self._list(root, folder, seen, lock)
+                    except OSError as e:
+                        print(f"Could not read folder {folder}: {e}")
+                if records:
+                    instrumentation.count('files listed', len(records))
+                    put(records)
+                keys = identify(folders)
+                with lock:
+                    add_folders(root, keys)
+                    pending -= 1
+                    finished = pending == 0
+                if finished:
+                    for _ in range(self.workers):
+                        tasks.put(None)
+                    put(_DONE)
+
+        with lock:
+            for root in self.roots:
+                add_folders(root, identify([root]))
+            if not pending:
+                return
+        threads = [threading.Thread(target=work, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                batch = results.get()
+                if batch is _DONE:
+                    break
+                yield from batch
+        finally:
+            stopped.set()
+            for thread in threads:
+                thread.join()
+
+
+def scan_images(roots, include=(), exclude=(), sniff=True, follow_symlinks=True, workers=8):
+    """stream an ImageRecord for every image below any of the roots, see Scanner"""
+    return Scanner(roots, include, exclude, sniff, follow_symlinks, workers).scan()
@@ -1,37 +1,256 @@
 import argparse
-from image_processing.load_images import load_images_from_folder
-from utils.find_duplicates import find_duplicates
-from image_processing.display import display_duplicates
-
-def main(folder1, folder2=None):
-    images1 = load_images_from_folder(folder1)
-    if folder2:
-        images2 = load_images_from_folder(folder2)
-        all_images = images1 + images2
+import contextlib
+import itertools
+import os
+import signal
+import sys
+from ImageRecognition.image_processing.scanner import scan_images
+from ImageRecognition.utils.cache import FeatureCache, DEFAULT_CACHE_PATH, DEFAULT_CHECKPOINT_INTERVAL
+from ImageRecognition.utils.embedding_store import EmbeddingStore
+from ImageRecognition.utils.feature_index import DEFAULT_THRESHOLD
+from ImageRecognition.utils.find_duplicates import find_duplicate_ids, find_duplicate_ids_cascade, extract_features
+from ImageRecognition.utils.hash_index import DEFAULT_MAX_DISTANCE
+from ImageRecognition.utils import instrumentation
+from ImageRecognition.utils.worker_pool import FeatureExtractor, DEFAULT_TASK_TIMEOUT
+from ImageRecognition.utils.catalog import Catalog
+from ImageRecognition.utils.report import (REPORT_FORMATS, open_report, catalog_records, match_records, group_record,
+                                           GroupStream)
+from ImageRecognition.utils.watch import DuplicateWatcher
+from ImageRecognition.image_processing.display import display_duplicates
+from ImageRecognition.model.backends import create_backend
+from ImageRecognition.model.model import DEFAULT_BACKEND
+
+def print_stage_stats(stats, file=sys.stdout):
+    """print how many images every cascade stage settled and how long it took"""
+    print(f"{'stage':<16} {'images':>8} {'resolved':>9} {'seconds':>9}", file=file)
+    for stage in stats:
+        print(f"{stage.name:<16} {stage.images:>8} {stage.resolved:>9} {stage.seconds:>9.2f}", file=file)
+
+def open_cache(cache_path, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL, backend=DEFAULT_BACKEND):
+    """the feature cache of the backend's features, or None when caching is off"""
+    if not cache_path:
+        return contextlib.nullcontext()
+    return FeatureCache(cache_path, checkpoint_interval=checkpoint_interval, model=backend)
+
+def prepare_resume(cache, retry_quarantined):
+    # the cache holds what earlier, maybe interrupted runs processed, only the rest goes to the workers
+    if cache is None:
+        return
+    if retry_quarantined:
+        released = cache.release_quarantine()
+        if released:
+            print(f"Trying {released} quarantined images again.", file=sys.stderr)
+        return
+    quarantined = cache.quarantined()
+    if quarantined:
+        print(f"Skipping {len(quarantined)} quarantined images, use --retry-quarantined to try them again.",
+              file=sys.stderr)
+
+def write_report(records, output, output_file):
+    # records are generated one group at a time and written right away
+    with open_report(output, output_file) as writer:
+        count = writer.write_all(records)
+    print(f"Wrote {count} duplicate groups.", file=sys.stderr)
+
+def stream_report(all_images, cache, hash_distance, extractor, output, output_file):
+    # a group is written as soon as it is found, and again whenever it grows
+    catalog = Catalog(normalize=True)
+    with open_report(output, output_file) as writer:
+        stream = GroupStream(writer, catalog)
+        found = find_duplicate_ids(all_images, cache=cache, hash_distance=hash_distance, extractor=extractor,
+                                   on_group=stream, catalog=catalog)
+    print(f"Wrote {len(stream)} duplicate groups.", file=sys.stderr)
+    return found
+
+def run_cascade(all_images, cache, hash_distance, output=None, output_file=None, display=True, extractor=None):
+    catalog, groups, stats = find_duplicate_ids_cascade(all_images, confirm_distance=hash_distance, cache=cache,
+                                                        extractor=extractor)
+    duplicates = [catalog.paths_of(group) for group in groups]
+    if output:
+        write_report(catalog_records(catalog, groups, 'cascade'), output, output_file)
+        print_stage_stats(stats, file=sys.stderr)
     else:
-        all_images = images1
+        if duplicates:
+            print("Found duplicates:")
+            for dup in duplicates:
+                print("\n".join(dup))
+        else:
+            print("No duplicates found.")
+        print_stage_stats(stats)
+    if duplicates and display:
+        display_duplicates(duplicates)
+
+def fill_store(all_images, cache, store_path, backend, extractor=None):
+    # the reference set, e.g. an archive, only grows
+    store = EmbeddingStore(store_path, backend=backend)
+    added = store.add(extract_features(all_images, cache=cache, extractor=extractor))
+    print(f"Added {added} images to {store_path}, it holds {len(store)} now.")
+
+def query_store(all_images, cache, store_path, backend, hash_distance, output=None, output_file=None, extractor=None):
+    # the new images are compared with the store chunk by chunk, memory does not grow with the store
+    store = EmbeddingStore(store_path, backend=backend)
+    matches = store.match(extract_features(all_images, cache=cache, extractor=extractor), threshold=DEFAULT_THRESHOLD,
+                          max_distance=hash_distance)
+    if output:
+        write_report(match_records(matches), output, output_file)
+        return
+    found = 0
+    for match in matches:
+        print(f"Already in the store: {match.path}")
+        for path in match.stored:
+            print(f"    {path}")
+        found += 1
+    print(f"{found} images are in the store already." if found else "None of the images are in the store.")
 
-    hash_duplicates, feature_duplicates = find_duplicates(all_images)
+def print_match(match):
+    print(f"New {match.kind} duplicate: {match.path}")
+    for path in match.duplicates:
+        print(f"    {path}")
 
-    if hash_duplicates:
-        print("Found hash duplicates:")
-        for dup in hash_duplicates:
-            print("\n".join(dup))
+def report_match(writer, numbers):
+    """on_match callback writing every new duplicate as a group, the new image first"""
+    def write(match):
+        writer.write(group_record(next(numbers), match.kind, [match.path] + match.duplicates))
+    return write
+
+def run_watch(folders, cache, hash_distance, interval, backend=DEFAULT_BACKEND, include=(), exclude=(), sniff=True,
+              output=None, output_file=None, task_timeout=DEFAULT_TASK_TIMEOUT, stop=None):
+    report = open_report(output, output_file) if output else contextlib.nullcontext()
+    with FeatureExtractor(backend=backend, task_timeout=task_timeout) as extractor, report as writer, \
+            DuplicateWatcher(folders, cache=cache, extractor=extractor, hash_distance=hash_distance,
+                             interval=interval, include=include, exclude=exclude, sniff=sniff) as watcher:
+        hash_duplicates, feature_duplicates = watcher.initial_scan()
+        on_match = print_match
+        if writer is not None:
+            # the groups so far, then one group for every new duplicate
+            numbers = itertools.count()
+            for kind, groups in (('hash', hash_duplicates), ('feature', feature_duplicates)):
+                for paths in groups:
+                    writer.write(group_record(next(numbers), kind, paths))
+            on_match = report_match(writer, numbers)
+        print(f"Watching {len(watcher.index)} images, {len(hash_duplicates)} hash and "
+              f"{len(feature_duplicates)} feature duplicate groups so far.",
+              file=sys.stderr if writer is not None else sys.stdout)
+        try:
+            watcher.run(on_match, stop)
+        except KeyboardInterrupt:
+            pass
+
+def watch(folders, cache_path=DEFAULT_CACHE_PATH, hash_distance=DEFAULT_MAX_DISTANCE, interval=1.0,
+          backend=DEFAULT_BACKEND, include=(), exclude=(), sniff=True, output=None, output_file=None,
+          task_timeout=DEFAULT_TASK_TIMEOUT, stop=None):
+    # an initial scan, then only added, changed and removed files are processed
+    with open_cache(cache_path, backend=backend) as cache:
+        run_watch(folders, cache, hash_distance, interval, backend, include, exclude, sniff, output, output_file,
+                  task_timeout, stop)
+
+def main(folders, cache_path=DEFAULT_CACHE_PATH, hash_distance=DEFAULT_MAX_DISTANCE, cascade=False,
+         output=None, output_file=None, display=True, include=(), exclude=(), sniff=True,
+         store_path=None, add_to_store=False, backend=DEFAULT_BACKEND, task_timeout=DEFAULT_TASK_TIMEOUT,
+         checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL, retry_quarantined=False):
+    # images are streamed to the workers as the folders are walked, in parallel
+    all_images = scan_images(folders, include=include, exclude=exclude, sniff=sniff)
+
+    # only new or changed files are hashed and run through the model, a crashed
+    # or hung worker is replaced and the file that took it down is quarantined
+    # the workers, the cache and the store all use the same backend
+    with open_cache(cache_path, checkpoint_interval, backend) as cache, \
+            FeatureExtractor(backend=backend, task_timeout=task_timeout) as extractor:
+        prepare_resume(cache, retry_quarantined)
+        if store_path and add_to_store:
+            fill_store(all_images, cache, store_path, backend, extractor)
+            return
+        if store_path:
+            query_store(all_images, cache, store_path, backend, hash_distance, output, output_file, extractor)
+            return
+        if cascade:
+            run_cascade(all_images, cache, hash_distance, output, output_file, display, extractor)
+            return
+        if output:
+            catalog, hash_groups, feature_groups = stream_report(all_images, cache, hash_distance, extractor, output,
+                                                                 output_file)
+        else:
+            catalog, hash_groups, feature_groups = find_duplicate_ids(all_images, cache=cache,
+                                                                      hash_distance=hash_distance, extractor=extractor)
+        if cache is not None:
+            cache.cleanup(folders)
+
+    hash_duplicates = [catalog.paths_of(group) for group in hash_groups]
+    feature_duplicates = [catalog.paths_of(group) for group in feature_groups]
+
+    if not output:
+        if hash_duplicates:
+            print("Found hash duplicates:")
+            for dup in hash_duplicates:
+                print("\n".join(dup))
+        else:
+            print("No hash duplicates found.")
+    if hash_duplicates and display:
         display_duplicates(hash_duplicates)
-    else:
-        print("No hash duplicates found.")
 
-    if feature_duplicates:
-        print("Found feature duplicates:")
-        for dup in feature_duplicates:
-            print("\n".join(dup))
+    if not output:
+        if feature_duplicates:
+            print("Found feature duplicates:")
+            for dup in feature_duplicates:
+                print("\n".join(dup))
+        else:
+            print("No feature duplicates found.")
+    if feature_duplicates and display:
         display_duplicates(feature_duplicates)
-    else:
-        print("No feature duplicates found.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Find duplicate images in folders.')
-    parser.add_argument('folder1', type=str, help='Path to the first folder with images.')
-    parser.add_argument('folder2', type=str, nargs='?', default=None, help='Path to the second folder with images (optional).')
+    parser.add_argument('folders', type=str, nargs='+', help='Folders with images, searched recursively.')
+    parser.add_argument('--include', type=str, action='append', default=[], help='Only scan files matching this glob (name or path below a folder), can be repeated.')
+    parser.add_argument('--exclude', type=str, action='append', default=[], help='Skip files and folders matching this glob, can be repeated.')
+    parser.add_argument('--by-extension', action='store_true', help='Recognize images by their extension instead of their first bytes.')
+    parser.add_argument('--cache', type=str, default=DEFAULT_CACHE_PATH, help='Path to the hash and feature cache.')
+    parser.add_argument('--no-cache', action='store_true', help='Process every image even if it was cached.')
+    parser.add_argument('--hash-distance', type=int, default=DEFAULT_MAX_DISTANCE, help='Max Hamming distance between hashes of duplicates.')
+    parser.add_argument('--cascade', action='store_true', help='Check file content and hashes first and use the model only for borderline cases.')
+    parser.add_argument('--watch', action='store_true', help='Keep running and report new duplicates as files are added or changed.')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between checks for changes in watch mode.')
+    parser.add_argument('--output', choices=REPORT_FORMATS, default=None, help='Write the duplicate groups as jsonl, csv or parquet instead of printing them.')
+    parser.add_argument('--output-file', type=str, default=None, help='File for --output (default: stdout, parquet needs a file).')
+    parser.add_argument('--no-display', action='store_true', help='Do not open windows with the duplicates, e.g. on servers.')
+    parser.add_argument('--backend', type=str, default=os.environ.get('IMAGE_DUPES_BACKEND', DEFAULT_BACKEND),
+                        help='Embedding backend: vgg16, mobilenet_v2, mobilenet_v3_small, efficientnet_b0, any of them with -int8, or onnx:<path>.')
+    parser.add_argument('--store', type=str, default=None, help='Embedding store of a reference set: report which images of the folders are in it already.')
+    parser.add_argument('--add-to-store', action='store_true', help='Add the images of the folders to --store instead of searching duplicates.')
+    parser.add_argument('--task-timeout', type=float, default=DEFAULT_TASK_TIMEOUT, help='Seconds a worker may spend on one batch before it is restarted, 0 for no limit.')
+    parser.add_argument('--checkpoint-interval', type=float, default=DEFAULT_CHECKPOINT_INTERVAL, help='Seconds between commits of the cache, an interrupted run resumes from the last one.')
+    parser.add_argument('--retry-quarantined', action='store_true', help='Process images again that crashed or hung a worker in an earlier run.')
+    parser.add_argument('--stats', action='store_true', help='Print the time and call count of every pipeline stage at the end.')
+    parser.add_argument('--stats-json', type=str, default=None, help='Write the stage timers and counters to this json file at the end.')
+    parser.add_argument('--profile', choices=instrumentation.PROFILERS, default=None, help='Profile the stages given with --profile-stages.')
+    parser.add_argument('--profile-stages', type=str, default='', help='Comma separated stages to profile, e.g. decode,predict.')
     args = parser.parse_args()
-    main(args.folder1, args.folder2)
\ No newline at end of file
+    if args.add_to_store and not args.store:
+        parser.error('--add-to-store needs --store')
+    try:
+        create_backend(args.backend)
+    except ValueError as e:
+        parser.error(str(e))
+    # a terminated scan still commits what it processed, the next run resumes from there
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    if args.stats or args.stats_json or args.profile:
+        instrumentation.enable(args.profile, [name for name in args.profile_stages.split(',') if name])
+    try:
+        if args.watch:
+            watch(args.folders, cache_path=None if args.no_cache else args.cache,
+                  hash_distance=args.hash_distance, interval=args.interval, backend=args.backend,
+                  include=args.include, exclude=args.exclude, sniff=not args.by_extension,
+                  output=args.output, output_file=args.output_file, task_timeout=args.task_timeout or None)
+        else:
+            main(args.folders, cache_path=None if args.no_cache else args.cache,
+                 hash_distance=args.hash_distance, cascade=args.cascade,
+                 output=args.output, output_file=args.output_file, display=not args.no_display,
+                 include=args.include, exclude=args.exclude, sniff=not args.by_extension,
+                 store_path=args.store, add_to_store=args.add_to_store, backend=args.backend,
+                 task_timeout=args.task_timeout or None, checkpoint_interval=args.checkpoint_interval,
+                 retry_quarantined=args.retry_quarantined)
+    finally:
+        if args.stats or args.profile:
+            instrumentation.report(file=sys.stderr)
+        if args.stats_json:
+            instrumentation.dump_json(args.stats_json)
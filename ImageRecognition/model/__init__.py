@@ -1 +1,2 @@
-from ImageRecognition.model.model import initialize_model, get_model
\ No newline at end of file
+from ImageRecognition.model.model import initialize_model, get_model, embedding_dim, backend_name
+from ImageRecognition.model.backends import EmbeddingBackend, BACKENDS, create_backend
@@ -0,0 +1,244 @@
+import os
+import numpy as np
+from ImageRecognition.utils import instrumentation
+
+# converted models are kept here so they are only built once per machine
+MODEL_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'image_duplicates', 'models')
+
+# imagenet statistics used by the 'caffe' and 'torch' preprocessing modes
+_CAFFE_MEAN = np.array([103.939, 116.779, 123.68], dtype=np.float32)
+_TORCH_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+_TORCH_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+
+def preprocess(batch, mode):
+    """scale an rgb float32 batch of 0..255 pixels the way a network was trained"""
+    if mode == 'caffe':
+        # vgg16 - bgr channels with the imagenet mean removed
+        return batch[..., ::-1] - _CAFFE_MEAN
+    if mode == 'tf':
+        # mobilenet - pixels scaled to -1..1
+        return batch / 127.5 - 1.0
+    if mode == 'torch':
+        return (batch / 255.0 - _TORCH_MEAN) / _TORCH_STD
+    if mode is None:
+        # the network rescales its input itself (efficientnet)
+        return batch
+    raise ValueError(f'unknown preprocessing mode {mode!r}')
+
+
+class EmbeddingBackend:
+    """turns batches of 224x224 rgb images into embedding vectors
+
+    subclasses declare `name` and `dim` (the embedding size) and implement
+    load() and predict(). load() is called once per process, `threads`
+    limits the threads of the runtime (None leaves it its default).
+    predict() gets a batch that was already passed through preprocess()
+    """
+
+    name = None
+    dim = None
+    input_size = (224, 224)
+    preprocess_mode = 'caffe'
+
+    def load(self, threads=None):
+        raise NotImplementedError
+
+    def preprocess(self, batch):
+        return preprocess(np.asarray(batch, dtype=np.float32), self.preprocess_mode)
+
+    def predict(self, batch):
+        raise NotImplementedError
+
+    def embed(self, batch):
+        """(n, 224, 224, 3) pixels to an (n, dim) float32 matrix"""
+        with instrumentation.stage('preprocess'):
+            batch = self.preprocess(batch)
+        with instrumentation.stage('predict'):
+            return np.asarray(self.predict(batch), dtype=np.float32)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.name!r}, dim={self.dim})'
+
+
+class KerasBackend(EmbeddingBackend):
+    """keras application without its top, followed by global average pooling"""
+
+    constructor = None
+
+    def __init__(self):
+        self.keras_model = None
+
+    def load(self, threads=None):
+        if threads:
+            import tensorflow as tf
+            try:
+                tf.config.threading.set_intra_op_parallelism_threads(threads)
+                tf.config.threading.set_inter_op_parallelism_threads(1)
+            except RuntimeError:
+                # tensorflow already ran something in this process, its thread pools are fixed
+                pass
+        from tensorflow.keras import applications
+        from tensorflow.keras.models import Model
+        from tensorflow.keras.layers import GlobalAveragePooling2D
+        application = getattr(applications, self.constructor)
+        base_model = application(weights='imagenet', include_top=False, input_shape=(*self.input_size, 3))
+        self.keras_model = Model(inputs=base_model.input, outputs=GlobalAveragePooling2D()(base_model.output))
+
+    def predict(self, batch):
+        return self.keras_model.predict_on_batch(batch)
+
+
+class VGG16Backend(KerasBackend):
+    """the original model, about 15 GFLOPs per image"""
+    name = 'vgg16'
+    dim = 512
+    constructor = 'VGG16'
+
+
+class MobileNetV2Backend(KerasBackend):
+    """about 0.3 GFLOPs per image"""
+    name = 'mobilenet_v2'
+    dim = 1280
+    constructor = 'MobileNetV2'
+    preprocess_mode = 'tf'
+
+
+class MobileNetV3SmallBackend(KerasBackend):
+    """about 0.06 GFLOPs per image, includes its own rescaling"""
+    name = 'mobilenet_v3_small'
+    dim = 576
+    constructor = 'MobileNetV3Small'
+    preprocess_mode = None
+
+
+class EfficientNetB0Backend(KerasBackend):
+    """about 0.4 GFLOPs per image, includes its own rescaling"""
+    name = 'efficientnet_b0'
+    dim = 1280
+    constructor = 'EfficientNetB0'
+    preprocess_mode = None
+
+
+class QuantizedBackend(EmbeddingBackend):
+    """tflite version of a keras backend with int8 weights
+
+    the conversion runs once and the result is stored in MODEL_CACHE_DIR
+    """
+
+    def __init__(self, base, threads=None):
+        self.base = base
+        self.name = f'{base.name}-int8'
+        self.dim = base.dim
+        self.input_size = base.input_size
+        self.preprocess_mode = base.preprocess_mode
+        self.threads = threads
+        self.interpreter = None
+
+    def _convert(self, path, threads):
+        import tensorflow as tf
+        self.base.load(threads)
+        converter = tf.lite.TFLiteConverter.from_keras_model(self.base.keras_model)
+        # dynamic range quantization - int8 weights, float activations
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(converter.convert())
+        os.replace(path + '.tmp', path)
+        # only the converted model is needed from now on
+        self.base.keras_model = None
+
+    def load(self, threads=None):
+        import tensorflow as tf
+        threads = threads or self.threads
+        path = os.path.join(MODEL_CACHE_DIR, f'{self.name}.tflite')
+        if not os.path.exists(path):
+            self._convert(path, threads)
+        self.interpreter = tf.lite.Interpreter(model_path=path, num_threads=threads)
+        self.interpreter.allocate_tensors()
+
+    def predict(self, batch):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        input_details = self.interpreter.get_input_details()[0]
+        if tuple(input_details['shape']) != batch.shape:
+            # the batch size changes between calls, e.g. for the last batch
+            self.interpreter.resize_tensor_input(input_details['index'], batch.shape)
+            self.interpreter.allocate_tensors()
+        self.interpreter.set_tensor(input_details['index'], batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.interpreter.get_output_details()[0]['index'])
+
+
+class OnnxBackend(EmbeddingBackend):
+    """any onnx model that maps (n, 224, 224, 3) images to (n, dim) embeddings
+
+    the path comes from the backend name ('onnx:/path/model.onnx') or from
+    IMAGE_DUPES_ONNX_MODEL, `preprocess_mode` must match how the model was
+    trained. needs the optional onnxruntime package
+    """
+
+    def __init__(self, path=None, preprocess_mode='caffe', threads=None):
+        self.path = path or os.environ.get('IMAGE_DUPES_ONNX_MODEL')
+        if not self.path:
+            raise ValueError('the onnx backend needs a model path, use onnx:<path> or set IMAGE_DUPES_ONNX_MODEL')
+        self.name = f'onnx:{os.path.basename(self.path)}'
+        self.preprocess_mode = preprocess_mode
+        self.threads = threads
+        self.session = None
+
+    def load(self, threads=None):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError('the onnx backend needs onnxruntime, install it with: pip install onnxruntime')
+        threads = threads or self.threads
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(self.path, options, providers=['CPUExecutionProvider'])
+        self.dim = self.session.get_outputs()[0].shape[-1]
+
+    def predict(self, batch):
+        feed = {self.session.get_inputs()[0].name: np.ascontiguousarray(batch, dtype=np.float32)}
+        return self.session.run(None, feed)[0]
+
+
+class PixelBackend(EmbeddingBackend):
+    """mean colours of a 16x16 grid, no network and nothing to download
+
+    only sees near-identical images, it lets benchmarks and tests run the
+    whole pipeline offline. the mean of every image is removed so a
+    brightness shift does not change the direction of the vector
+    """
+    name = 'pixels'
+    dim = 16 * 16 * 3
+    preprocess_mode = None
+    grid = 16
+
+    def load(self, threads=None):
+        pass
+
+    def predict(self, batch):
+        n, height, width, channels = batch.shape
+        cells = batch.reshape(n, self.grid, height // self.grid, self.grid, width // self.grid, channels)
+        vectors = cells.mean(axis=(2, 4)).reshape(n, -1)
+        return vectors - vectors.mean(axis=1, keepdims=True)
+
+
+BACKENDS = {backend.name: backend for backend in (VGG16Backend, MobileNetV2Backend, MobileNetV3SmallBackend, EfficientNetB0Backend,
+                                                  PixelBackend)}
+
+
+def create_backend(name, threads=None):
+    """backend for a name like 'vgg16', 'mobilenet_v2-int8' or 'onnx:/path/model.onnx'
+
+    `threads` is the default for load() of the backends that take it in the constructor
+    """
+    if name == 'onnx' or name.startswith('onnx:'):
+        return OnnxBackend(name.partition(':')[2] or None, threads=threads)
+    if name.endswith('-int8'):
+        return QuantizedBackend(create_backend(name[:-len('-int8')]), threads=threads)
+    if name not in BACKENDS:
+        raise ValueError(f'unknown backend {name!r}, choose from {", ".join(sorted(BACKENDS))} (optionally with -int8) or onnx:<path>')
+    return BACKENDS[name]()
@@ -1,19 +1,32 @@
-from tensorflow.keras.applications.vgg16 import VGG16
-from tensorflow.keras.models import Model
-from tensorflow.keras.layers import GlobalAveragePooling2D
+import os
+from ImageRecognition.model.backends import create_backend
+
+# backend used when none is given, can be changed with IMAGE_DUPES_BACKEND
+DEFAULT_BACKEND = 'vgg16'
 
 # initialize the model as a global variable
 model = None
 
-def initialize_model():
+def backend_name():
+    """name of the configured embedding backend"""
+    return os.environ.get('IMAGE_DUPES_BACKEND', DEFAULT_BACKEND)
+
+def initialize_model(backend=None, threads=None):
     global model
-    # load the VGG16 model without the top layer
-    base_model = VGG16(weights='imagenet', include_top=False)
-    # create a new model that outputs global average pooling of the VGG16 output
-    model = Model(inputs=base_model.input, outputs=GlobalAveragePooling2D()(base_model.output))
+    # create the embedding backend (vgg16 with global average pooling by default) and load it
+    model = create_backend(backend or backend_name(), threads)
+    model.load(threads)
 
-def get_model():
+def get_model(backend=None):
     global model
-    if model is None:
-        initialize_model()
-    return model
\ No newline at end of file
+    if model is None or (backend is not None and model.name != backend):
+        initialize_model(backend)
+    return model
+
+def embedding_dim():
+    """size of the vectors the active or configured backend produces"""
+    if model is not None:
+        return model.dim
+    dim = create_backend(backend_name()).dim
+    # onnx models only know their size once they are loaded
+    return dim if dim is not None else get_model().dim
@@ -0,0 +1,46 @@
+import unittest
+import numpy as np
+from ImageRecognition.model.backends import create_backend, preprocess, QuantizedBackend, VGG16Backend, MobileNetV2Backend, OnnxBackend, PixelBackend
+
+class TestBackends(unittest.TestCase):
+
+    def test_create_backend(self):
+        self.assertIsInstance(create_backend('vgg16'), VGG16Backend)
+        self.assertEqual(create_backend('vgg16').dim, 512)
+        quantized = create_backend('mobilenet_v2-int8')
+        self.assertIsInstance(quantized, QuantizedBackend)
+        self.assertIsInstance(quantized.base, MobileNetV2Backend)
+        self.assertEqual((quantized.name, quantized.dim), ('mobilenet_v2-int8', 1280))
+        onnx = create_backend('onnx:/models/embedder.onnx')
+        self.assertIsInstance(onnx, OnnxBackend)
+        self.assertEqual(onnx.path, '/models/embedder.onnx')
+        # the per-worker thread count reaches the runtimes that take it in the constructor
+        self.assertEqual(create_backend('onnx:/models/embedder.onnx', threads=2).threads, 2)
+        self.assertEqual(create_backend('mobilenet_v2-int8', threads=2).threads, 2)
+        with self.assertRaises(ValueError):
+            create_backend('resnet50')
+
+    def test_preprocess(self):
+        batch = np.full((1, 2, 2, 3), 255, dtype=np.float32)
+        batch[..., 0] = 0
+        # caffe mode swaps to bgr and removes the imagenet mean
+        np.testing.assert_allclose(preprocess(batch, 'caffe')[0, 0, 0], [255 - 103.939, 255 - 116.779, -123.68], rtol=1e-6)
+        np.testing.assert_allclose(preprocess(batch, 'tf')[0, 0, 0], [-1, 1, 1])
+        self.assertIs(preprocess(batch, None), batch)
+        with self.assertRaises(ValueError):
+            preprocess(batch, 'unknown')
+
+    def test_pixel_backend(self):
+        backend = create_backend('pixels')
+        self.assertIsInstance(backend, PixelBackend)
+        backend.load()
+        rng = np.random.default_rng(0)
+        batch = rng.integers(0, 200, (2, 224, 224, 3)).astype(np.float32)
+        # a brighter copy keeps the same vector
+        batch[1] = batch[0] + 40
+        vectors = backend.embed(batch)
+        self.assertEqual(vectors.shape, (2, backend.dim))
+        np.testing.assert_allclose(vectors[0], vectors[1], atol=1e-3)
+
+if __name__ == '__main__':
+    unittest.main()
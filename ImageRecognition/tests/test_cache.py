@@ -0,0 +1,98 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+import imagehash
+from PIL import Image
+from ImageRecognition.utils.cache import FeatureCache
+
+class TestFeatureCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.img_path = os.path.join(self.temp_dir.name, 'img.png')
+        Image.new('RGB', (10, 10)).save(self.img_path)
+        self.img_hash = imagehash.average_hash(Image.new('RGB', (10, 10), (255, 0, 0)))
+        self.features = np.random.rand(512).astype(np.float32)
+        self.cache_path = os.path.join(self.temp_dir.name, 'cache', 'cache.sqlite3')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_store_and_lookup(self):
+        with FeatureCache(self.cache_path) as cache:
+            self.assertIsNone(cache.lookup(self.img_path))
+            cache.store(self.img_path, self.img_hash, self.features)
+        # a new connection sees the stored entry
+        with FeatureCache(self.cache_path) as cache:
+            img_hash, features = cache.lookup(self.img_path)
+            self.assertEqual(img_hash, self.img_hash)
+            np.testing.assert_array_equal(features, self.features)
+            cached, missing = cache.split([self.img_path, os.path.join(self.temp_dir.name, 'new.png')])
+            self.assertEqual(len(cached), 1)
+            self.assertEqual(len(missing), 1)
+
+    def test_changed_file_is_stale(self):
+        with FeatureCache(self.cache_path) as cache:
+            cache.store(self.img_path, self.img_hash, self.features)
+            Image.new('RGB', (20, 20)).save(self.img_path)
+            self.assertIsNone(cache.lookup(self.img_path))
+
+    def test_digest_survives_touch(self):
+        with FeatureCache(self.cache_path, digest=True) as cache:
+            cache.store(self.img_path, self.img_hash, self.features)
+            stat = os.stat(self.img_path)
+            os.utime(self.img_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            self.assertIsNotNone(cache.lookup(self.img_path))
+
+    def test_digest_finds_copies(self):
+        copy_path = os.path.join(self.temp_dir.name, 'copy.png')
+        with open(self.img_path, 'rb') as src, open(copy_path, 'wb') as dst:
+            dst.write(src.read())
+        with FeatureCache(self.cache_path) as cache:
+            cache.store(self.img_path, self.img_hash, self.features)
+            self.assertIsNone(cache.lookup(copy_path))
+        with FeatureCache(self.cache_path, digest=True) as cache:
+            # entries stored without digest do not match by content
+            self.assertIsNone(cache.lookup(copy_path))
+            cache.store(self.img_path, self.img_hash, self.features)
+            img_hash, features = cache.lookup(copy_path)
+            self.assertEqual(img_hash, self.img_hash)
+            np.testing.assert_array_equal(features, self.features)
+            # the copy got its own entry
+            self.assertEqual(len(cache), 2)
+
+    def test_other_backend_is_stale(self):
+        with FeatureCache(self.cache_path, model='vgg16') as cache:
+            cache.store(self.img_path, self.img_hash, self.features)
+        with FeatureCache(self.cache_path, model='mobilenet_v2') as cache:
+            self.assertIsNone(cache.lookup(self.img_path))
+
+    def test_checkpoint_commits_before_commit_every(self):
+        with FeatureCache(self.cache_path, commit_every=1000, checkpoint_interval=0) as cache:
+            cache.store(self.img_path, self.img_hash, self.features)
+            # another connection, like the next run after a kill, sees the checkpoint
+            with FeatureCache(self.cache_path) as other:
+                self.assertIsNotNone(other.lookup(self.img_path))
+
+    def test_quarantined_file_is_skipped_until_it_changes(self):
+        with FeatureCache(self.cache_path) as cache:
+            cache.quarantine(self.img_path, 'worker crashed')
+        with FeatureCache(self.cache_path) as cache:
+            self.assertEqual(cache.quarantined(), [(os.path.abspath(self.img_path), 'worker crashed')])
+            self.assertEqual(cache.split([self.img_path]), ([], []))
+            Image.new('RGB', (20, 20)).save(self.img_path)
+            self.assertEqual(cache.split([self.img_path]), ([], [self.img_path]))
+            cache.quarantine(self.img_path, 'worker crashed')
+            self.assertEqual(cache.release_quarantine(), 1)
+            self.assertEqual(cache.split([self.img_path]), ([], [self.img_path]))
+
+    def test_cleanup_removes_deleted_files(self):
+        with FeatureCache(self.cache_path) as cache:
+            cache.store(self.img_path, self.img_hash, self.features)
+            os.remove(self.img_path)
+            self.assertEqual(cache.cleanup([self.temp_dir.name]), 1)
+            self.assertEqual(len(cache), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+import numpy as np
+import imagehash
+from ImageRecognition.utils.catalog import Catalog
+
+class TestCatalog(unittest.TestCase):
+
+    def test_columns(self):
+        img_hash = imagehash.ImageHash(np.eye(8, dtype=bool))
+        features = np.arange(4, dtype=np.float32)
+        catalog = Catalog(capacity=2)
+        ids = catalog.add([('a', img_hash, features), ('b', None, features + 1), ('c', 7, None)])
+
+        self.assertEqual(ids.tolist(), [0, 1, 2])
+        self.assertEqual(len(catalog), 3)
+        self.assertEqual(catalog.id_of('b'), 1)
+        self.assertIn('c', catalog)
+        self.assertEqual(catalog.has_hash.tolist(), [True, False, True])
+        self.assertEqual(catalog.has_features.tolist(), [True, True, False])
+        self.assertEqual(catalog.hashes[[0, 2]].tolist(), [int(str(img_hash), 16), 7])
+        np.testing.assert_array_equal(catalog.features[1], features + 1)
+        self.assertEqual(catalog.paths_of(np.array([2, 0])), ['c', 'a'])
+
+    def test_float16_features(self):
+        catalog = Catalog(feature_dtype=np.float16)
+        catalog.add([('a', None, np.full(512, 0.5, dtype=np.float32))])
+        self.assertEqual(catalog.features.dtype, np.float16)
+        self.assertEqual(catalog.features.shape, (1, 512))
+
+    def test_normalize_and_fill_in(self):
+        catalog = Catalog(normalize=True)
+        ids = catalog.add([('a', None, None), ('b', None, None), ('a', None, None)])
+        self.assertEqual(catalog.id_of('a'), 0)
+        catalog.set_hashes(ids[:2], [5, None])
+        catalog.set_features(ids[:1], [np.array([3, 4], dtype=np.float32)])
+        catalog.copy_rows(ids[2:], ids[:1])
+        self.assertEqual(catalog.has_hash.tolist(), [True, False, True])
+        self.assertEqual(catalog.has_features.tolist(), [True, False, True])
+        np.testing.assert_allclose(catalog.features[[0, 2]], [[0.6, 0.8], [0.6, 0.8]])
+
+    def test_empty(self):
+        catalog = Catalog()
+        self.assertEqual(catalog.features.shape, (0, 0))
+        self.assertEqual(len(catalog.add([])), 0)
+
+if __name__ == '__main__':
+    unittest.main()
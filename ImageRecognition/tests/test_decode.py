@@ -0,0 +1,41 @@
+import unittest
+import os
+import tempfile
+from PIL import Image
+from ImageRecognition.image_processing.decode import decode_image
+
+class TestDecodeImage(unittest.TestCase):
+
+    def decode_saved(self, img, name):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, name)
+            img.save(path)
+            return decode_image(path)
+
+    def test_large_jpeg_is_decoded_small(self):
+        img = self.decode_saved(Image.new('RGB', (2000, 1500), (200, 10, 10)), 'big.jpg')
+        self.assertEqual(img.mode, 'RGB')
+        self.assertGreaterEqual(min(img.size), 224)
+        self.assertLess(img.width, 1000)
+
+    def test_large_png_is_reduced(self):
+        img = self.decode_saved(Image.new('RGBA', (1000, 800)), 'big.png')
+        self.assertEqual(img.mode, 'RGB')
+        # reduced by 3, the largest factor that keeps both sides >= 224
+        self.assertGreaterEqual(min(img.size), 224)
+        self.assertLess(img.width, 400)
+
+    def test_large_palette_and_bilevel_images_are_reduced(self):
+        palette = Image.new('RGB', (600, 600), (200, 10, 10)).quantize(16)
+        for img, name in ((palette, 'big.gif'), (palette, 'quantized.png'), (Image.new('1', (600, 600), 1), 'bilevel.png')):
+            decoded = self.decode_saved(img, name)
+            self.assertEqual(decoded.mode, 'RGB')
+            self.assertEqual(decoded.size, (300, 300))
+
+    def test_small_image_keeps_its_size(self):
+        img = self.decode_saved(Image.new('L', (10, 10)), 'small.png')
+        self.assertEqual(img.mode, 'RGB')
+        self.assertEqual(img.size, (10, 10))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+from ImageRecognition.utils.embedding_store import EmbeddingStore
+
+class TestEmbeddingStore(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.temp_dir.name, 'store')
+        rng = np.random.default_rng(0)
+        self.vectors = rng.standard_normal((50, 8)).astype(np.float32)
+        self.results = [(f'/archive/img{i}.jpg', i, vector) for i, vector in enumerate(self.vectors)]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_add_and_reopen(self):
+        store = EmbeddingStore(self.directory, backend='pixels')
+        # rows without features are skipped, known paths are not added twice
+        self.assertEqual(store.add(self.results[:30] + [('/archive/broken.jpg', None, None)], chunk_size=7), 30)
+        self.assertEqual(store.add(self.results, chunk_size=7), 20)
+
+        store = EmbeddingStore(self.directory)
+        self.assertEqual((len(store), store.dim, store.backend), (50, 8, 'pixels'))
+        self.assertEqual(store.paths_of([0, 49, 7]), ['/archive/img0.jpg', '/archive/img49.jpg', '/archive/img7.jpg'])
+        self.assertEqual(store.hashes[:3].tolist(), [0, 1, 2])
+        norms = np.linalg.norm(self.vectors, axis=1, keepdims=True)
+        np.testing.assert_allclose(store.vectors, self.vectors / norms, rtol=1e-5)
+
+    def test_other_backend_is_refused(self):
+        EmbeddingStore(self.directory, backend='pixels').add(self.results[:1])
+        with self.assertRaises(ValueError):
+            EmbeddingStore(self.directory, backend='vgg16')
+
+    def test_query_in_chunks(self):
+        store = EmbeddingStore(self.directory, dtype=np.float16)
+        store.add(self.results)
+        queries = np.stack([self.vectors[3] * 2, self.vectors[40] + 0.01, -self.vectors[0]])
+        rows, ids, similarities = store.query(queries, threshold=0.99, chunk_size=16, query_chunk=2)
+        self.assertEqual(sorted(zip(rows.tolist(), ids.tolist())), [(0, 3), (1, 40)])
+        self.assertTrue(np.all(similarities >= 0.99))
+
+        rows, ids, distances = store.query_hashes([3, 0b1000000], max_distance=1, chunk_size=16)
+        expected = [(row, i, bin(query ^ i).count('1')) for row, query in enumerate([3, 0b1000000])
+                    for i in range(50) if bin(query ^ i).count('1') <= 1]
+        self.assertEqual(sorted(zip(rows.tolist(), ids.tolist(), distances.tolist())), expected)
+
+    def test_match(self):
+        store = EmbeddingStore(self.directory)
+        store.add(self.results)
+        new = [('/drop/copy.jpg', 0xff00, self.vectors[5] * 3), ('/drop/same_hash.jpg', 9, -self.vectors[9]),
+               ('/drop/new.jpg', 0xff00ff00, -self.vectors[1]), ('/drop/broken.jpg', None, None)]
+        matches = list(store.match(new, threshold=0.99, max_distance=0, batch_size=2))
+        self.assertEqual([(match.path, match.stored) for match in matches],
+                         [('/drop/copy.jpg', ['/archive/img5.jpg']), ('/drop/same_hash.jpg', ['/archive/img9.jpg'])])
+        # the new image and the stored ones, for the distances in reports
+        self.assertEqual(matches[1].hashes.tolist(), [9, 9])
+        np.testing.assert_allclose(matches[0].features @ matches[0].features[0], [1, 1], rtol=1e-5)
+        np.testing.assert_allclose(matches[1].features @ matches[1].features[0], [1, -1], rtol=1e-5)
+
+    def test_interrupted_add_is_cut_off(self):
+        store = EmbeddingStore(self.directory)
+        store.add(self.results[:10])
+        # rows written without a commit, like after a crash
+        with open(os.path.join(self.directory, 'vectors'), 'ab') as f:
+            f.write(b'\0' * 100)
+        store = EmbeddingStore(self.directory)
+        self.assertEqual(store.add(self.results[10:12]), 2)
+        self.assertEqual(store.paths_of([11]), ['/archive/img11.jpg'])
+        self.assertEqual(os.path.getsize(os.path.join(self.directory, 'vectors')), 12 * 8 * 4)
+
+    def test_empty_store(self):
+        store = EmbeddingStore(self.directory)
+        rows, ids, _ = store.query(self.vectors[:2])
+        self.assertEqual((len(rows), len(ids)), (0, 0))
+
+if __name__ == '__main__':
+    unittest.main()
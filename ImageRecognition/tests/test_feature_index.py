@@ -0,0 +1,115 @@
+import unittest
+import numpy as np
+from ImageRecognition.utils.catalog import Catalog
+from ImageRecognition.utils.feature_index import FeatureIndex
+
+class TestFeatureIndex(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        # 200 unrelated non-negative vectors plus slightly changed copies of the first 20
+        self.base = np.abs(rng.standard_normal((200, 512))).astype(np.float32)
+        self.copies = self.base[:20] + 0.05 * np.abs(rng.standard_normal((20, 512))).astype(np.float32)
+        self.vectors = np.vstack([self.base, self.copies])
+
+    def check_clusters(self, index):
+        clusters = sorted(cluster.tolist() for cluster in index.clusters())
+        self.assertEqual(clusters, [[i, 200 + i] for i in range(20)])
+
+    def test_exact_clusters(self):
+        index = FeatureIndex(threshold=0.95, mode='exact', block_size=64)
+        index.add(self.vectors)
+        self.check_clusters(index)
+
+    def test_lsh_clusters(self):
+        index = FeatureIndex(threshold=0.95, mode='lsh', block_size=64)
+        # added in two parts to exercise growing the storage
+        index.add(self.base)
+        index.add(self.copies)
+        self.check_clusters(index)
+
+    def test_float16_storage(self):
+        index = FeatureIndex(threshold=0.95, dtype=np.float16)
+        index.add(self.vectors)
+        self.assertEqual(index.vectors.dtype, np.float16)
+        self.check_clusters(index)
+
+    def test_query(self):
+        for mode in ('exact', 'lsh'):
+            index = FeatureIndex(threshold=0.95, mode=mode)
+            index.add(self.vectors)
+            ids, similarities = index.query(self.copies[3])
+            self.assertEqual(sorted(ids.tolist()), [3, 203])
+            self.assertTrue(np.all(similarities >= 0.95))
+
+    def test_pairs_with_added_in_chunks(self):
+        for mode in ('exact', 'lsh'):
+            index = FeatureIndex(threshold=0.95, mode=mode, block_size=16)
+            found = set()
+            for start in range(0, len(self.vectors), 50):
+                left, right, _ = index.pairs_with(index.add(self.vectors[start:start + 50]))
+                found.update(zip(left.tolist(), right.tolist()))
+            self.assertEqual(found, {(i, 200 + i) for i in range(20)})
+
+    def test_removed_vectors_are_ignored(self):
+        for mode in ('exact', 'lsh'):
+            index = FeatureIndex(threshold=0.95, mode=mode)
+            index.add(self.vectors)
+            index.remove([3])
+            self.assertEqual(len(index), 219)
+            self.assertEqual(index.query(self.copies[3])[0].tolist(), [203])
+            self.assertNotIn([3, 203], [cluster.tolist() for cluster in index.clusters()])
+
+    def test_lsh_remove_float16(self):
+        index = FeatureIndex(threshold=0.95, mode='lsh', dtype=np.float16)
+        index.add(self.vectors)
+        # rounded to float16 some rows hash differently than when they were added
+        index.remove(np.arange(len(self.vectors)))
+        self.assertEqual(len(index), 0)
+        self.assertEqual(sum(len(table) for table in index._buckets), 0)
+
+    def test_lsh_recenter(self):
+        index = FeatureIndex(threshold=0.95, mode='lsh', block_size=64)
+        # centered on a first batch that is nothing like the rest
+        index.add(-self.base[:5])
+        index.remove(np.arange(5))
+        index.add(self.vectors)
+        index.recenter()
+        self.assertTrue(np.all(index._center > 0))
+        clusters = sorted(cluster.tolist() for cluster in index.clusters())
+        self.assertEqual(clusters, [[5 + i, 205 + i] for i in range(20)])
+
+    def test_index_over_catalog(self):
+        for mode in ('exact', 'lsh'):
+            catalog = Catalog(normalize=True)
+            # a row without features in front shifts every id by one
+            catalog.add([('none', None, None)])
+            ids = catalog.add((f'{i}.jpg', None, vector) for i, vector in enumerate(self.vectors))
+            index = FeatureIndex(threshold=0.95, mode=mode, catalog=catalog)
+            index.add_ids(ids)
+            # the catalog's rows are compared in place
+            self.assertIsNone(index._vectors)
+            self.assertEqual(len(index), 220)
+            clusters = sorted(cluster.tolist() for cluster in index.clusters())
+            self.assertEqual(clusters, [[1 + i, 201 + i] for i in range(20)])
+        with self.assertRaises(ValueError):
+            FeatureIndex(catalog=Catalog())
+
+    def test_chain_forms_one_cluster(self):
+        # a is close to b and b is close to c, so all three are one cluster
+        a = np.zeros(8, dtype=np.float32)
+        a[0] = 1
+        b = a.copy()
+        b[1] = 0.4
+        c = b.copy()
+        c[2] = 0.45
+        index = FeatureIndex(threshold=0.9)
+        index.add([a, b, c, -a])
+        self.assertEqual([cluster.tolist() for cluster in index.clusters()], [[0, 1, 2]])
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            FeatureIndex(mode='ivf')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,15 @@
 import unittest
 import os
+import shutil
 import tempfile
+import threading
+from unittest import mock
+import numpy as np
 from PIL import Image
-from ImageRecognition.utils.find_duplicates import find_duplicates
+from ImageRecognition.utils.report import catalog_records
+from ImageRecognition.utils.find_duplicates import find_duplicates, find_duplicates_cascade, find_duplicate_ids_cascade, ScanCancelled
+from ImageRecognition.utils.feature_index import FeatureIndex
+from ImageRecognition.utils.hash_index import HashIndex
 from ImageRecognition.model.model import initialize_model
 
 class TestFindDuplicates(unittest.TestCase):
@@ -46,5 +53,95 @@ class TestFindDuplicates(unittest.TestCase):
             for img in images:
                 img[0].close()
 
+    def test_groups_are_reported_while_scanning(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = []
+            for i in range(5):
+                path = os.path.join(temp_dir, f'img{i}.png')
+                Image.new('RGB', (10, 10)).save(path)
+                paths.append(path)
+            progress = []
+            groups = {}
+
+            def on_group(kind, group, group_paths, absorbed):
+                for old in absorbed:
+                    del groups[kind, old]
+                groups[kind, group] = group_paths
+
+            hash_duplicates, feature_duplicates = find_duplicates(paths, batch_size=2, workers=1,
+                                                                  progress=progress.append, on_group=on_group)
+
+            self.assertEqual(progress, [2, 4, 5])
+            self.assertEqual(groups, {('hash', 0): hash_duplicates[0], ('feature', 0): feature_duplicates[0]})
+            self.assertEqual(sorted(hash_duplicates[0]), paths)
+
+    def test_streamed_groups_are_not_compared_again(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = []
+            for i in range(7):
+                path = os.path.join(temp_dir, f'img{i}.png')
+                img = Image.new('RGB', (32, 32), 'white' if i % 2 else 'black')
+                if i % 3 == 0:
+                    img.paste((255, 0, 0), (0, 0, 16, 32))
+                img.save(path)
+                paths.append(path)
+            expected = find_duplicates(paths, batch_size=2, workers=1)
+            # the groups joined while streaming are the result, nothing is matched a second time
+            with mock.patch.object(HashIndex, 'clusters', side_effect=AssertionError), \
+                    mock.patch.object(FeatureIndex, 'clusters', side_effect=AssertionError):
+                streamed = find_duplicates(paths, batch_size=2, workers=1, on_group=lambda *args: None)
+            self.assertEqual(streamed, expected)
+            self.assertTrue(expected[0])
+
+    def test_cancel(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'img.png')
+            Image.new('RGB', (10, 10)).save(path)
+            cancel = threading.Event()
+            cancel.set()
+            with self.assertRaises(ScanCancelled):
+                find_duplicates([path], workers=1, cancel=cancel)
+
+class TestFindDuplicatesCascade(unittest.TestCase):
+
+    def test_cheap_stages_settle_clear_cases(self):
+        rng = np.random.default_rng(0)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            original = Image.fromarray(rng.integers(0, 256, (32, 32, 3), dtype=np.uint8)).resize((256, 256))
+            paths = [os.path.join(temp_dir, name) for name in ('a.png', 'a_copy.png', 'a_small.png')]
+            original.save(paths[0])
+            shutil.copy(paths[0], paths[1])
+            original.resize((128, 128)).save(paths[2])
+            for i in range(4):
+                path = os.path.join(temp_dir, f'random{i}.png')
+                Image.fromarray(rng.integers(0, 256, (32, 32, 3), dtype=np.uint8)).save(path)
+                paths.append(path)
+
+            duplicates, stats = find_duplicates_cascade(paths, workers=1)
+
+            self.assertEqual([sorted(group) for group in duplicates], [sorted(paths[:3])])
+            self.assertEqual([stage.name for stage in stats], ['identical files', 'perceptual hash', 'cnn features'])
+            # the copy is settled by its content, the rest by their hashes
+            self.assertEqual((stats[0].images, stats[0].resolved), (7, 1))
+            self.assertEqual((stats[1].images, stats[1].resolved), (6, 6))
+            self.assertEqual(stats[2].images, 0)
+
+    def test_cascade_catalog_keeps_hashes(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = [os.path.join(temp_dir, name) for name in ('a.png', 'a_copy.png', 'b.png')]
+            rng = np.random.default_rng(1)
+            Image.fromarray(rng.integers(0, 256, (32, 32, 3), dtype=np.uint8)).save(paths[0])
+            shutil.copy(paths[0], paths[1])
+            Image.fromarray(rng.integers(0, 256, (32, 32, 3), dtype=np.uint8)).save(paths[2])
+
+            catalog, groups, _ = find_duplicate_ids_cascade(paths, workers=1)
+
+            self.assertEqual([catalog.paths_of(group) for group in groups], [paths[:2]])
+            # the copy was never hashed itself, it shares the hash of its original
+            self.assertTrue(catalog.has_hash.all())
+            self.assertEqual(catalog.hashes[0], catalog.hashes[1])
+            [record] = catalog_records(catalog, groups, 'cascade')
+            self.assertEqual(record['pairs'][0]['hash_distance'], 0)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+import numpy as np
+import imagehash
+from ImageRecognition.utils.hash_index import HashIndex, hamming_distance, pack_hashes
+
+class TestHashIndex(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.hashes = rng.integers(0, 2**63, 300, dtype=np.uint64) * np.uint64(2) + rng.integers(0, 2, 300, dtype=np.uint64)
+
+    def brute_force_pairs(self, max_distance):
+        distances = hamming_distance(self.hashes[:, np.newaxis], self.hashes[np.newaxis])
+        rows, cols = np.nonzero(np.triu(distances <= max_distance, k=1))
+        return set(zip(rows.tolist(), cols.tolist()))
+
+    def test_pack_hashes(self):
+        img_hash = imagehash.ImageHash(np.eye(8, dtype=bool))
+        packed = pack_hashes([img_hash, 5])
+        self.assertEqual(packed.dtype, np.uint64)
+        self.assertEqual(int(packed[0]), int(str(img_hash), 16))
+        self.assertEqual(int(packed[1]), 5)
+
+    def test_hamming_distance(self):
+        self.assertEqual(hamming_distance(np.uint64(0), np.uint64(2**64 - 1)), 64)
+        self.assertEqual(hamming_distance(np.array([0b1011], dtype=np.uint64), np.uint64(0b0001)).tolist(), [2])
+
+    def test_pairs_match_brute_force(self):
+        # flip a few bits of some hashes to get close pairs
+        self.hashes[100:120] = self.hashes[:20] ^ np.uint64(0b101)
+        self.hashes[120:130] = self.hashes[20:30] ^ np.uint64(1 << 63)
+        for max_distance in (0, 1, 2, 5):
+            index = HashIndex(max_distance, block_size=16)
+            index.add(self.hashes)
+            left, right, distances = index.pairs()
+            self.assertEqual(set(zip(left.tolist(), right.tolist())), self.brute_force_pairs(max_distance))
+            self.assertTrue(np.all(distances <= max_distance))
+
+    def test_clusters(self):
+        self.hashes[10] = self.hashes[0] ^ np.uint64(1)
+        self.hashes[20] = self.hashes[10] ^ np.uint64(2)
+        self.hashes[30:35] = self.hashes[5]
+        index = HashIndex(1)
+        index.add(self.hashes)
+        clusters = sorted(cluster.tolist() for cluster in index.clusters())
+        self.assertEqual(clusters, [[0, 10, 20], [5, 30, 31, 32, 33, 34]])
+
+    def test_pairs_with_added_in_chunks(self):
+        self.hashes[100:120] = self.hashes[:20] ^ np.uint64(0b11)
+        index = HashIndex(2)
+        found = set()
+        for start in range(0, len(self.hashes), 32):
+            left, right, _ = index.pairs_with(index.add(self.hashes[start:start + 32]))
+            found.update(zip(left.tolist(), right.tolist()))
+        self.assertEqual(found, self.brute_force_pairs(2))
+
+    def test_removed_hashes_are_ignored(self):
+        self.hashes[10] = self.hashes[0] ^ np.uint64(1)
+        self.hashes[20] = self.hashes[10] ^ np.uint64(2)
+        index = HashIndex(1)
+        index.add(self.hashes)
+        index.remove([10])
+        self.assertEqual(len(index), 299)
+        self.assertEqual(index.clusters(), [])
+        self.assertEqual(index.query(int(self.hashes[10]))[0].tolist(), [0, 20])
+        self.assertEqual(len(index.pairs()[0]), 0)
+
+    def test_query(self):
+        index = HashIndex(2)
+        index.add(self.hashes)
+        ids, distances = index.query(int(self.hashes[7] ^ np.uint64(0b11)))
+        self.assertEqual(ids.tolist(), [7])
+        self.assertEqual(distances.tolist(), [2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 from PIL import Image
-from ImageRecognition.image_processing.features import image_to_feature_vector
+import numpy as np
+from ImageRecognition.image_processing.features import image_to_feature_vector, images_to_feature_matrix
 from ImageRecognition.model.model import initialize_model
 
 class TestImageToFeatureVector(unittest.TestCase):
@@ -17,5 +18,19 @@ class TestImageToFeatureVector(unittest.TestCase):
         self.assertEqual(len(features), 512)
         img.close()
 
+    def test_images_to_feature_matrix(self):
+        # batch size that does not divide the number of images
+        images = [Image.new('RGB', (10, 10), (i * 40, 0, 0)) for i in range(5)]
+        features = images_to_feature_matrix(images, batch_size=2)
+        self.assertEqual(features.shape, (5, 512))
+        self.assertEqual(features.dtype, np.float32)
+        # batching must not change the result
+        np.testing.assert_allclose(features[3], image_to_feature_vector(images[3]), rtol=1e-4, atol=1e-4)
+        for img in images:
+            img.close()
+
+    def test_images_to_feature_matrix_empty(self):
+        self.assertEqual(images_to_feature_matrix([]).shape, (0, 512))
+
 if __name__ == '__main__':
     unittest.main()
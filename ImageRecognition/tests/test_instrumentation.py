@@ -0,0 +1,93 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from ImageRecognition.utils import instrumentation
+
+class TestInstrumentation(unittest.TestCase):
+
+    def tearDown(self):
+        instrumentation.disable()
+
+    def test_disabled_is_a_no_op(self):
+        self.assertFalse(instrumentation.enabled())
+        with instrumentation.stage('decode'):
+            instrumentation.count('images')
+        self.assertIsNone(instrumentation.snapshot())
+        self.assertIsNone(instrumentation.take())
+        self.assertIsNone(instrumentation.settings())
+
+    def test_timers_and_counters(self):
+        instrumentation.enable()
+        for _ in range(3):
+            with instrumentation.stage('decode'):
+                instrumentation.count('images')
+        instrumentation.add_time('wait for workers', 0.5)
+        data = instrumentation.snapshot()
+        self.assertEqual(data['timers']['decode']['calls'], 3)
+        self.assertGreaterEqual(data['timers']['decode']['max_seconds'], 0)
+        self.assertEqual(data['timers']['wait for workers']['seconds'], 0.5)
+        self.assertEqual(data['counters'], {'images': 3})
+
+    def test_stage_times_exceptions(self):
+        instrumentation.enable()
+        with self.assertRaises(ValueError):
+            with instrumentation.stage('decode'):
+                raise ValueError
+        self.assertEqual(instrumentation.snapshot()['timers']['decode']['calls'], 1)
+
+    def test_take_and_merge(self):
+        # what a worker sends back is added to the parent's numbers
+        instrumentation.enable()
+        instrumentation.count('images', 2)
+        taken = instrumentation.take()
+        self.assertEqual(instrumentation.snapshot()['counters'], {})
+        instrumentation.merge(taken)
+        instrumentation.merge(taken)
+        self.assertEqual(instrumentation.snapshot()['counters'], {'images': 4})
+
+    def test_tracemalloc_peak(self):
+        instrumentation.enable('tracemalloc', ['allocate'])
+        with instrumentation.stage('allocate'):
+            data = bytearray(4 * 2**20)
+        del data
+        peak = instrumentation.snapshot()['memory_peak_bytes']['allocate']
+        self.assertGreaterEqual(peak, 4 * 2**20)
+
+    def test_cprofile_report(self):
+        instrumentation.enable('cprofile', ['sort'])
+        with instrumentation.stage('sort'):
+            sorted(range(1000), key=lambda i: -i)
+        out = io.StringIO()
+        instrumentation.report(file=out)
+        self.assertIn('profile of sort', out.getvalue())
+
+    def test_take_and_merge_profiles(self):
+        instrumentation.enable('cprofile', ['sort'])
+        with instrumentation.stage('sort'):
+            sorted(range(1000), key=lambda i: -i)
+        taken = instrumentation.take()
+        # the profile leaves with the snapshot, the json-friendly snapshot() has none
+        self.assertIn('sort', taken['profiles'])
+        self.assertNotIn('profiles', instrumentation.snapshot())
+        instrumentation.merge(taken)
+        instrumentation.merge(taken)
+        calls = [stat[1] for func, stat in instrumentation.take()['profiles']['sort'].items() if 'sorted' in func[2]]
+        self.assertEqual(calls, [2])
+
+    def test_unknown_profiler(self):
+        with self.assertRaises(ValueError):
+            instrumentation.enable('perf')
+
+    def test_dump_json(self):
+        instrumentation.enable()
+        instrumentation.count('cache hits', 5)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'stats.json')
+            instrumentation.dump_json(path)
+            with open(path) as f:
+                self.assertEqual(json.load(f)['counters'], {'cache hits': 5})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,7 @@ import unittest
 import os
 import tempfile
 from PIL import Image
-from ImageRecognition.image_processing.load_images import load_images_from_folder
+from ImageRecognition.image_processing.load_images import load_images_from_folder, iter_images, ImageRecord
 
 class TestLoadImagesFromFolder(unittest.TestCase):
 
@@ -24,5 +24,24 @@ class TestLoadImagesFromFolder(unittest.TestCase):
             for img, path in images:
                 img.close()
 
+    def test_iter_images(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            nested = os.path.join(temp_dir, 'a', 'b')
+            os.makedirs(nested)
+            img1_path = os.path.join(temp_dir, 'img1.JPG')
+            img2_path = os.path.join(nested, 'img2.png')
+            Image.new('RGB', (10, 10)).save(img1_path, format='JPEG')
+            Image.new('RGB', (10, 10)).save(img2_path)
+            with open(os.path.join(temp_dir, 'notes.txt'), 'w') as f:
+                f.write('not an image')
+
+            records = list(iter_images(temp_dir))
+            self.assertEqual(sorted(record.path for record in records), sorted([img1_path, img2_path]))
+            self.assertTrue(all(isinstance(record, ImageRecord) for record in records))
+            self.assertEqual(next(r for r in records if r.path == img2_path).size, os.path.getsize(img2_path))
+
+            # without recursion only the top folder is listed
+            self.assertEqual([record.path for record in iter_images(temp_dir, recursive=False)], [img1_path])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
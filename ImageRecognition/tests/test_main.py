@@ -0,0 +1,53 @@
+import contextlib
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from PIL import Image
+from ImageRecognition.main import main, watch
+
+
+class TestMainBackend(unittest.TestCase):
+
+    def test_backend_reaches_workers_and_cache(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for name, color in (('a.png', 'red'), ('b.png', 'red'), ('c.png', 'blue')):
+                Image.new('RGB', (32, 32), color).save(os.path.join(temp_dir, name))
+            cache_path = os.path.join(temp_dir, 'cache', 'features.db')
+            # nothing may be read from the environment, the argument alone picks the backend
+            with mock.patch.dict(os.environ), contextlib.redirect_stdout(io.StringIO()) as out:
+                os.environ.pop('IMAGE_DUPES_BACKEND', None)
+                main([temp_dir], cache_path=cache_path, display=False, backend='pixels')
+            self.assertIn('Found hash duplicates', out.getvalue())
+            with contextlib.closing(sqlite3.connect(cache_path)) as db:
+                models = {model for (model,) in db.execute('SELECT model FROM files')}
+            self.assertEqual(models, {'pixels'})
+
+
+class TestWatch(unittest.TestCase):
+
+    def test_options_reach_the_watcher(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for name in ('a.png', 'b.png', 'c.jpg'):
+                Image.new('RGB', (32, 32), 'red').save(os.path.join(temp_dir, name))
+            os.makedirs(os.path.join(temp_dir, 'skip'))
+            Image.new('RGB', (32, 32), 'red').save(os.path.join(temp_dir, 'skip', 'd.png'))
+            output_file = os.path.join(temp_dir, 'report.jsonl')
+            stop = threading.Event()
+            stop.set()
+            with contextlib.redirect_stderr(io.StringIO()):
+                watch([temp_dir], cache_path=None, backend='pixels', include=['*.png'], exclude=['skip'],
+                      output='jsonl', output_file=output_file, task_timeout=30, stop=stop)
+            with open(output_file) as f:
+                records = [json.loads(line) for line in f]
+        self.assertEqual(sorted(record['kind'] for record in records), ['feature', 'hash'])
+        for record in records:
+            self.assertEqual(sorted(os.path.basename(path) for path in record['paths']), ['a.png', 'b.png'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import csv
+import json
+import os
+import tempfile
+import numpy as np
+from ImageRecognition.utils.catalog import Catalog
+from ImageRecognition.utils.embedding_store import StoreMatch
+from ImageRecognition.utils.report import catalog_records, group_record, match_records, open_report, GroupStream
+
+class TestReport(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.paths = []
+        for name, size in (('a.jpg', 10), ('b.jpg', 30), ('c.jpg', 20)):
+            path = os.path.join(self.temp_dir.name, name)
+            with open(path, 'wb') as f:
+                f.write(b'x' * size)
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_group_record(self):
+        features = np.array([[1, 0], [1, 0], [0, 1]], dtype=np.float32)
+        record = group_record(3, 'hash', self.paths, [0b1, 0b11, None], features)
+        self.assertEqual(record['group'], 3)
+        self.assertEqual(record['sizes'], [10, 30, 20])
+        # the largest file is the one to keep
+        self.assertEqual(record['keeper'], self.paths[1])
+        self.assertEqual(record['pairs'], [
+            {'a': 0, 'b': 1, 'hash_distance': 1, 'cosine': 1.0},
+            {'a': 0, 'b': 2, 'hash_distance': None, 'cosine': 0.0},
+            {'a': 1, 'b': 2, 'hash_distance': None, 'cosine': 0.0},
+        ])
+
+    def test_catalog_records(self):
+        catalog = Catalog()
+        catalog.add([(self.paths[0], 5, np.ones(4)), (self.paths[1], 5, None), (self.paths[2], 7, np.ones(4))])
+        records = list(catalog_records(catalog, [np.array([0, 1]), np.array([0, 2])], 'feature', first_group=1))
+        self.assertEqual([record['group'] for record in records], [1, 2])
+        self.assertEqual(records[0]['pairs'], [{'a': 0, 'b': 1, 'hash_distance': 0, 'cosine': None}])
+        self.assertEqual(records[1]['pairs'], [{'a': 0, 'b': 1, 'hash_distance': 1, 'cosine': 1.0}])
+
+    def test_match_records(self):
+        match = StoreMatch(self.paths[0], self.paths[1:], np.array([0b1, 0b11, 0b1], dtype=np.uint64),
+                           np.array([[1, 0], [1, 0], [0, 1]], dtype=np.float32))
+        [record] = match_records([match], first_group=2)
+        self.assertEqual((record['group'], record['kind'], record['paths']), (2, 'store', self.paths))
+        self.assertEqual(record['pairs'][:2], [
+            {'a': 0, 'b': 1, 'hash_distance': 1, 'cosine': 1.0},
+            {'a': 0, 'b': 2, 'hash_distance': 0, 'cosine': 0.0},
+        ])
+
+    def test_group_stream(self):
+        catalog = Catalog()
+        catalog.add([(path, 5, None) for path in self.paths])
+        written = []
+        writer = type('ListWriter', (), {'write': lambda _, record: written.append(record)})()
+        stream = GroupStream(writer, catalog)
+        stream('hash', 7, self.paths[:2], [])
+        stream('feature', 7, self.paths[1:], [])
+        stream('hash', 9, [self.paths[2]], [])
+        # hash group 9 swallows hash group 7 and is written again under its own number
+        stream('hash', 9, self.paths, [7])
+        self.assertEqual([(record['group'], record['kind'], len(record['paths']), record['absorbed']) for record in written],
+                         [(0, 'hash', 2, []), (1, 'feature', 2, []), (2, 'hash', 1, []), (2, 'hash', 3, [0])])
+        self.assertEqual(written[0]['pairs'][0]['hash_distance'], 0)
+        self.assertEqual(len(stream), 2)
+
+    def test_jsonl_and_csv(self):
+        record = group_record(0, 'hash', self.paths[:2], [1, 1])
+        jsonl_path = os.path.join(self.temp_dir.name, 'report.jsonl')
+        with open_report('jsonl', jsonl_path) as writer:
+            self.assertEqual(writer.write_all([record, record]), 2)
+        with open(jsonl_path) as f:
+            self.assertEqual([json.loads(line) for line in f], [record, record])
+
+        csv_path = os.path.join(self.temp_dir.name, 'report.csv')
+        with open_report('csv', csv_path) as writer:
+            writer.write(record)
+        with open(csv_path, newline='') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([(row['path'], row['keeper'], row['hash_distance']) for row in rows],
+                         [(self.paths[0], 'False', '0'), (self.paths[1], 'True', '')])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            open_report('xml')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import os
+import tempfile
+from PIL import Image
+from ImageRecognition.image_processing.scanner import Scanner, scan_images, sniff_format
+
+class TestScanner(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        root = self.temp_dir.name
+        self.first = os.path.join(root, 'first')
+        self.second = os.path.join(root, 'second')
+        deep = os.path.join(self.first, 'a', 'b', 'c')
+        os.makedirs(deep)
+        os.makedirs(os.path.join(self.second, 'cache'))
+        self.jpeg = os.path.join(deep, 'photo.jpg')
+        Image.new('RGB', (10, 10)).save(self.jpeg)
+        # wrong and missing extensions
+        self.png = os.path.join(self.first, 'scan.dat')
+        Image.new('RGB', (10, 10)).save(self.png, format='PNG')
+        self.gif = os.path.join(self.second, 'IMG_0001')
+        Image.new('RGB', (10, 10)).save(self.gif, format='GIF')
+        with open(os.path.join(self.second, 'fake.jpg'), 'w') as f:
+            f.write('not an image')
+        self.cached = os.path.join(self.second, 'cache', 'thumb.png')
+        Image.new('RGB', (10, 10)).save(self.cached)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def paths(self, *args, **kwargs):
+        return sorted(record.path for record in scan_images(*args, **kwargs))
+
+    def test_sniff_format(self):
+        self.assertEqual(sniff_format(self.jpeg), 'jpeg')
+        self.assertEqual(sniff_format(self.png), 'png')
+        self.assertEqual(sniff_format(self.gif), 'gif')
+        self.assertIsNone(sniff_format(os.path.join(self.second, 'fake.jpg')))
+        self.assertIsNone(sniff_format(os.path.join(self.second, 'missing')))
+
+    def test_roots_are_walked_recursively_by_content(self):
+        self.assertEqual(self.paths([self.first, self.second], workers=3),
+                         sorted([self.jpeg, self.png, self.gif, self.cached]))
+        # by extension the renamed files are missed and the fake one is taken
+        self.assertEqual(self.paths([self.first, self.second], sniff=False),
+                         sorted([self.jpeg, os.path.join(self.second, 'fake.jpg'), self.cached]))
+
+    def test_globs(self):
+        self.assertEqual(self.paths([self.second], exclude=['cache']), [self.gif])
+        self.assertEqual(self.paths([self.first, self.second], include=['*.jpg', 'IMG_*']), sorted([self.jpeg, self.gif]))
+        # relative paths match too
+        self.assertEqual(self.paths([self.first], exclude=['a/b']), [self.png])
+
+    def test_globs_below_any_root(self):
+        # a trailing separator is normalized away
+        self.assertEqual(self.paths([self.first + os.sep], exclude=['a/b']), [self.png])
+        self.assertEqual(self.paths([self.first + os.sep + os.sep], include=['a/b/c/*']), [self.jpeg])
+        # the filesystem root already ends with a separator
+        root = os.path.abspath(os.sep)
+        scanner = Scanner([root], include=['a/b/*'], exclude=['a/*'])
+        path = os.path.join(root, 'a', 'b', 'photo.jpg')
+        self.assertTrue(scanner.included(root, 'photo.jpg', path))
+        self.assertTrue(scanner.excluded(root, 'b', os.path.join(root, 'a', 'b')))
+        self.assertFalse(scanner.excluded(root, 'a', os.path.join(root, 'a')))
+
+    def test_links_and_overlapping_roots_are_reported_once(self):
+        os.link(self.jpeg, os.path.join(self.second, 'hardlink.jpg'))
+        os.symlink(self.png, os.path.join(self.second, 'symlink.png'))
+        # a loop back to the root
+        os.symlink(self.first, os.path.join(self.first, 'a', 'loop'))
+        paths = self.paths([self.first, self.second, os.path.join(self.first, 'a')])
+        self.assertEqual(len(paths), 4)
+        self.assertIn(self.gif, paths)
+        self.assertEqual(self.paths([self.second], follow_symlinks=False), sorted([self.gif, self.cached,
+                                                                                   os.path.join(self.second, 'hardlink.jpg')]))
+
+    def test_stops_early(self):
+        records = Scanner([self.first, self.second], sniff=False, workers=2, queue_size=1).scan()
+        next(records)
+        records.close()
+
+    def test_missing_root(self):
+        self.assertEqual(self.paths([os.path.join(self.first, 'missing')]), [])
+
+if __name__ == '__main__':
+    unittest.main()
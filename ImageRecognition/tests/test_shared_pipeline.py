@@ -0,0 +1,43 @@
+import unittest
+import os
+import tempfile
+from multiprocessing import shared_memory
+import numpy as np
+from PIL import Image
+from ImageRecognition.image_processing.decode import decode_image
+from ImageRecognition.image_processing.features import image_to_array
+from ImageRecognition.model.backends import create_backend
+from ImageRecognition.utils.shared_pipeline import SharedMemoryExtractor
+
+class TestSharedMemoryExtractor(unittest.TestCase):
+
+    def test_map_matches_the_model(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = []
+            for i in range(5):
+                path = os.path.join(temp_dir, f'img{i}.png')
+                Image.new('RGB', (10, 10), (i * 50, 255 - i * 50, 0)).save(path)
+                paths.append(path)
+            paths.append(os.path.join(temp_dir, 'missing.jpg'))
+
+            # 3 batches of 2 through 2 slots, so slots are reused
+            with SharedMemoryExtractor(workers=1, batch_size=2, backend='pixels', slots=2) as extractor:
+                results = {path: (img_hash, features) for path, img_hash, features in extractor.map(paths)}
+                self.assertEqual(len(list(extractor.map(paths[:1]))), 1)
+                blocks = list(extractor._blocks)
+            # the shared memory is gone once the extractor is closed
+            self.assertEqual(extractor._blocks, [])
+            with self.assertRaises(FileNotFoundError):
+                shared_memory.SharedMemory(blocks[0].name)
+
+            self.assertEqual(sorted(results), sorted(paths))
+            self.assertEqual(results[paths[-1]], (None, None))
+            backend = create_backend('pixels')
+            expected = backend.embed(np.stack([image_to_array(decode_image(path)) for path in paths[:-1]]))
+            for path, vector in zip(paths, expected):
+                img_hash, features = results[path]
+                self.assertEqual(len(str(img_hash)), 16)
+                np.testing.assert_allclose(features, vector, atol=1e-3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CHECK = """
+import sys
+import ImageRecognition.image_processing
+import ImageRecognition.model
+import ImageRecognition.utils.cache
+import ImageRecognition.utils.find_duplicates
+print(' '.join(name for name in ('tensorflow', 'keras', 'matplotlib') if name in sys.modules))
+"""
+
+# the submodule first, the way main.py, gui.py and watch.py import it
+REEXPORT = """
+import ImageRecognition.utils.find_duplicates
+import ImageRecognition.utils
+from ImageRecognition.utils import find_duplicates
+print(callable(ImageRecognition.utils.find_duplicates), callable(find_duplicates))
+"""
+
+
+class TestStartup(unittest.TestCase):
+    def test_heavy_frameworks_are_not_imported(self):
+        # fresh interpreter, nothing else may have imported them yet
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        output = subprocess.run([sys.executable, '-c', CHECK], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+        self.assertEqual(output.stdout.strip(), '')
+
+    def test_find_duplicates_stays_a_function_after_the_submodule_import(self):
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        output = subprocess.run([sys.executable, '-c', REEXPORT], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+        self.assertEqual(output.stdout.strip(), 'True True')
+
+
+if __name__ == '__main__':
+    unittest.main()
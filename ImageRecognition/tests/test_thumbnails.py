@@ -0,0 +1,79 @@
+import unittest
+import os
+import tempfile
+import time
+from PIL import Image
+from ImageRecognition.utils.thumbnails import ThumbnailCache
+
+class TestThumbnailCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.paths = []
+        for i in range(3):
+            path = os.path.join(self.temp_dir.name, f'img{i}.png')
+            Image.new('RGB', (1200, 800), (i * 80, 0, 0)).save(path)
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_thumbnail_fits_the_size(self):
+        with ThumbnailCache(size=(100, 100)) as cache:
+            thumbnail = cache.get(self.paths[0])
+            self.assertEqual(thumbnail.size, (100, 67))
+            self.assertIs(cache.get(self.paths[0]), thumbnail)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_least_recently_used_is_evicted(self):
+        with ThumbnailCache(size=(100, 100), capacity=2) as cache:
+            cache.get(self.paths[0])
+            cache.get(self.paths[1])
+            cache.get(self.paths[0])
+            cache.get(self.paths[2])
+            self.assertEqual(len(cache), 2)
+            cache.get(self.paths[0])
+            self.assertEqual(cache.misses, 3)
+
+    def test_disk_cache_is_reused(self):
+        disk_dir = os.path.join(self.temp_dir.name, 'thumbnails')
+        with ThumbnailCache(size=(100, 100), disk_dir=disk_dir) as cache:
+            cache.get(self.paths[0])
+        files = os.listdir(disk_dir)
+        self.assertEqual(len(files), 1)
+        # mark the stored thumbnail to see that the next cache reads it instead of the image
+        Image.new('RGB', (10, 10)).save(os.path.join(disk_dir, files[0]), 'JPEG')
+        with ThumbnailCache(size=(100, 100), disk_dir=disk_dir) as cache:
+            self.assertEqual(cache.get(self.paths[0]).size, (10, 10))
+
+    def test_disk_cache_drops_least_recently_used(self):
+        disk_dir = os.path.join(self.temp_dir.name, 'thumbnails')
+        with ThumbnailCache(size=(100, 100), disk_dir=disk_dir, disk_limit=None) as cache:
+            for path in self.paths:
+                cache.get(path)
+            disk_paths = [cache._disk_path(path) for path in self.paths]
+        total = sum(os.path.getsize(disk_path) for disk_path in disk_paths)
+        now = time.time()
+        for disk_path, age in zip(disk_paths, (300, 200, 100)):
+            os.utime(disk_path, (now - age, now - age))
+        # one thumbnail over the limit, the oldest goes as soon as the cache opens
+        with ThumbnailCache(size=(100, 100), disk_dir=disk_dir, disk_limit=total - 1) as cache:
+            self.assertFalse(os.path.exists(disk_paths[0]))
+            # a read marks the second one as used, so the third goes when the first comes back
+            cache.get(self.paths[1])
+            cache.get(self.paths[0])
+        self.assertEqual([os.path.exists(disk_path) for disk_path in disk_paths], [True, True, False])
+
+    def test_prefetch(self):
+        with ThumbnailCache(size=(100, 100)) as cache:
+            cache.prefetch(self.paths)
+            thumbnails = [cache.get(path) for path in self.paths]
+            self.assertTrue(all(thumbnail is not None for thumbnail in thumbnails))
+            self.assertEqual(len(cache), 3)
+
+    def test_unreadable_image(self):
+        with ThumbnailCache() as cache:
+            self.assertIsNone(cache.get(os.path.join(self.temp_dir.name, 'missing.png')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from PIL import Image
+from ImageRecognition.utils.watch import DirectoryPoller, DuplicateIndex, DuplicateWatcher
+from ImageRecognition.utils.worker_pool import FeatureExtractor
+
+class TestDirectoryPoller(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        os.makedirs(os.path.join(self.root, 'sub'))
+        Image.new('RGB', (10, 10)).save(os.path.join(self.root, 'a.png'))
+        Image.new('RGB', (10, 10)).save(os.path.join(self.root, 'sub', 'b.png'))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_scan_and_changes(self):
+        poller = DirectoryPoller([self.root])
+        self.assertEqual(sorted(os.path.basename(r.path) for r in poller.scan()), ['a.png', 'b.png'])
+        self.assertFalse(any(poller.poll()))
+
+        Image.new('RGB', (10, 10)).save(os.path.join(self.root, 'sub', 'c.png'))
+        os.remove(os.path.join(self.root, 'a.png'))
+        # replaced through a rename, like most tools that write files safely
+        Image.new('RGB', (20, 20)).save(os.path.join(self.root, 'tmp.png'))
+        os.replace(os.path.join(self.root, 'tmp.png'), os.path.join(self.root, 'sub', 'b.png'))
+        os.makedirs(os.path.join(self.root, 'new'))
+        Image.new('RGB', (10, 10)).save(os.path.join(self.root, 'new', 'd.png'))
+
+        changes = poller.poll()
+        self.assertEqual(sorted(os.path.basename(r.path) for r in changes.added), ['c.png', 'd.png'])
+        self.assertEqual([os.path.basename(r.path) for r in changes.changed], ['b.png'])
+        self.assertEqual([os.path.basename(path) for path in changes.removed], ['a.png'])
+
+        shutil.rmtree(os.path.join(self.root, 'new'))
+        self.assertEqual([os.path.basename(path) for path in poller.poll().removed], ['d.png'])
+
+    def test_globs_and_sniffing(self):
+        Image.new('RGB', (10, 10)).save(os.path.join(self.root, 'photo'), format='PNG')
+        with open(os.path.join(self.root, 'notes.png'), 'w') as f:
+            f.write('not an image')
+        os.makedirs(os.path.join(self.root, 'skip'))
+        Image.new('RGB', (10, 10)).save(os.path.join(self.root, 'skip', 'c.png'))
+
+        poller = DirectoryPoller([self.root], exclude=['skip'])
+        self.assertEqual(sorted(os.path.basename(r.path) for r in poller.scan()), ['a.png', 'b.png', 'photo'])
+        Image.new('RGB', (10, 10)).save(os.path.join(self.root, 'skip', 'd.png'))
+        with open(os.path.join(self.root, 'more.png'), 'w') as f:
+            f.write('not an image either')
+        self.assertFalse(any(poller.poll()))
+
+        poller = DirectoryPoller([self.root], include=['sub/*', 'skip/*'], sniff=False)
+        self.assertEqual(sorted(os.path.basename(r.path) for r in poller.scan()), ['b.png', 'c.png', 'd.png'])
+
+    def test_full_poll_finds_files_rewritten_in_place(self):
+        poller = DirectoryPoller([self.root])
+        poller.scan()
+        path = os.path.join(self.root, 'a.png')
+        mtime = os.stat(self.root).st_mtime_ns
+        Image.new('RGB', (30, 30)).save(path)
+        # the folder mtime did not change, only listing it again shows the new file
+        os.utime(self.root, ns=(mtime, mtime))
+        self.assertFalse(any(poller.poll()))
+        self.assertEqual([r.path for r in poller._poll_once(full=True).changed], [path])
+
+class TestDuplicateIndex(unittest.TestCase):
+
+    def test_add_and_remove(self):
+        rng = np.random.default_rng(0)
+        vectors = np.abs(rng.standard_normal((3, 64))).astype(np.float32)
+        index = DuplicateIndex(hash_distance=2, feature_mode='exact')
+        self.assertEqual(index.add([('a', 0b1111, vectors[0]), ('b', 1 << 40, vectors[1])]), [])
+
+        matches = index.add([('c', 0b0111, vectors[0])])
+        self.assertEqual(sorted(matches), [('feature', 'c', ['a']), ('hash', 'c', ['a'])])
+        self.assertEqual(index.clusters('hash'), [['a', 'c']])
+
+        index.remove(['a'])
+        self.assertEqual(index.clusters('hash'), [])
+        # a changed file replaces its old entry
+        matches = index.add([('b', 0b0110, vectors[2])])
+        self.assertEqual(matches, [('hash', 'b', ['c'])])
+        self.assertEqual(len(index), 2)
+
+class TestDuplicateWatcher(unittest.TestCase):
+
+    def test_new_duplicate_is_reported(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            Image.new('RGB', (10, 10)).save(os.path.join(temp_dir, 'a.png'))
+            with DuplicateWatcher([temp_dir], extractor=FeatureExtractor(workers=1),
+                                  watcher=DirectoryPoller([temp_dir])) as watcher:
+                self.assertEqual(watcher.initial_scan(), ([], []))
+                shutil.copy(os.path.join(temp_dir, 'a.png'), os.path.join(temp_dir, 'b.png'))
+                changes, matches = watcher.poll()
+                self.assertEqual(len(changes.added), 1)
+                self.assertIn(('hash', os.path.join(temp_dir, 'b.png'), [os.path.join(temp_dir, 'a.png')]), matches)
+                watcher.extractor.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+import unittest
+import contextlib
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+import io
+from PIL import Image
+from ImageRecognition.image_processing.hash_images import process_images
+from ImageRecognition.utils import instrumentation
+from ImageRecognition.utils.worker_pool import FeatureExtractor
+
+def process_with_poison(paths, batch_size):
+    """process_images, but files named crash* kill the worker and hang* never finish"""
+    names = [os.path.basename(path) for path in paths]
+    if any(name.startswith('crash') for name in names):
+        os._exit(1)
+    if any(name.startswith('hang') for name in names):
+        time.sleep(3600)
+    return process_images(paths, batch_size=batch_size)
+
+def process_reporting_modules(paths, batch_size):
+    """process_images, with the hash replaced by whether the worker imported tensorflow"""
+    return [(path, 'tensorflow' in sys.modules, features)
+            for path, _, features in process_images(paths, batch_size=batch_size)]
+
+class TestFeatureExtractor(unittest.TestCase):
+
+    def test_map_reuses_workers(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = []
+            for i in range(5):
+                path = os.path.join(temp_dir, f'img{i}.jpg')
+                Image.new('RGB', (10, 10), (i * 50, 0, 0)).save(path)
+                paths.append(path)
+            paths.append(os.path.join(temp_dir, 'missing.jpg'))
+
+            with FeatureExtractor(workers=2, batch_size=2) as extractor:
+                self.assertEqual(list(extractor.map([])), [])
+                # nothing to do, so no workers were started
+                self.assertEqual(extractor._processes, [])
+                first = list(extractor.map(paths))
+                pids = [process.pid for process in extractor._processes]
+                second = list(extractor.map(iter(paths[:2])))
+                # the same processes serve every call
+                self.assertEqual(pids, [process.pid for process in extractor._processes])
+
+            self.assertEqual(sorted(path for path, _, _ in first), sorted(paths))
+            self.assertEqual(len(second), 2)
+            for path, img_hash, features in first:
+                if path.endswith('missing.jpg'):
+                    self.assertIsNone(img_hash)
+                    self.assertIsNone(features)
+                else:
+                    self.assertEqual(len(features), 512)
+
+    def test_bad_files_are_quarantined(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = []
+            for name in ('img0.jpg', 'crash.jpg', 'hang.jpg', 'img1.jpg', 'img2.jpg'):
+                path = os.path.join(temp_dir, name)
+                Image.new('RGB', (10, 10), (len(paths) * 50, 0, 0)).save(path)
+                paths.append(path)
+            quarantined = []
+
+            with FeatureExtractor(workers=1, batch_size=2, backend='pixels', task_timeout=5,
+                                  process=process_with_poison) as extractor, \
+                    contextlib.redirect_stdout(io.StringIO()) as stdout:
+                results = list(extractor.map(paths, lambda path, reason: quarantined.append((path, reason))))
+
+            # stdout may be the report, the quarantine messages go to stderr
+            self.assertEqual(stdout.getvalue(), '')
+
+            # the workers died with the bad files, the other files of their chunks still got through
+            self.assertEqual(sorted(path for path, _, _ in results), sorted(paths))
+            self.assertEqual(sorted(path for path, _ in quarantined), [paths[1], paths[2]])
+            self.assertIn('timed out', dict(quarantined)[paths[2]])
+            for path, img_hash, features in results:
+                if path in (paths[1], paths[2]):
+                    self.assertIsNone(features)
+                else:
+                    self.assertIsNotNone(img_hash)
+                    self.assertEqual(len(features), 768)
+
+    def test_worker_that_dies_between_chunks_is_replaced(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = []
+            for i in range(3):
+                path = os.path.join(temp_dir, f'img{i}.png')
+                Image.new('RGB', (10, 10), (i * 50, 0, 0)).save(path)
+                paths.append(path)
+
+            with FeatureExtractor(workers=1, batch_size=2, backend='pixels') as extractor:
+                first = list(extractor.map(paths))
+                # killed while waiting for the next chunk, as the kernel does when memory runs out
+                [process] = extractor._processes
+                while extractor._current[0] >= 0:
+                    time.sleep(0.01)
+                time.sleep(0.5)
+                os.kill(process.pid, signal.SIGKILL)
+                process.join()
+                second = list(extractor.map(paths))
+                self.assertNotEqual(extractor._processes[0].pid, process.pid)
+
+            self.assertEqual([path for path, _, _ in first], [path for path, _, _ in second])
+
+    def test_worker_that_cannot_start_stops_the_scan(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'img.png')
+            Image.new('RGB', (10, 10), (50, 0, 0)).save(path)
+
+            with FeatureExtractor(workers=1, backend='onnx:' + os.path.join(temp_dir, 'missing.onnx')) as extractor, \
+                    contextlib.redirect_stderr(io.StringIO()):
+                with self.assertRaises(RuntimeError):
+                    list(extractor.map([path]))
+
+    def test_cancel_stops_map_while_workers_are_busy(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'hang.png')
+            Image.new('RGB', (10, 10), (50, 0, 0)).save(path)
+            cancel = threading.Event()
+            threading.Timer(1, cancel.set).start()
+
+            with FeatureExtractor(workers=1, backend='pixels', task_timeout=None, process=process_with_poison) as extractor:
+                start = time.perf_counter()
+                self.assertEqual(list(extractor.map([path], cancel=cancel)), [])
+                self.assertLess(time.perf_counter() - start, 30)
+                # the hung worker was stopped with the map
+                self.assertEqual(extractor._processes, [])
+
+    def test_light_backend_workers_do_not_import_tensorflow(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'img.jpg')
+            Image.new('RGB', (10, 10), (50, 0, 0)).save(path)
+
+            with FeatureExtractor(workers=1, backend='pixels', process=process_reporting_modules) as extractor:
+                [(_, imported_tensorflow, features)] = list(extractor.map([path]))
+
+            self.assertFalse(imported_tensorflow)
+            self.assertEqual(len(features), 768)
+
+    def test_worker_stages_are_profiled(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = []
+            for i in range(3):
+                path = os.path.join(temp_dir, f'img{i}.png')
+                Image.new('RGB', (10, 10), (i * 50, 0, 0)).save(path)
+                paths.append(path)
+
+            instrumentation.enable('cprofile', ['decode'])
+            try:
+                with FeatureExtractor(workers=1, batch_size=2, backend='pixels') as extractor:
+                    list(extractor.map(paths))
+                # decode only runs in the worker, its profile came back with the results
+                self.assertEqual(instrumentation.snapshot()['timers']['decode']['calls'], 3)
+                out = io.StringIO()
+                instrumentation.report(file=out)
+            finally:
+                instrumentation.disable()
+
+            self.assertIn('profile of decode', out.getvalue())
+            self.assertIn('function calls', out.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1 +1,26 @@
-from ImageRecognition.utils.find_duplicates import find_duplicates
\ No newline at end of file
+import sys
+import types
+
+
+class _Package(types.ModuleType):
+    """ImageRecognition.utils, with find_duplicates loaded on first use
+
+    image_processing and model use utils.instrumentation, importing
+    find_duplicates here eagerly would import them back in a cycle. a lazy
+    module __getattr__ is not enough: importing the submodule of the same
+    name binds it here and hides the function, the property keeps the
+    function in place
+    """
+
+    @property
+    def find_duplicates(self):
+        from ImageRecognition.utils.find_duplicates import find_duplicates
+        return find_duplicates
+
+    @find_duplicates.setter
+    def find_duplicates(self, module):
+        # the import system binding the submodule, it stays in sys.modules
+        pass
+
+
+sys.modules[__name__].__class__ = _Package
@@ -0,0 +1,279 @@
+import os
+import hashlib
+import sqlite3
+import threading
+import time
+import numpy as np
+import imagehash
+from ImageRecognition.model.model import backend_name
+from ImageRecognition.utils import instrumentation
+
+# where main.py and gui.py keep the cache between runs
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'image_duplicates', 'cache.sqlite3')
+
+# seconds between commits during a scan, an interrupted scan loses at most this much work
+DEFAULT_CHECKPOINT_INTERVAL = 60
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS files (
+        path TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        digest TEXT,
+        hash TEXT,
+        features BLOB,
+        model TEXT NOT NULL DEFAULT 'vgg16'
+    )
+"""
+
+# copies of a file are found by its content digest
+DIGEST_INDEX = "CREATE INDEX IF NOT EXISTS files_digest ON files (digest, model)"
+
+# files that crashed or hung a worker, skipped until they change
+QUARANTINE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS quarantine (
+        path TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        reason TEXT
+    )
+"""
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """blake2b digest of the file content"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _hex_to_hash(hex_str):
+    """faster imagehash.hex_to_hash for square hashes"""
+    bits = np.unpackbits(np.frombuffer(bytes.fromhex(hex_str), dtype=np.uint8)).astype(bool)
+    side = int(np.sqrt(len(bits)))
+    return imagehash.ImageHash(bits.reshape(side, side))
+
+
+class FeatureCache:
+    """persistent cache of image hashes and features
+
+    entries are keyed by (path, size, mtime). with `digest=True` a file whose
+    size or mtime changed is still a hit if its content digest is the same,
+    and so is a new path with the content of a cached file (a copy or a
+    move), at the price of reading every file that misses the cache.
+    features of another embedding backend than `model` count as stale.
+    stored results are committed every `commit_every` files or
+    `checkpoint_interval` seconds, whichever comes first, so a scan that is
+    killed resumes from the last checkpoint
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, digest=False, commit_every=1000, model=None,
+                 checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.digest = digest
+        self.model = model or backend_name()
+        self.commit_every = commit_every
+        self.checkpoint_interval = checkpoint_interval
+        self._committed = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+        # lookups may run in the thread feeding the workers while results are
+        # stored from the main thread
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(SCHEMA)
+        columns = [row[1] for row in self._db.execute('PRAGMA table_info(files)')]
+        if 'model' not in columns:
+            # caches written before there were several backends only hold vgg16 features
+            self._db.execute("ALTER TABLE files ADD COLUMN model TEXT NOT NULL DEFAULT 'vgg16'")
+        self._db.execute(DIGEST_INDEX)
+        self._db.execute(QUARANTINE_SCHEMA)
+        # a handful of rows, checked for every path
+        self._quarantine = {path: (size, mtime_ns) for path, size, mtime_ns
+                            in self._db.execute('SELECT path, size, mtime_ns FROM quarantine')}
+
+    def lookup(self, path):
+        """return (hash, features) for an unchanged file or None if missing or stale"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = os.path.abspath(path)
+        with self._lock:
+            row = self._db.execute(
+                'SELECT size, mtime_ns, digest, hash, features FROM files WHERE path = ? AND model = ?', (key, self.model)
+            ).fetchone()
+        if row is None:
+            return self._lookup_copy(path, key, stat) if self.digest else None
+        size, mtime_ns, digest, img_hash, features = row
+        if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            # touched or copied files keep their entry if the content is the same
+            if not (self.digest and digest and digest == file_digest(path)):
+                return None
+            with self._lock:
+                self._db.execute(
+                    'UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?',
+                    (stat.st_size, stat.st_mtime_ns, key),
+                )
+                self._written()
+        return _hex_to_hash(img_hash), np.frombuffer(features, dtype=np.float32)
+
+    def _lookup_copy(self, path, key, stat):
+        """entry of another file with the same content, stored for path as well"""
+        try:
+            digest = file_digest(path)
+        except OSError:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                'SELECT hash, features FROM files WHERE digest = ? AND model = ? LIMIT 1', (digest, self.model)
+            ).fetchone()
+            if row is None:
+                return None
+            img_hash, features = row
+            self._db.execute(
+                'INSERT OR REPLACE INTO files (path, size, mtime_ns, digest, hash, features, model) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, stat.st_size, stat.st_mtime_ns, digest, img_hash, features, self.model),
+            )
+            self._written()
+        return _hex_to_hash(img_hash), np.frombuffer(features, dtype=np.float32)
+
+    def split(self, paths):
+        """split paths into cached results and paths that still have to be processed"""
+        cached = []
+        missing = list(self.iter_missing(paths, cached))
+        return cached, missing
+
+    def iter_missing(self, paths, cached):
+        """yield the paths that have to be processed, append cached results to `cached`"""
+        for path in paths:
+            if self._quarantine and self.is_quarantined(path):
+                instrumentation.count('quarantine skips')
+                continue
+            entry = self.lookup(path)
+            if entry is None:
+                self.misses += 1
+                instrumentation.count('cache misses')
+                yield path
+            else:
+                self.hits += 1
+                instrumentation.count('cache hits')
+                cached.append((path, *entry))
+
+    def store(self, path, img_hash, features):
+        """remember the hash and features of a processed file"""
+        if img_hash is None or features is None:
+            return
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        digest = file_digest(path) if self.digest else None
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO files (path, size, mtime_ns, digest, hash, features, model) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, digest, str(img_hash),
+                 np.asarray(features, dtype=np.float32).tobytes(), self.model),
+            )
+            self._written()
+
+    def _written(self):
+        # commit in batches, one transaction per file would be very slow
+        self._pending += 1
+        if (self._pending >= self.commit_every
+                or time.monotonic() - self._committed >= self.checkpoint_interval):
+            self.commit()
+
+    def commit(self):
+        with self._lock:
+            self._db.commit()
+            self._pending = 0
+            self._committed = time.monotonic()
+
+    def quarantine(self, path, reason):
+        """remember a file that crashed or hung a worker, committed right away"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        key = os.path.abspath(path)
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO quarantine (path, size, mtime_ns, reason) VALUES (?, ?, ?, ?)',
+                             (key, stat.st_size, stat.st_mtime_ns, reason))
+            self._quarantine[key] = (stat.st_size, stat.st_mtime_ns)
+            self.commit()
+
+    def is_quarantined(self, path):
+        """True for a quarantined file that did not change since"""
+        entry = self._quarantine.get(os.path.abspath(path))
+        if entry is None:
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return entry == (stat.st_size, stat.st_mtime_ns)
+
+    def quarantined(self):
+        """(path, reason) of every quarantined file"""
+        with self._lock:
+            return self._db.execute('SELECT path, reason FROM quarantine ORDER BY path').fetchall()
+
+    def release_quarantine(self):
+        """give every quarantined file another chance, returns how many there were"""
+        with self._lock:
+            released = self._db.execute('DELETE FROM quarantine').rowcount
+            self._quarantine = {}
+            self.commit()
+        return released
+
+    def prune(self, root=None):
+        """remove entries of files that no longer exist, optionally only below root"""
+        with self._lock:
+            if root is None:
+                rows = self._db.execute('SELECT path FROM files').fetchall()
+            else:
+                prefix = os.path.join(os.path.abspath(root), '')
+                rows = self._db.execute('SELECT path FROM files WHERE substr(path, 1, ?) = ?',
+                                        (len(prefix), prefix)).fetchall()
+        # the file system is checked without holding up lookups
+        gone = [(path,) for (path,) in rows if not os.path.exists(path)]
+        with self._lock:
+            self._db.executemany('DELETE FROM files WHERE path = ?', gone)
+            self.commit()
+        return len(gone)
+
+    def compact(self):
+        """give the space of removed entries back to the file system"""
+        with self._lock:
+            self.commit()
+            self._db.execute('VACUUM')
+
+    def cleanup(self, roots, compact_ratio=0.1):
+        """prune deleted files below the roots and compact if many entries went away"""
+        removed = sum(self.prune(root) for root in roots)
+        if removed and removed >= compact_ratio * (len(self) + removed):
+            self.compact()
+        return removed
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self.commit()
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
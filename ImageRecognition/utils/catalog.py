@@ -0,0 +1,129 @@
+import numpy as np
+from ImageRecognition.utils.hash_index import pack_hashes
+
+
+class Catalog:
+    """column store of scan results
+
+    every path gets an int id, its average hash is kept in a uint64 column
+    and its features in one contiguous matrix (float32, or float16 to halve
+    the memory). files whose hash or features could not be computed are
+    marked in the has_hash / has_features masks. groups of duplicates are
+    int arrays of these ids. with normalize=True the features are scaled to
+    unit length as they come in, so a FeatureIndex can compare the rows in
+    place instead of keeping a copy
+    """
+
+    def __init__(self, feature_dtype=np.float32, capacity=1024, normalize=False):
+        self.feature_dtype = np.dtype(feature_dtype)
+        self.normalize = normalize
+        self.paths = []
+        self._ids = {}
+        self._count = 0
+        self._hashes = np.zeros(capacity, dtype=np.uint64)
+        self._has_hash = np.zeros(capacity, dtype=bool)
+        self._has_features = np.zeros(capacity, dtype=bool)
+        # the width is only known once the first features arrive
+        self._features = None
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, path):
+        return path in self._ids
+
+    def id_of(self, path):
+        """id of a path, the first one if it was added more than once"""
+        return self._ids[path]
+
+    @property
+    def hashes(self):
+        return self._hashes[:self._count]
+
+    @property
+    def has_hash(self):
+        return self._has_hash[:self._count]
+
+    @property
+    def features(self):
+        if self._features is None:
+            return np.empty((self._count, 0), dtype=self.feature_dtype)
+        return self._features[:self._count]
+
+    @property
+    def has_features(self):
+        return self._has_features[:self._count]
+
+    @property
+    def nbytes(self):
+        """memory of the columns, not counting the path strings"""
+        features = 0 if self._features is None else self._features.nbytes
+        return self._hashes.nbytes + self._has_hash.nbytes + self._has_features.nbytes + features
+
+    def _grow(self, needed, dim):
+        size = len(self._hashes)
+        if needed > size:
+            size = max(2 * size, needed)
+            for name in ('_hashes', '_has_hash', '_has_features'):
+                column = getattr(self, name)
+                grown = np.zeros(size, dtype=column.dtype)
+                grown[:self._count] = column[:self._count]
+                setattr(self, name, grown)
+        if dim is not None and (self._features is None or len(self._features) < size):
+            grown = np.zeros((size, dim), dtype=self.feature_dtype)
+            if self._features is not None:
+                grown[:self._count] = self._features[:self._count]
+            self._features = grown
+
+    def add(self, results):
+        """add (path, hash, features) results of new paths and return their ids"""
+        results = list(results)
+        start = self._count
+        dim = self._features.shape[1] if self._features is not None else next(
+            (len(features) for _, _, features in results if features is not None), None)
+        self._grow(start + len(results), dim)
+        ids = np.arange(start, start + len(results))
+        for i, (path, _, _) in zip(ids.tolist(), results):
+            self._ids.setdefault(path, i)
+            self.paths.append(path)
+        self._count += len(results)
+        self.set_hashes(ids, [img_hash for _, img_hash, _ in results])
+        self.set_features(ids, [features for _, _, features in results])
+        return ids
+
+    def set_hashes(self, ids, hashes):
+        """store the hashes of ids that are already in the catalog, None entries are skipped"""
+        hashed = [(i, img_hash) for i, img_hash in zip(np.asarray(ids).tolist(), hashes) if img_hash is not None]
+        if hashed:
+            rows = [i for i, _ in hashed]
+            self._hashes[rows] = pack_hashes(img_hash for _, img_hash in hashed)
+            self._has_hash[rows] = True
+
+    def set_features(self, ids, features):
+        """the same as set_hashes for features"""
+        present = [(i, vector) for i, vector in zip(np.asarray(ids).tolist(), features) if vector is not None]
+        if not present:
+            return
+        rows = [i for i, _ in present]
+        vectors = np.asarray([vector for _, vector in present], dtype=np.float32)
+        if self._features is None:
+            self._grow(self._count, vectors.shape[1])
+        if self.normalize:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors /= np.where(norms == 0, 1, norms)
+        self._features[rows] = vectors
+        self._has_features[rows] = True
+
+    def copy_rows(self, targets, sources):
+        """give the targets the hash and features of the sources, e.g. copies of a file"""
+        targets = np.asarray(targets, dtype=np.int64)
+        sources = np.asarray(sources, dtype=np.int64)
+        self._hashes[targets] = self._hashes[sources]
+        self._has_hash[targets] = self._has_hash[sources]
+        self._has_features[targets] = self._has_features[sources]
+        if self._features is not None:
+            self._features[targets] = self._features[sources]
+
+    def paths_of(self, ids):
+        """paths of an int array of ids"""
+        return [self.paths[i] for i in np.asarray(ids).tolist()]
@@ -0,0 +1,60 @@
+import numpy as np
+
+
+def connected_components(count, pairs):
+    """group ids 0..count-1 into clusters connected by (i, j) pairs
+
+    returns a list of sorted int64 arrays, only clusters with more than one member
+    """
+    parent = list(range(count))
+
+    def find(i):
+        # path halving keeps the trees flat
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in pairs:
+        root_i, root_j = find(int(i)), find(int(j))
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+    roots = np.fromiter((find(i) for i in range(count)), dtype=np.int64, count=count)
+    order = np.argsort(roots, kind='stable')
+    # split the sorted ids wherever the root changes
+    bounds = np.flatnonzero(np.diff(roots[order])) + 1
+    return [group for group in np.split(order, bounds) if len(group) > 1]
+
+
+class UnionFind:
+    """clusters that grow as pairs come in, for reporting groups while a scan runs
+
+    only clusters with more than one member are kept in `groups`, keyed by
+    their root id
+    """
+
+    def __init__(self):
+        self._parent = {}
+        self.groups = {}
+
+    def find(self, i):
+        parent = self._parent
+        while parent.get(i, i) != i:
+            parent[i] = parent.get(parent[i], parent[i])
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        """join the clusters of i and j, returns (root, absorbed root) or None if already joined"""
+        root_i, root_j = self.find(int(i)), self.find(int(j))
+        if root_i == root_j:
+            return None
+        root, absorbed = min(root_i, root_j), max(root_i, root_j)
+        self._parent[absorbed] = root
+        members = self.groups.pop(absorbed, [absorbed])
+        self.groups.setdefault(root, [root]).extend(members)
+        return root, absorbed
+
+    def clusters(self):
+        """the groups like connected_components returns them, sorted int64 arrays ordered by root"""
+        return [np.array(sorted(self.groups[root]), dtype=np.int64) for root in sorted(self.groups)]
@@ -0,0 +1,244 @@
+import os
+import json
+import hashlib
+from collections import namedtuple
+import numpy as np
+from ImageRecognition.utils.feature_index import DEFAULT_THRESHOLD, _normalize
+from ImageRecognition.utils.hash_index import DEFAULT_MAX_DISTANCE, hamming_distance, pack_hashes
+
+# rows of the store compared at once, bounds the memory of a query
+DEFAULT_CHUNK_SIZE = 8192
+
+# query vectors compared with one chunk at once
+DEFAULT_QUERY_CHUNK = 512
+
+# column files of a store directory and their dtypes, vectors use the store dtype
+_COLUMNS = {'hashes': np.uint64, 'keys': np.uint64, 'offsets': np.uint64}
+
+# a new image found in the store: its path, the stored paths it matches, and the packed
+# hashes and normalized features of the image followed by those of the stored ones
+StoreMatch = namedtuple('StoreMatch', ['path', 'stored', 'hashes', 'features'])
+
+
+def path_key(path):
+    """64-bit key of an absolute path, used to skip paths that are already stored"""
+    return int.from_bytes(hashlib.blake2b(os.path.abspath(path).encode(), digest_size=8).digest(), 'little')
+
+
+class EmbeddingStore:
+    """append-only on-disk store of paths, average hashes and normalized features
+
+    meant for a large reference set like an archive of millions of images.
+    every column is a flat binary file that only grows, rows are read back
+    through numpy.memmap, so a query keeps at most `chunk_size` rows in
+    memory however large the store is. meta.json holds the committed row
+    count, rows written after it by an interrupted add are cut off when the
+    store is opened again. the store remembers the backend its features
+    came from and refuses vectors of another size
+    """
+
+    def __init__(self, directory, backend=None, dtype=np.float32):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._meta_path = os.path.join(directory, 'meta.json')
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+            if backend is not None and meta['backend'] is not None and meta['backend'] != backend:
+                raise ValueError(f"the store in {directory} holds {meta['backend']} features, not {backend}")
+        else:
+            meta = {'backend': backend, 'dtype': np.dtype(dtype).name, 'dim': None, 'count': 0, 'path_bytes': 0}
+        self.backend = meta['backend']
+        self.dtype = np.dtype(meta['dtype'])
+        self.dim = meta['dim']
+        self._count = meta['count']
+        self._path_bytes = meta['path_bytes']
+        self._sorted_keys = None
+        self._truncate()
+
+    def _file(self, name):
+        return os.path.join(self.directory, name)
+
+    def _truncate(self):
+        """drop what an interrupted add wrote after the last commit"""
+        sizes = {name: self._count * np.dtype(dtype).itemsize for name, dtype in _COLUMNS.items()}
+        sizes['vectors'] = self._count * (self.dim or 0) * self.dtype.itemsize
+        sizes['paths'] = self._path_bytes
+        for name, size in sizes.items():
+            path = self._file(name)
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+    def _commit(self):
+        meta = {'backend': self.backend, 'dtype': self.dtype.name, 'dim': self.dim,
+                'count': self._count, 'path_bytes': self._path_bytes}
+        with open(self._meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(self._meta_path + '.tmp', self._meta_path)
+
+    def __len__(self):
+        return self._count
+
+    def _column(self, name, dtype, shape=None):
+        """read-only memmap of the committed rows of a column"""
+        shape = shape or (self._count,)
+        if not self._count:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode='r', shape=shape)
+
+    @property
+    def vectors(self):
+        return self._column('vectors', self.dtype, (self._count, self.dim or 0))
+
+    @property
+    def hashes(self):
+        return self._column('hashes', np.uint64)
+
+    def paths_of(self, ids):
+        """paths of an int array of row ids, read through the offsets column"""
+        offsets = self._column('offsets', np.uint64)
+        paths = []
+        with open(self._file('paths'), 'rb') as f:
+            for i in np.asarray(ids).tolist():
+                start = int(offsets[i])
+                end = int(offsets[i + 1]) if i + 1 < self._count else self._path_bytes
+                f.seek(start)
+                paths.append(f.read(end - start).decode('utf-8', 'surrogateescape'))
+        return paths
+
+    def _known(self, keys):
+        """mask of keys that are stored already"""
+        if self._sorted_keys is None:
+            # 8 bytes per row, only loaded when adding
+            self._sorted_keys = np.sort(self._column('keys', np.uint64))
+        positions = np.searchsorted(self._sorted_keys, keys)
+        positions[positions == len(self._sorted_keys)] = 0
+        return self._sorted_keys[positions] == keys if len(self._sorted_keys) else np.zeros(len(keys), dtype=bool)
+
+    def add(self, results, chunk_size=4096):
+        """append (path, hash, features) results, returns the number of new rows
+
+        results without a hash or features and paths that are stored already
+        are skipped. every chunk is committed on its own
+        """
+        added = 0
+        chunk = []
+        for result in results:
+            if result[1] is not None and result[2] is not None:
+                chunk.append(result)
+            if len(chunk) == chunk_size:
+                added += self._add_chunk(chunk)
+                chunk = []
+        if chunk:
+            added += self._add_chunk(chunk)
+        return added
+
+    def _add_chunk(self, results):
+        keys = np.fromiter((path_key(path) for path, _, _ in results), dtype=np.uint64, count=len(results))
+        # new paths, each once
+        _, first = np.unique(keys, return_index=True)
+        new = np.zeros(len(results), dtype=bool)
+        new[first] = True
+        new &= ~self._known(keys)
+        results = [result for result, keep in zip(results, new.tolist()) if keep]
+        if not results:
+            return 0
+        keys = keys[new]
+        vectors = _normalize(np.stack([features for _, _, features in results]))
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f'the store holds {self.dim}-dimensional features, got {vectors.shape[1]}')
+        encoded = [os.path.abspath(path).encode('utf-8', 'surrogateescape') for path, _, _ in results]
+        lengths = np.fromiter((len(path) for path in encoded), dtype=np.uint64, count=len(encoded))
+        offsets = np.uint64(self._path_bytes) + np.concatenate([np.zeros(1, dtype=np.uint64), np.cumsum(lengths)[:-1]])
+        columns = {
+            'vectors': vectors.astype(self.dtype),
+            'hashes': pack_hashes(img_hash for _, img_hash, _ in results),
+            'keys': keys,
+            'offsets': offsets,
+        }
+        for name, column in columns.items():
+            with open(self._file(name), 'ab') as f:
+                f.write(column.tobytes())
+        with open(self._file('paths'), 'ab') as f:
+            f.write(b''.join(encoded))
+        self._count += len(results)
+        self._path_bytes += int(lengths.sum())
+        self._commit()
+        self._sorted_keys = np.sort(np.concatenate([self._sorted_keys, keys]))
+        return len(results)
+
+    def _chunks(self, chunk_size):
+        for start in range(0, self._count, chunk_size):
+            yield start, min(start + chunk_size, self._count)
+
+    def query(self, vectors, threshold=DEFAULT_THRESHOLD, chunk_size=DEFAULT_CHUNK_SIZE, query_chunk=DEFAULT_QUERY_CHUNK):
+        """(query rows, store ids, similarities) of every stored vector similar to a query vector
+
+        the store is read in chunks of chunk_size rows and compared with
+        query_chunk query vectors at a time by one matrix product
+        """
+        queries = _normalize(vectors)
+        found = []
+        stored = self.vectors
+        for start, end in self._chunks(chunk_size):
+            chunk = np.asarray(stored[start:end], dtype=np.float32)
+            for row in range(0, len(queries), query_chunk):
+                similarities = queries[row:row + query_chunk] @ chunk.T
+                rows, cols = np.nonzero(similarities >= threshold)
+                found.append((rows + row, cols + start, similarities[rows, cols]))
+        return self._concatenate(found, np.float32)
+
+    def query_hashes(self, hashes, max_distance=DEFAULT_MAX_DISTANCE, chunk_size=DEFAULT_CHUNK_SIZE,
+                     query_chunk=DEFAULT_QUERY_CHUNK):
+        """(query rows, store ids, distances) of every stored hash within max_distance bits of a query hash"""
+        queries = pack_hashes(hashes)
+        found = []
+        stored = self.hashes
+        for start, end in self._chunks(chunk_size):
+            chunk = np.asarray(stored[start:end])
+            for row in range(0, len(queries), query_chunk):
+                distances = hamming_distance(queries[row:row + query_chunk, np.newaxis], chunk[np.newaxis])
+                rows, cols = np.nonzero(distances <= max_distance)
+                found.append((rows + row, cols + start, distances[rows, cols]))
+        return self._concatenate(found, np.int64)
+
+    def match(self, results, threshold=DEFAULT_THRESHOLD, max_distance=DEFAULT_MAX_DISTANCE, batch_size=4096,
+              chunk_size=DEFAULT_CHUNK_SIZE):
+        """yield a StoreMatch for every (path, hash, features) result that is in the store already
+
+        a stored image matches if its hash is within max_distance bits or its
+        features reach the threshold. results are taken batch_size at a time,
+        so neither side has to fit in memory
+        """
+        batch = []
+        for result in results:
+            if result[1] is not None and result[2] is not None:
+                batch.append(result)
+            if len(batch) == batch_size:
+                yield from self._match_batch(batch, threshold, max_distance, chunk_size)
+                batch = []
+        if batch:
+            yield from self._match_batch(batch, threshold, max_distance, chunk_size)
+
+    def _match_batch(self, results, threshold, max_distance, chunk_size):
+        vectors = _normalize(np.stack([features for _, _, features in results]))
+        hashes = pack_hashes(img_hash for _, img_hash, _ in results)
+        rows, ids, _ = self.query(vectors, threshold, chunk_size)
+        hash_rows, hash_ids, _ = self.query_hashes(hashes, max_distance, chunk_size)
+        matches = {}
+        for row, i in zip(np.concatenate([rows, hash_rows]).tolist(), np.concatenate([ids, hash_ids]).tolist()):
+            matches.setdefault(row, set()).add(i)
+        stored_hashes, stored_vectors = self.hashes, self.vectors
+        for row in sorted(matches):
+            found = sorted(matches[row])
+            yield StoreMatch(results[row][0], self.paths_of(found),
+                             np.concatenate([hashes[row:row + 1], stored_hashes[found]]),
+                             np.concatenate([vectors[row:row + 1], np.asarray(stored_vectors[found], dtype=np.float32)]))
+
+    @staticmethod
+    def _concatenate(found, dtype):
+        if not found:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=dtype)
+        return tuple(np.concatenate(column) for column in zip(*found))
@@ -0,0 +1,262 @@
+from collections import defaultdict
+import numpy as np
+from ImageRecognition.utils.clustering import connected_components
+
+# cosine similarity above which two feature vectors count as duplicates
+DEFAULT_THRESHOLD = 0.95
+
+
+def _normalize(vectors):
+    """scale rows to unit length so dot products are cosine similarities"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[np.newaxis]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class FeatureIndex:
+    """similarity search over feature vectors
+
+    mode 'exact' compares every vector with every other one in blocks of
+    matrix products, mode 'lsh' only compares vectors that share a bucket in
+    one of several random-projection hash tables (sub-quadratic, may miss
+    some pairs). the projections are centered on the mean of the first
+    vectors added, call recenter once the index holds a more typical
+    sample. removed ids are left as tombstones, ids of the other
+    vectors never change. with dtype=np.float16 the vectors take half the
+    memory, they are compared in float32 tile by tile. given a `catalog`
+    with normalize=True, the index keeps no vectors of its own: add_ids
+    indexes catalog rows and the ids are catalog ids
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, mode='exact', block_size=2048, planes=12, tables=10, seed=0,
+                 dtype=np.float32, catalog=None):
+        if mode not in ('exact', 'lsh'):
+            raise ValueError(f"unknown mode {mode!r}, expected 'exact' or 'lsh'")
+        self.threshold = threshold
+        self.mode = mode
+        self.block_size = block_size
+        self.planes = planes
+        self.tables = tables
+        self.seed = seed
+        if catalog is not None and not catalog.normalize:
+            raise ValueError('the catalog must normalize its features, see Catalog(normalize=True)')
+        self.catalog = catalog
+        self.dtype = np.dtype(dtype) if catalog is None else catalog.feature_dtype
+        self._vectors = None
+        self._alive = np.zeros(0, dtype=bool)
+        # ids handed out so far, and how many of them are indexed and not removed
+        self._count = 0
+        self._size = 0
+        self._hyperplanes = None
+        self._center = None
+        # bucket code of every id in every table, remove finds the buckets by it
+        self._row_codes = np.zeros((0, tables), dtype=np.int64)
+        self._buckets = [defaultdict(list) for _ in range(tables)]
+
+    def __len__(self):
+        """number of vectors that were added and not removed"""
+        return self._size
+
+    @property
+    def vectors(self):
+        """normalized vectors added so far"""
+        if self.catalog is not None:
+            return self.catalog.features[:self._count]
+        if self._vectors is None:
+            return np.empty((0, 0), dtype=self.dtype)
+        return self._vectors[:self._count]
+
+    def _grow_alive(self, size):
+        if len(self._alive) < size:
+            alive = np.zeros(max(2 * len(self._alive), size), dtype=bool)
+            alive[:self._count] = self._alive[:self._count]
+            self._alive = alive
+
+    def add(self, vectors):
+        """add vectors to the index and return their ids"""
+        if self.catalog is not None:
+            raise ValueError('an index over a catalog takes catalog ids, use add_ids')
+        vectors = _normalize(vectors)
+        if self._vectors is None:
+            self._vectors = np.empty((max(len(vectors), 1024), vectors.shape[1]), dtype=self.dtype)
+        if self._count + len(vectors) > len(self._vectors):
+            # grow geometrically so repeated adds stay cheap
+            grown = np.empty((max(2 * len(self._vectors), self._count + len(vectors)), vectors.shape[1]), dtype=self.dtype)
+            grown[:self._count] = self._vectors[:self._count]
+            self._vectors = grown
+        self._grow_alive(len(self._vectors))
+        ids = np.arange(self._count, self._count + len(vectors))
+        self._vectors[ids] = vectors
+        self._alive[ids] = True
+        self._count += len(vectors)
+        self._size += len(vectors)
+        self._hash(ids, vectors)
+        return ids
+
+    def add_ids(self, ids):
+        """index rows of the catalog by their catalog ids (increasing, not indexed yet) and return the ids"""
+        if self.catalog is None:
+            raise ValueError('add_ids needs an index over a catalog')
+        ids = np.asarray(ids, dtype=np.int64)
+        self._grow_alive(len(self.catalog))
+        self._alive[ids] = True
+        self._count = len(self.catalog)
+        self._size += len(ids)
+        self._hash(ids, self._rows(ids))
+        return ids
+
+    def _hash(self, ids, vectors):
+        """put new ids into their lsh buckets"""
+        if self.mode != 'lsh' or not len(ids):
+            return
+        codes = self._codes(vectors)
+        if len(self._row_codes) < len(self._alive):
+            grown = np.zeros((len(self._alive), self.tables), dtype=np.int64)
+            grown[:len(self._row_codes)] = self._row_codes
+            self._row_codes = grown
+        self._row_codes[ids] = codes.T
+        for table, table_codes in zip(self._buckets, codes):
+            for i, code in zip(ids.tolist(), table_codes.tolist()):
+                table[code].append(i)
+
+    def recenter(self):
+        """center the projections on the mean of the vectors indexed now and rebuild the buckets"""
+        if self.mode != 'lsh':
+            return
+        ids = np.flatnonzero(self._alive[:self._count])
+        if not len(ids):
+            return
+        total = np.zeros(self._rows(ids[:1]).shape[1], dtype=np.float64)
+        for start in range(0, len(ids), self.block_size):
+            total += self._rows(ids[start:start + self.block_size]).sum(axis=0)
+        self._center = (total / len(ids)).astype(np.float32)
+        self._buckets = [defaultdict(list) for _ in range(self.tables)]
+        for start in range(0, len(ids), self.block_size):
+            block = ids[start:start + self.block_size]
+            self._hash(block, self._rows(block))
+
+    def remove(self, ids):
+        """remove vectors by id, the id is not reused"""
+        ids = np.asarray(ids, dtype=np.int64)
+        ids = ids[self._alive[ids]]
+        self._alive[ids] = False
+        self._size -= len(ids)
+        if self.mode == 'lsh' and len(ids):
+            # the codes they were filed under, float16 rows may not hash the same way again
+            for table, codes in zip(self._buckets, self._row_codes[ids].T):
+                for i, code in zip(ids.tolist(), codes.tolist()):
+                    bucket = table[code]
+                    bucket.remove(i)
+                    if not bucket:
+                        del table[code]
+
+    def _rows(self, ids):
+        """stored vectors as float32"""
+        vectors = self.catalog.features if self.catalog is not None else self._vectors
+        return vectors[ids].astype(np.float32, copy=False)
+
+    def _codes(self, vectors):
+        """bucket code of every vector in every table, shape (tables, n)"""
+        if self._hyperplanes is None:
+            rng = np.random.default_rng(self.seed)
+            self._hyperplanes = rng.standard_normal((self.tables, vectors.shape[1], self.planes)).astype(np.float32)
+        if self._center is None:
+            # cnn features are non-negative, hashing around their mean spreads
+            # them over the buckets instead of piling them into a few
+            self._center = vectors.mean(axis=0)
+        bits = np.einsum('nd,tdp->tnp', vectors - self._center, self._hyperplanes) > 0
+        return bits.astype(np.int64) @ (1 << np.arange(self.planes, dtype=np.int64))
+
+    def query(self, vector):
+        """ids and similarities of the indexed vectors similar to `vector`"""
+        vector = _normalize(vector)[0]
+        if self.mode == 'exact':
+            candidates = np.flatnonzero(self._alive[:self._count])
+        else:
+            codes = self._codes(vector[np.newaxis])[:, 0]
+            candidates = np.unique(np.fromiter(
+                (i for table, code in zip(self._buckets, codes.tolist()) for i in table.get(code, ())),
+                dtype=np.int64,
+            ))
+        similarities = self._rows(candidates) @ vector if len(candidates) else np.empty(0, dtype=np.float32)
+        keep = similarities >= self.threshold
+        return candidates[keep], similarities[keep]
+
+    def pairs_with(self, ids):
+        """similar pairs (i, j, similarity) of the given ids j and the ids i < j added before them"""
+        ids = np.asarray(ids, dtype=np.int64)
+        found = []
+        if self.mode == 'exact':
+            for row in range(0, len(ids), self.block_size):
+                row_ids = ids[row:row + self.block_size]
+                row_vectors = self._rows(row_ids)
+                for col in range(0, row_ids.max(), self.block_size):
+                    col_ids = np.arange(col, min(col + self.block_size, row_ids.max()))
+                    similarities = row_vectors @ self._rows(col_ids).T
+                    similar = (similarities >= self.threshold) & (col_ids[np.newaxis] < row_ids[:, np.newaxis])
+                    similar &= self._alive[col_ids][np.newaxis]
+                    rows, cols = np.nonzero(similar)
+                    found.append((col_ids[cols], row_ids[rows], similarities[rows, cols]))
+        else:
+            for j in ids.tolist():
+                candidates, similarities = self.query(self._rows(j))
+                earlier = candidates < j
+                found.append((candidates[earlier], np.full(earlier.sum(), j, dtype=np.int64), similarities[earlier]))
+        if not found:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        return tuple(np.concatenate(column) for column in zip(*found))
+
+    def pairs(self):
+        """all (i, j, similarity) with i < j and similarity above the threshold"""
+        if self.mode == 'exact':
+            found = self._exact_pairs()
+        else:
+            found = self._lsh_pairs()
+        if not found:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        left = np.concatenate([f[0] for f in found])
+        right = np.concatenate([f[1] for f in found])
+        similarities = np.concatenate([f[2] for f in found])
+        if self.mode == 'lsh':
+            # the same pair can be found in several tables
+            _, unique = np.unique(left * self._count + right, return_index=True)
+            left, right, similarities = left[unique], right[unique], similarities[unique]
+        return left, right, similarities
+
+    def _pairs_within(self, ids):
+        """similar pairs among sorted ids, compared tile by tile"""
+        found = []
+        for row in range(0, len(ids), self.block_size):
+            row_ids = ids[row:row + self.block_size]
+            row_vectors = self._rows(row_ids)
+            # only tiles on or right of the diagonal, so every pair is seen once
+            for col in range(row, len(ids), self.block_size):
+                col_ids = ids[col:col + self.block_size]
+                similarities = row_vectors @ self._rows(col_ids).T
+                similar = similarities >= self.threshold
+                if col == row:
+                    similar = np.triu(similar, k=1)
+                rows, cols = np.nonzero(similar)
+                if len(rows):
+                    found.append((row_ids[rows], col_ids[cols], similarities[rows, cols]))
+        return found
+
+    def _exact_pairs(self):
+        return self._pairs_within(np.flatnonzero(self._alive[:self._count]))
+
+    def _lsh_pairs(self):
+        found = []
+        for table in self._buckets:
+            for ids in table.values():
+                if len(ids) > 1:
+                    # ids are appended in increasing order, so they stay sorted
+                    found.extend(self._pairs_within(np.asarray(ids, dtype=np.int64)))
+        return found
+
+    def clusters(self):
+        """groups of ids connected by similar pairs, as int arrays"""
+        left, right, _ = self.pairs()
+        return connected_components(self._count, zip(left, right))
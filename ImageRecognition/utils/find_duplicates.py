@@ -1,27 +1,351 @@
-from collections import defaultdict
-from multiprocessing import Pool, cpu_count
-from ImageRecognition.image_processing.hash_images import process_image
-from ImageRecognition.model.model import initialize_model
-
-
-def find_duplicates(images):
-    """find duplicate images based on hashes and features"""
-    hash_dict = defaultdict(list)
-    feature_dict = defaultdict(list)
-    # process images in batches
-    batch_size = 64
-    for i in range(0, len(images), batch_size):
-        batch = images[i:i+batch_size]
-        # use multiprocessing to process images in parallel
-        with Pool(cpu_count(), initializer=initialize_model) as pool:
-            results = pool.map(process_image, [img[1] for img in batch])
-        for path, img_hash, features in results:
-            if img_hash is not None:
-                hash_dict[img_hash].append(path)
-            if features is not None:
-                feature_dict[tuple(features)].append(path)
-    # find duplicates based on hashes
-    hash_duplicates = [paths for paths in hash_dict.values() if len(paths) > 1]
-    # find duplicates based on features
-    feature_duplicates = [paths for paths in feature_dict.values() if len(paths) > 1]
-    return hash_duplicates, feature_duplicates
\ No newline at end of file
+import os
+import time
+from array import array
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+import numpy as np
+from ImageRecognition.image_processing.hash_images import hash_image
+from ImageRecognition.image_processing.load_images import ImageRecord
+from ImageRecognition.utils.cache import file_digest
+from ImageRecognition.utils import instrumentation
+from ImageRecognition.utils.catalog import Catalog
+from ImageRecognition.utils.clustering import connected_components, UnionFind
+from ImageRecognition.utils.feature_index import FeatureIndex, DEFAULT_THRESHOLD
+from ImageRecognition.utils.hash_index import HashIndex, DEFAULT_MAX_DISTANCE
+from ImageRecognition.utils.worker_pool import FeatureExtractor
+
+# hash distance up to which the cascade asks the model for a second opinion
+DEFAULT_CANDIDATE_DISTANCE = 8
+
+# how many images a stage of the cascade looked at and settled, and how long it took
+StageStats = namedtuple('StageStats', ['name', 'images', 'resolved', 'seconds'])
+
+
+def _path_of(item):
+    """path of a plain path, an ImageRecord or an (image, path) tuple"""
+    if isinstance(item, str):
+        return item
+    if isinstance(item, ImageRecord):
+        return item.path
+    return item[1]
+
+
+class ScanCancelled(Exception):
+    """raised by find_duplicates when its `cancel` event was set"""
+
+
+def _iter_extract(paths, batch_size, workers, extractor, on_quarantine=None, cancel=None):
+    """hash and extract features of paths with the given or a new extractor, as results arrive"""
+    if extractor is None:
+        with FeatureExtractor(workers=workers, batch_size=batch_size) as extractor:
+            yield from extractor.map(paths, on_quarantine, cancel)
+    else:
+        yield from extractor.map(paths, on_quarantine, cancel)
+
+
+def _iter_extract_cached(paths, batch_size, workers, extractor, cache, cancel=None):
+    """like _iter_extract, but cached and quarantined files are not sent to the workers
+
+    files that crash or hang a worker are quarantined in the cache, so a
+    resumed scan skips them
+    """
+    if cache is None:
+        yield from _iter_extract(paths, batch_size, workers, extractor, cancel=cancel)
+        return
+    # cached files are collected while the rest streams to the workers
+    cached = []
+    reported = 0
+    try:
+        for result in _iter_extract(cache.iter_missing(paths, cached), batch_size, workers, extractor, cache.quarantine,
+                                    cancel):
+            cache.store(*result)
+            yield result
+            # the feeder thread appends to `cached`, report what it found so far
+            while reported < len(cached):
+                yield cached[reported]
+                reported += 1
+        yield from cached[reported:]
+    finally:
+        # keep what was processed even if the scan was cancelled
+        cache.commit()
+
+
+def _extract_cached(paths, batch_size, workers, extractor, cache):
+    """all results of _iter_extract_cached as a list"""
+    return list(_iter_extract_cached(paths, batch_size, workers, extractor, cache))
+
+
+def extract_features(images, batch_size=32, workers=None, extractor=None, cache=None):
+    """(path, hash, features) of paths, ImageRecords or (image, path) tuples as the results arrive
+
+    cached files are not sent to the workers
+    """
+    return _iter_extract_cached((_path_of(item) for item in images), batch_size, workers, extractor, cache)
+
+
+def _new_results(results, catalog):
+    """results of paths that are not in the catalog yet, each path once"""
+    seen = set()
+    new = []
+    for result in results:
+        if result[0] not in catalog and result[0] not in seen:
+            seen.add(result[0])
+            new.append(result)
+    return new
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def find_duplicate_ids(images, batch_size=32, workers=None, extractor=None,
+                       feature_threshold=DEFAULT_THRESHOLD, feature_mode='exact', cache=None,
+                       hash_distance=DEFAULT_MAX_DISTANCE, feature_dtype=np.float32,
+                       progress=None, on_group=None, cancel=None, catalog=None):
+    """like find_duplicates, but returns (catalog, hash groups, feature groups)
+
+    the results are kept in a Catalog and the groups are int arrays of
+    catalog ids, so nothing per image is held in python objects except the
+    path. a path listed twice is only processed once. pass an empty
+    `catalog` with normalize=True to look up the members of the groups given
+    to on_group. the feature index compares the catalog's rows in place
+    """
+    catalog = catalog if catalog is not None else Catalog(feature_dtype, normalize=True)
+    # catalog id of every id in the hash index
+    hash_rows = array('q')
+    hash_index = HashIndex(max_distance=hash_distance)
+    feature_index = FeatureIndex(threshold=feature_threshold, mode=feature_mode, catalog=catalog)
+    if on_group is not None:
+        hash_groups, hash_reported = UnionFind(), set()
+        feature_groups, feature_reported = UnionFind(), set()
+    done = 0
+    paths = (_path_of(item) for item in images)
+    # the workers stop on cancel too, so a scan waiting for them ends right away
+    results = _iter_extract_cached(paths, batch_size, workers, extractor, cache, cancel)
+    for chunk in _chunks(results, batch_size):
+        if cancel is not None and cancel.is_set():
+            results.close()
+            raise ScanCancelled(f'cancelled after {done} images')
+        done += len(chunk)
+        ids = catalog.add(_new_results(chunk, catalog))
+        new_hashes = ids[catalog.has_hash[ids]]
+        new_features = feature_index.add_ids(ids[catalog.has_features[ids]])
+        hash_rows.extend(new_hashes.tolist())
+        if on_group is not None:
+            # match every new image against the ones seen so far and report the groups it joins
+            if len(new_hashes):
+                with instrumentation.stage('match hashes'):
+                    left, right, _ = hash_index.pairs_with(hash_index.add(catalog.hashes[new_hashes]))
+                _report_groups(hash_groups, hash_reported, zip(left.tolist(), right.tolist()), 'hash',
+                               lambda group: catalog.paths_of([hash_rows[i] for i in group]), on_group)
+            if len(new_features):
+                with instrumentation.stage('match features'):
+                    left, right, _ = feature_index.pairs_with(new_features)
+                _report_groups(feature_groups, feature_reported, zip(left.tolist(), right.tolist()), 'feature',
+                               catalog.paths_of, on_group)
+        if progress is not None:
+            progress(done)
+    if cancel is not None and cancel.is_set():
+        # the results ended early because of it
+        raise ScanCancelled(f'cancelled after {done} images')
+    hash_rows = np.frombuffer(hash_rows, dtype=np.int64) if hash_rows else np.empty(0, dtype=np.int64)
+    if on_group is not None:
+        # every pair was joined while streaming, the groups are complete already
+        return catalog, [hash_rows[cluster] for cluster in hash_groups.clusters()], feature_groups.clusters()
+    # without streaming every image is compared at once, which is faster
+    hash_index.add(catalog.hashes[hash_rows])
+    with instrumentation.stage('match hashes'):
+        hash_groups = [hash_rows[cluster] for cluster in hash_index.clusters()]
+    with instrumentation.stage('match features'):
+        feature_groups = feature_index.clusters()
+    return catalog, hash_groups, feature_groups
+
+
+def find_duplicates(images, batch_size=32, workers=None, extractor=None,
+                    feature_threshold=DEFAULT_THRESHOLD, feature_mode='exact', cache=None,
+                    hash_distance=DEFAULT_MAX_DISTANCE, progress=None, on_group=None, cancel=None):
+    """find duplicate images based on hashes and features
+
+    hash duplicates are clusters of images whose average hashes differ in at
+    most `hash_distance` bits, feature duplicates are clusters of images
+    whose feature vectors have a cosine similarity of at least
+    `feature_threshold` (directly or through other members of the cluster).
+    the same worker processes are used for the whole run,
+    pass an already started `extractor` to reuse its workers across calls.
+    with a `cache` only new or changed files are processed.
+
+    `images` may be any iterable of paths, ImageRecord objects (see
+    iter_images) or (image, path) tuples, it is consumed lazily
+
+    for long scans `progress(done)` is called with the number of images
+    processed so far, `on_group(kind, group, paths, absorbed)` whenever a
+    'hash' or 'feature' cluster is found or grows (`absorbed` lists the ids
+    of already reported clusters that were merged into `group`) and setting
+    the `cancel` event stops the scan with ScanCancelled
+    """
+    catalog, hash_groups, feature_groups = find_duplicate_ids(
+        images, batch_size=batch_size, workers=workers, extractor=extractor,
+        feature_threshold=feature_threshold, feature_mode=feature_mode, cache=cache, hash_distance=hash_distance,
+        progress=progress, on_group=on_group, cancel=cancel,
+    )
+    hash_duplicates = [catalog.paths_of(group) for group in hash_groups]
+    feature_duplicates = [catalog.paths_of(group) for group in feature_groups]
+    return hash_duplicates, feature_duplicates
+
+
+def _report_groups(groups, reported, pairs, kind, paths_of, on_group):
+    """join the pairs and call on_group once for every cluster that changed"""
+    changed = {}
+    for i, j in pairs:
+        merged = groups.union(i, j)
+        if merged is None:
+            continue
+        root, absorbed = merged
+        gone = changed.pop(absorbed, [])
+        if absorbed in reported:
+            reported.discard(absorbed)
+            gone.append(absorbed)
+        changed.setdefault(root, []).extend(gone)
+    for root, absorbed in changed.items():
+        reported.add(root)
+        on_group(kind, root, paths_of(sorted(groups.groups[root])), absorbed)
+
+
+def _group_by(ids, key):
+    """groups of more than one id with the same key, ids whose key fails are left out"""
+    groups = defaultdict(list)
+    for i in ids:
+        try:
+            groups[key(i)].append(i)
+        except OSError:
+            continue
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def _head_digest(path, head=1 << 16):
+    """digest of the first 64 KiB, enough to tell most same-sized files apart"""
+    with open(path, 'rb') as f:
+        return hash(f.read(head))
+
+
+def _identical_files(paths, sizes):
+    """groups of byte-identical files - by size first, then head digest, then full digest"""
+    groups = _group_by(range(len(paths)), lambda i: sizes[i])
+    groups = [g for group in groups for g in _group_by(group, lambda i: _head_digest(paths[i]))]
+    return [g for group in groups for g in _group_by(group, lambda i: file_digest(paths[i]))]
+
+
+def _size_of(item):
+    """file size, unreadable files get a negative size that matches nothing"""
+    try:
+        return os.path.getsize(_path_of(item))
+    except OSError:
+        return -1 - id(item)
+
+
+def _hash_all(paths, workers, cache):
+    """average hashes of paths, from the cache where possible"""
+    hashes = [None] * len(paths)
+    todo = []
+    for i, path in enumerate(paths):
+        entry = cache.lookup(path) if cache is not None else None
+        if entry is None:
+            todo.append(i)
+        else:
+            hashes[i] = entry[0]
+    # pil releases the gil while decoding, so threads are enough here
+    with ThreadPoolExecutor(workers or cpu_count()) as pool:
+        for i, (_, img_hash) in zip(todo, pool.map(hash_image, [paths[i] for i in todo])):
+            hashes[i] = img_hash
+    return hashes
+
+
+def find_duplicate_ids_cascade(images, confirm_distance=DEFAULT_MAX_DISTANCE, candidate_distance=DEFAULT_CANDIDATE_DISTANCE,
+                               feature_threshold=DEFAULT_THRESHOLD, batch_size=32, workers=None, extractor=None, cache=None):
+    """like find_duplicates_cascade, but returns (catalog, groups, stats)
+
+    the catalog holds the hash of every image and the features of the ones
+    that went through the model, copies share those of their original. the
+    groups are int arrays of catalog ids, so reports can show the distances
+    """
+    items = list(images)
+    # every image gets its row up front, the stages fill in what they compute
+    catalog = Catalog(normalize=True)
+    ids = catalog.add((_path_of(item), None, None) for item in items)
+    paths = catalog.paths
+    stats = []
+    edges = []
+
+    # stage 1 - byte-identical files, only one of each group goes on
+    start = time.perf_counter()
+    sizes = [item.size if isinstance(item, ImageRecord) else _size_of(item) for item in items]
+    copies = array('q')
+    # the member of its group that goes on, for every copy
+    originals = array('q')
+    for group in _identical_files(paths, sizes):
+        edges.extend((group[0], i) for i in group[1:])
+        copies.extend(group[1:])
+        originals.extend([group[0]] * (len(group) - 1))
+    copies = np.frombuffer(copies, dtype=np.int64) if copies else np.empty(0, dtype=np.int64)
+    originals = np.frombuffer(originals, dtype=np.int64) if originals else np.empty(0, dtype=np.int64)
+    remaining = np.setdiff1d(ids, copies)
+    stats.append(StageStats('identical files', len(paths), len(copies), time.perf_counter() - start))
+
+    # stage 2 - perceptual hashes
+    start = time.perf_counter()
+    catalog.set_hashes(remaining, _hash_all(catalog.paths_of(remaining), workers, cache))
+    hashed = remaining[catalog.has_hash[remaining]]
+    hash_index = HashIndex(max_distance=candidate_distance)
+    hash_index.add(catalog.hashes[hashed])
+    left, right, distances = hash_index.pairs()
+    left, right = hashed[left], hashed[right]
+    close = distances <= confirm_distance
+    edges.extend(zip(left[close].tolist(), right[close].tolist()))
+    left, right = left[~close], right[~close]
+    # images in a borderline pair are the only ones that still need the model
+    unsettled = np.union1d(left, right)
+    stats.append(StageStats('perceptual hash', len(remaining), len(remaining) - len(unsettled), time.perf_counter() - start))
+
+    # stage 3 - cnn features for the borderline pairs
+    start = time.perf_counter()
+    results = _extract_cached(catalog.paths_of(unsettled), batch_size, workers, extractor, cache)
+    catalog.set_features([catalog.id_of(path) for path, _, _ in results], [vector for _, _, vector in results])
+    # the catalog keeps unit vectors, so the row products are cosines
+    both = catalog.has_features[left] & catalog.has_features[right]
+    left, right = left[both], right[both]
+    similarities = np.einsum('nd,nd->n', catalog.features[left].astype(np.float32),
+                             catalog.features[right].astype(np.float32))
+    similar = similarities >= feature_threshold
+    edges.extend(zip(left[similar].tolist(), right[similar].tolist()))
+    stats.append(StageStats('cnn features', len(unsettled), len(unsettled), time.perf_counter() - start))
+
+    # copies share the hash and features of the member that went on
+    catalog.copy_rows(copies, originals)
+    return catalog, connected_components(len(catalog), edges), stats
+
+
+def find_duplicates_cascade(images, confirm_distance=DEFAULT_MAX_DISTANCE, candidate_distance=DEFAULT_CANDIDATE_DISTANCE,
+                            feature_threshold=DEFAULT_THRESHOLD, batch_size=32, workers=None, extractor=None, cache=None):
+    """find duplicate images with the cheap checks first and the model last
+
+    1. files with the same size and content digest are byte-identical copies
+    2. average hashes within `confirm_distance` bits are duplicates, images
+       with no other hash within `candidate_distance` bits are unique
+    3. only the images of the pairs in between go through the model, the pair
+       is a duplicate if the cosine similarity reaches `feature_threshold`
+
+    returns the duplicate clusters (lists of paths) and a StageStats per stage
+    """
+    catalog, groups, stats = find_duplicate_ids_cascade(
+        images, confirm_distance=confirm_distance, candidate_distance=candidate_distance,
+        feature_threshold=feature_threshold, batch_size=batch_size, workers=workers, extractor=extractor, cache=cache,
+    )
+    return [catalog.paths_of(group) for group in groups], stats
@@ -0,0 +1,168 @@
+import itertools
+from collections import defaultdict
+import numpy as np
+from ImageRecognition.utils.clustering import connected_components
+
+# hamming distance up to which two 64-bit hashes count as duplicates
+DEFAULT_MAX_DISTANCE = 2
+
+# number of set bits of every byte value
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def pack_hashes(hashes):
+    """pack ImageHash objects (or ints) into a uint64 array"""
+    return np.fromiter((h if isinstance(h, (int, np.integer)) else int(str(h), 16) for h in hashes), dtype=np.uint64)
+
+
+def hamming_distance(a, b):
+    """number of differing bits between uint64 values (broadcasts like a ^ b)"""
+    xor = np.ascontiguousarray(np.bitwise_xor(a, b), dtype=np.uint64)
+    return _POPCOUNT[xor.view(np.uint8)].reshape(xor.shape + (8,)).sum(axis=-1, dtype=np.int64)
+
+
+class HashIndex:
+    """radius search over 64-bit perceptual hashes with multi-index hashing
+
+    the hash is split into max_distance + 1 bands. two hashes within
+    max_distance bits must agree on at least one whole band, so only hashes
+    sharing a band value are ever compared. removed ids are left as
+    tombstones, ids of the other hashes never change
+    """
+
+    def __init__(self, max_distance=DEFAULT_MAX_DISTANCE, block_size=2048):
+        if not 0 <= max_distance < 64:
+            raise ValueError('max_distance must be between 0 and 63')
+        self.max_distance = max_distance
+        self.block_size = block_size
+        bands = max_distance + 1
+        widths = [64 // bands + (1 if i < 64 % bands else 0) for i in range(bands)]
+        self._shifts = np.cumsum([0] + widths[:-1]).astype(np.uint64)
+        self._masks = np.array([(1 << width) - 1 for width in widths], dtype=np.uint64)
+        self._hashes = np.empty(1024, dtype=np.uint64)
+        self._alive = np.zeros(1024, dtype=bool)
+        self._count = 0
+        self._removed = 0
+        self._buckets = [defaultdict(list) for _ in range(bands)]
+
+    def __len__(self):
+        """number of hashes that were added and not removed"""
+        return self._count - self._removed
+
+    @property
+    def hashes(self):
+        """packed hashes added so far"""
+        return self._hashes[:self._count]
+
+    def _bands(self, hashes):
+        """band values of every hash, shape (bands, n)"""
+        return (hashes[np.newaxis] >> self._shifts[:, np.newaxis]) & self._masks[:, np.newaxis]
+
+    def add(self, hashes):
+        """add hashes (ImageHash objects, ints or a uint64 array) and return their ids"""
+        if not isinstance(hashes, np.ndarray):
+            hashes = pack_hashes(hashes)
+        hashes = hashes.astype(np.uint64, copy=False)
+        if self._count + len(hashes) > len(self._hashes):
+            size = max(2 * len(self._hashes), self._count + len(hashes))
+            grown = np.empty(size, dtype=np.uint64)
+            grown[:self._count] = self.hashes
+            self._hashes = grown
+            alive = np.zeros(size, dtype=bool)
+            alive[:self._count] = self._alive[:self._count]
+            self._alive = alive
+        ids = np.arange(self._count, self._count + len(hashes))
+        self._hashes[ids] = hashes
+        self._alive[ids] = True
+        self._count += len(hashes)
+        for table, values in zip(self._buckets, self._bands(hashes)):
+            for i, value in zip(ids.tolist(), values.tolist()):
+                table[value].append(i)
+        return ids
+
+    def remove(self, ids):
+        """remove hashes by id, the id is not reused"""
+        ids = np.asarray(ids, dtype=np.int64)
+        ids = ids[self._alive[ids]]
+        self._alive[ids] = False
+        self._removed += len(ids)
+        # take them out of the buckets so the buckets only hold live ids
+        for table, values in zip(self._buckets, self._bands(self._hashes[ids])):
+            for i, value in zip(ids.tolist(), values.tolist()):
+                bucket = table[value]
+                bucket.remove(i)
+                if not bucket:
+                    del table[value]
+
+    def query(self, img_hash, max_distance=None):
+        """ids and distances of the indexed hashes within max_distance of img_hash"""
+        if max_distance is None:
+            max_distance = self.max_distance
+        if max_distance > self.max_distance:
+            raise ValueError('the index only guarantees results up to its own max_distance')
+        value = pack_hashes([img_hash])
+        candidates = np.unique(np.fromiter(
+            (i for table, band in zip(self._buckets, self._bands(value)[:, 0].tolist()) for i in table.get(band, ())),
+            dtype=np.int64,
+        ))
+        distances = hamming_distance(self._hashes[candidates], value[0])
+        keep = distances <= max_distance
+        return candidates[keep], distances[keep]
+
+    def pairs_with(self, ids):
+        """close pairs (i, j, distance) of the given ids j and the ids i < j added before them"""
+        found = []
+        for j in np.asarray(ids, dtype=np.int64).tolist():
+            candidates, distances = self.query(self._hashes[j])
+            earlier = candidates < j
+            found.append((candidates[earlier], np.full(earlier.sum(), j, dtype=np.int64), distances[earlier]))
+        if not found:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return tuple(np.concatenate(column) for column in zip(*found))
+
+    def pairs(self):
+        """all (i, j, distance) with i < j and distance up to max_distance"""
+        found = []
+        for table in self._buckets:
+            for ids in table.values():
+                if len(ids) > 1:
+                    found.extend(self._pairs_within(np.asarray(ids, dtype=np.int64)))
+        if not found:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        left = np.concatenate([f[0] for f in found])
+        right = np.concatenate([f[1] for f in found])
+        distances = np.concatenate([f[2] for f in found])
+        # the same pair can share several bands
+        _, unique = np.unique(left * self._count + right, return_index=True)
+        return left[unique], right[unique], distances[unique]
+
+    def _pairs_within(self, ids):
+        """close pairs among sorted ids, compared tile by tile"""
+        found = []
+        for row in range(0, len(ids), self.block_size):
+            row_ids = ids[row:row + self.block_size]
+            row_hashes = self._hashes[row_ids][:, np.newaxis]
+            for col in range(row, len(ids), self.block_size):
+                col_ids = ids[col:col + self.block_size]
+                distances = hamming_distance(row_hashes, self._hashes[col_ids][np.newaxis])
+                close = distances <= self.max_distance
+                if col == row:
+                    close = np.triu(close, k=1)
+                rows, cols = np.nonzero(close)
+                if len(rows):
+                    found.append((row_ids[rows], col_ids[cols], distances[rows, cols]))
+        return found
+
+    def clusters(self):
+        """groups of ids connected by close pairs, as int arrays"""
+        # identical hashes are common (copies, blank images), compare every
+        # distinct value once and attach all its ids to the first one
+        alive = np.flatnonzero(self._alive[:self._count])
+        values, first, inverse = np.unique(self._hashes[alive], return_index=True, return_inverse=True)
+        first = alive[first]
+        distinct = HashIndex(self.max_distance, self.block_size)
+        distinct.add(values)
+        left, right, _ = distinct.pairs()
+        same = zip(alive.tolist(), first[inverse].tolist())
+        close = zip(first[left].tolist(), first[right].tolist())
+        return connected_components(self._count, itertools.chain(same, close))
@@ -0,0 +1,234 @@
+import contextlib
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+# per-stage timers and counters for the image pipeline
+#
+# everything is off by default, stage() then returns a shared no-op context
+# and count() returns right away, so the calls can stay in the hot paths.
+# after enable() every stage records its calls and time, and optionally a
+# cProfile or the tracemalloc peak of the stages named in `profile_stages`.
+# worker processes send their numbers back with the results, see take() and
+# merge(). cProfile data travels as the raw pstats dict, which pickles but is
+# not json, so it is part of take() and not of snapshot()
+
+PROFILERS = ('cprofile', 'tracemalloc')
+
+_NULL_STAGE = contextlib.nullcontext()
+
+# the active Stats, None while disabled
+_stats = None
+
+
+class _ProfileData:
+    """raw pstats data in the shape pstats.Stats() loads"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def _add_profile(total, data):
+    """add raw pstats data into total"""
+    for func, stat in data.items():
+        total[func] = pstats.add_func_stats(total[func], stat) if func in total else stat
+    return total
+
+
+class Stats:
+    def __init__(self, profile=None, profile_stages=()):
+        if profile not in (None,) + PROFILERS:
+            raise ValueError(f'unknown profiler {profile!r}, choose from {", ".join(PROFILERS)}')
+        self.profile = profile
+        self.profile_stages = set(profile_stages)
+        # stage -> [calls, seconds, max seconds]
+        self.timers = defaultdict(lambda: [0, 0.0, 0.0])
+        self.counters = defaultdict(int)
+        # stage -> largest tracemalloc peak in bytes
+        self.memory = {}
+        # stage -> cProfile.Profile
+        self.profiles = {}
+        # stage -> raw pstats data merged from other processes
+        self.profile_data = {}
+        self._lock = threading.Lock()
+
+    def add_time(self, name, seconds, calls=1):
+        with self._lock:
+            timer = self.timers[name]
+            timer[0] += calls
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds if calls == 1 else 0.0)
+
+    def add_count(self, name, value):
+        with self._lock:
+            self.counters[name] += value
+
+    def snapshot(self):
+        """timers, counters and memory peaks as plain json-friendly data"""
+        with self._lock:
+            return {
+                'timers': {name: {'calls': calls, 'seconds': seconds, 'max_seconds': longest}
+                           for name, (calls, seconds, longest) in self.timers.items()},
+                'counters': dict(self.counters),
+                'memory_peak_bytes': dict(self.memory),
+            }
+
+    def merge(self, snapshot):
+        """add a snapshot taken in another process"""
+        with self._lock:
+            for name, timer in snapshot['timers'].items():
+                total = self.timers[name]
+                total[0] += timer['calls']
+                total[1] += timer['seconds']
+                total[2] = max(total[2], timer['max_seconds'])
+            for name, value in snapshot['counters'].items():
+                self.counters[name] += value
+            for name, peak in snapshot['memory_peak_bytes'].items():
+                self.memory[name] = max(self.memory.get(name, 0), peak)
+            for name, data in snapshot.get('profiles', {}).items():
+                _add_profile(self.profile_data.setdefault(name, {}), data)
+
+    def profile_stats(self):
+        """stage -> raw pstats data of this process and the merged ones"""
+        with self._lock:
+            combined = {name: dict(data) for name, data in self.profile_data.items()}
+            for name, profiler in self.profiles.items():
+                _add_profile(combined.setdefault(name, {}), pstats.Stats(profiler).stats)
+        return combined
+
+
+class _Stage:
+    __slots__ = ('stats', 'name', 'start', 'profiler', 'memory_start')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+        self.profiler = None
+        self.memory_start = None
+        if name in stats.profile_stages and stats.profile == 'tracemalloc':
+            # read here and kept whole: the with statement frees its bound __enter__ right after
+            # the call, and the tuple is made after the counters are read, freeing either inside
+            # the stage would count against it
+            tracemalloc.reset_peak()
+            self.memory_start = tracemalloc.get_traced_memory()
+
+    def __enter__(self):
+        stats = self.stats
+        if self.name in stats.profile_stages and stats.profile == 'cprofile':
+            self.profiler = stats.profiles.setdefault(self.name, cProfile.Profile())
+            self.profiler.enable()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        stats = self.stats
+        if self.profiler is not None:
+            self.profiler.disable()
+        elif self.memory_start is not None:
+            peak = tracemalloc.get_traced_memory()[1] - self.memory_start[0]
+            stats.memory[self.name] = max(stats.memory.get(self.name, 0), peak)
+        stats.add_time(self.name, elapsed)
+        return False
+
+
+def enable(profile=None, profile_stages=()):
+    """start collecting, `profile` is 'cprofile' or 'tracemalloc' for the stages in profile_stages"""
+    global _stats
+    _stats = Stats(profile, profile_stages)
+    if profile == 'tracemalloc' and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return _stats
+
+
+def disable():
+    global _stats
+    if _stats is not None and _stats.profile == 'tracemalloc' and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _stats = None
+
+
+def enabled():
+    return _stats is not None
+
+
+def settings():
+    """what enable() was called with, to start workers the same way, None while disabled"""
+    if _stats is None:
+        return None
+    return _stats.profile, tuple(_stats.profile_stages)
+
+
+def stage(name):
+    """context manager timing one call of a pipeline stage"""
+    if _stats is None:
+        return _NULL_STAGE
+    return _Stage(_stats, name)
+
+
+def add_time(name, seconds, calls=1):
+    """record time measured elsewhere, e.g. waiting on a queue"""
+    if _stats is not None:
+        _stats.add_time(name, seconds, calls)
+
+
+def count(name, value=1):
+    if _stats is not None:
+        _stats.add_count(name, value)
+
+
+def take():
+    """snapshot of the numbers and profiles so far and start again from zero, None while disabled"""
+    global _stats
+    if _stats is None:
+        return None
+    snapshot = _stats.snapshot()
+    profiles = _stats.profile_stats()
+    if profiles:
+        snapshot['profiles'] = profiles
+    _stats = Stats(_stats.profile, _stats.profile_stages)
+    return snapshot
+
+
+def merge(snapshot):
+    if _stats is not None and snapshot is not None:
+        _stats.merge(snapshot)
+
+
+def snapshot():
+    return _stats.snapshot() if _stats is not None else None
+
+
+def dump_json(path):
+    """write the snapshot for dashboards"""
+    with open(path, 'w') as f:
+        json.dump(snapshot(), f, indent=2, sort_keys=True)
+
+
+def report(file=None, top=15):
+    """human readable summary of the stages and counters"""
+    data = snapshot()
+    if data is None:
+        return
+    lines = [f"{'stage':<22} {'calls':>9} {'total s':>9} {'mean ms':>9} {'max ms':>9}"]
+    for name, timer in sorted(data['timers'].items(), key=lambda item: -item[1]['seconds']):
+        mean = 1000 * timer['seconds'] / timer['calls'] if timer['calls'] else 0.0
+        lines.append(f"{name:<22} {timer['calls']:>9} {timer['seconds']:>9.3f} {mean:>9.2f} {1000 * timer['max_seconds']:>9.2f}")
+    for name, value in sorted(data['counters'].items()):
+        lines.append(f"{name:<22} {value:>9}")
+    for name, peak in sorted(data['memory_peak_bytes'].items()):
+        lines.append(f"{name:<22} peak {peak / 2**20:.1f} MB")
+    for name, data in sorted(_stats.profile_stats().items()):
+        out = io.StringIO()
+        pstats.Stats(_ProfileData(data), stream=out).sort_stats('cumulative').print_stats(top)
+        lines.append(f"--- profile of {name} ---")
+        lines.append(out.getvalue())
+    print('\n'.join(lines), file=file)
@@ -0,0 +1,247 @@
+import csv
+import json
+import os
+import sys
+import numpy as np
+from ImageRecognition.utils.hash_index import hamming_distance
+
+REPORT_FORMATS = ('jsonl', 'csv', 'parquet')
+
+# groups bigger than this only report the pairs with the keeper, not every pair
+MAX_PAIRWISE_MEMBERS = 50
+
+# one row per group member in the csv and parquet reports
+ROW_FIELDS = ['group', 'kind', 'path', 'size', 'keeper', 'hash_distance', 'cosine', 'absorbed']
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def _keeper(paths, sizes):
+    """index of the member to keep - the largest file, the shortest path on ties"""
+    return max(range(len(paths)), key=lambda i: (sizes[i] or 0, -len(paths[i])))
+
+
+def group_record(group, kind, paths, hashes=None, features=None, absorbed=()):
+    """report record of one duplicate group
+
+    `hashes` (uint64) and `features` are aligned with `paths`, missing values
+    are None. pairs hold the member positions and their hash hamming
+    distance and feature cosine similarity. `absorbed` are the numbers of
+    streamed groups that were merged into this one
+    """
+    sizes = [_file_size(path) for path in paths]
+    keeper = _keeper(paths, sizes)
+    if len(paths) <= MAX_PAIRWISE_MEMBERS:
+        pairs = [(i, j) for i in range(len(paths)) for j in range(i + 1, len(paths))]
+    else:
+        pairs = [(keeper, j) for j in range(len(paths)) if j != keeper]
+    left = np.array([i for i, _ in pairs], dtype=np.int64)
+    right = np.array([j for _, j in pairs], dtype=np.int64)
+    distances = [None] * len(pairs)
+    if hashes is not None:
+        known = np.array([value is not None for value in hashes])
+        packed = np.array([value or 0 for value in hashes], dtype=np.uint64)
+        values = hamming_distance(packed[left], packed[right]).tolist()
+        distances = [value if ok else None for value, ok in zip(values, (known[left] & known[right]).tolist())]
+    cosines = [None] * len(pairs)
+    if features is not None:
+        norms = np.linalg.norm(features, axis=1, keepdims=True)
+        features = features / np.where(norms == 0, 1, norms)
+        # float rounding can push a cosine just past +-1
+        values = np.clip(np.einsum('nd,nd->n', features[left], features[right]), -1, 1)
+        # nan rows stand for members without features
+        cosines = [None if np.isnan(value) else round(value, 6) for value in values.tolist()]
+    records = [{'a': i, 'b': j, 'hash_distance': distance, 'cosine': cosine}
+               for (i, j), distance, cosine in zip(pairs, distances, cosines)]
+    return {
+        'group': group,
+        'kind': kind,
+        'paths': list(paths),
+        'sizes': sizes,
+        'keeper': paths[keeper],
+        'pairs': records,
+        'absorbed': list(absorbed),
+    }
+
+
+def catalog_record(catalog, ids, kind, number, absorbed=()):
+    """record of a group of catalog ids"""
+    hashes = [int(value) if present else None
+              for value, present in zip(catalog.hashes[ids].tolist(), catalog.has_hash[ids].tolist())]
+    features = None
+    if catalog.features.shape[1]:
+        features = catalog.features[ids].astype(np.float32)
+        # members without features get nan rows, their cosines are left out
+        features[~catalog.has_features[ids]] = np.nan
+    return group_record(number, kind, catalog.paths_of(ids), hashes, features, absorbed)
+
+
+def catalog_records(catalog, groups, kind, first_group=0):
+    """records of groups of catalog ids, generated one at a time"""
+    for number, ids in enumerate(groups, first_group):
+        yield catalog_record(catalog, ids, kind, number)
+
+
+def match_records(matches, kind='store', first_group=0):
+    """records of the StoreMatch objects of EmbeddingStore.match, the new image comes first"""
+    for number, match in enumerate(matches, first_group):
+        yield group_record(number, kind, [match.path] + match.stored, match.hashes.tolist(), match.features)
+
+
+class GroupStream:
+    """on_group callback of find_duplicate_ids that writes every group as soon as it is found
+
+    a group that grows is written again under the same number, a group that
+    absorbs others lists their numbers in 'absorbed', so a reader keeps the
+    last record of every number and drops the absorbed ones. `catalog` is
+    the one find_duplicate_ids fills
+    """
+
+    def __init__(self, writer, catalog):
+        self.writer = writer
+        self.catalog = catalog
+        # (kind, cluster id of find_duplicate_ids) -> group number of live groups
+        self._numbers = {}
+        self._count = 0
+
+    def __len__(self):
+        """number of groups left after the merges"""
+        return len(self._numbers)
+
+    def __call__(self, kind, group, paths, absorbed):
+        number = self._numbers.get((kind, group))
+        if number is None:
+            number = self._numbers[kind, group] = self._count
+            self._count += 1
+        gone = [self._numbers.pop((kind, root)) for root in absorbed]
+        ids = np.array([self.catalog.id_of(path) for path in paths], dtype=np.int64)
+        self.writer.write(catalog_record(self.catalog, ids, kind, number, gone))
+
+
+def record_rows(record):
+    """flat rows of a record, one per member, distances are to the keeper"""
+    keeper = record['paths'].index(record['keeper'])
+    to_keeper = {}
+    for pair in record['pairs']:
+        if keeper in (pair['a'], pair['b']):
+            to_keeper[pair['b'] if pair['a'] == keeper else pair['a']] = pair
+    for i, (path, size) in enumerate(zip(record['paths'], record['sizes'])):
+        pair = to_keeper.get(i, {})
+        yield {
+            'group': record['group'],
+            'kind': record['kind'],
+            'path': path,
+            'size': size,
+            'keeper': i == keeper,
+            'hash_distance': pair.get('hash_distance'),
+            'cosine': pair.get('cosine'),
+            'absorbed': ' '.join(map(str, record.get('absorbed', []))),
+        }
+
+
+class ReportWriter:
+    """writes records to a file or stdout as they come, use open_report"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._own = path not in (None, '-')
+        self.file = open(path, 'w', newline='', encoding='utf-8') if self._own else sys.stdout
+
+    def write(self, record):
+        raise NotImplementedError
+
+    def write_all(self, records):
+        count = 0
+        for record in records:
+            self.write(record)
+            count += 1
+        return count
+
+    def close(self):
+        if self._own:
+            self.file.close()
+        else:
+            self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class JsonlWriter(ReportWriter):
+    """one json object per group and line"""
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        # readers follow the file while the scan runs
+        self.file.flush()
+
+
+class CsvWriter(ReportWriter):
+    """one line per group member, see ROW_FIELDS"""
+
+    def __init__(self, path=None):
+        super().__init__(path)
+        self._writer = csv.DictWriter(self.file, fieldnames=ROW_FIELDS)
+        self._writer.writeheader()
+
+    def write(self, record):
+        self._writer.writerows(record_rows(record))
+        self.file.flush()
+
+
+class ParquetWriter(ReportWriter):
+    """rows like the csv report, written in row groups of `batch_rows` rows
+
+    needs the optional pyarrow package
+    """
+
+    def __init__(self, path=None, batch_rows=10000):
+        if path in (None, '-'):
+            raise ValueError('the parquet report needs an output file')
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('the parquet report needs pyarrow, install it with: pip install pyarrow')
+        self.path = path
+        self._own = False
+        self._pyarrow = pyarrow
+        self._schema = pyarrow.schema([
+            ('group', pyarrow.int64()), ('kind', pyarrow.string()), ('path', pyarrow.string()),
+            ('size', pyarrow.int64()), ('keeper', pyarrow.bool_()),
+            ('hash_distance', pyarrow.int64()), ('cosine', pyarrow.float64()), ('absorbed', pyarrow.string()),
+        ])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+        self.batch_rows = batch_rows
+        self._rows = []
+
+    def write(self, record):
+        self._rows.extend(record_rows(record))
+        if len(self._rows) >= self.batch_rows:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            columns = {name: [row[name] for row in self._rows] for name in ROW_FIELDS}
+            self._writer.write_table(self._pyarrow.table(columns, schema=self._schema))
+            self._rows = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+def open_report(output_format, path=None):
+    """writer for 'jsonl', 'csv' or 'parquet', path None or '-' is stdout"""
+    writers = {'jsonl': JsonlWriter, 'csv': CsvWriter, 'parquet': ParquetWriter}
+    if output_format not in writers:
+        raise ValueError(f'unknown report format {output_format!r}, choose from {", ".join(REPORT_FORMATS)}')
+    return writers[output_format](path)
@@ -0,0 +1,208 @@
+import queue
+import time
+from multiprocessing import cpu_count, shared_memory
+import numpy as np
+import imagehash
+from ImageRecognition.image_processing.features import DEFAULT_BATCH_SIZE
+from ImageRecognition.model.backends import create_backend
+from ImageRecognition.utils import instrumentation
+from ImageRecognition.utils.worker_pool import FeatureExtractor, _limit_threads
+
+
+def _attach(name, shape):
+    """float32 array over an existing shared memory block"""
+    block = shared_memory.SharedMemory(name)
+    return block, np.ndarray(shape, dtype=np.float32, buffer=block.buf)
+
+
+def _decoder(tasks, free, filled, inputs_name, inputs_shape, backend, instrument=None):
+    """decode and preprocess chunks of paths into free slots of the input ring"""
+    if instrument is not None:
+        instrumentation.enable(*instrument)
+    from ImageRecognition.image_processing.decode import decode_image
+    from ImageRecognition.image_processing.features import image_to_array
+    # only used for preprocess(), the network is loaded by the inference process
+    model = create_backend(backend)
+    block, inputs = _attach(inputs_name, inputs_shape)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            task_id, paths = task
+            start = time.perf_counter()
+            slot = free.get()
+            instrumentation.add_time('wait for slot', time.perf_counter() - start)
+            hashes = []
+            rows = 0
+            for path in paths:
+                try:
+                    img = decode_image(path)
+                    with instrumentation.stage('hash'):
+                        img_hash = imagehash.average_hash(img)
+                    array = image_to_array(img)
+                except Exception as e:
+                    print(f"Error processing image {path}: {e}")
+                    instrumentation.count('errors')
+                    hashes.append(None)
+                    continue
+                with instrumentation.stage('preprocess'):
+                    inputs[slot, rows] = model.preprocess(array[np.newaxis])[0]
+                hashes.append(str(img_hash))
+                rows += 1
+            instrumentation.count('images', rows)
+            # the pixels stay in the slot, only its index and the hashes are sent
+            filled.put((slot, task_id, paths, hashes, rows, instrumentation.take()))
+    finally:
+        del inputs
+        block.close()
+
+
+def _inference(filled, results, inputs_name, inputs_shape, outputs_name, outputs_shape, threads, backend,
+               instrument=None):
+    """run the model on filled slots and write the embeddings into the output matrix"""
+    if instrument is not None:
+        instrumentation.enable(*instrument)
+    _limit_threads(threads)
+    model = create_backend(backend)
+    with instrumentation.stage('model load'):
+        model.load(threads)
+    input_block, inputs = _attach(inputs_name, inputs_shape)
+    output_block, outputs = _attach(outputs_name, outputs_shape)
+    try:
+        while True:
+            message = filled.get()
+            if message is None:
+                break
+            slot, task_id, paths, hashes, rows, stats = message
+            embedded = True
+            if rows:
+                try:
+                    with instrumentation.stage('predict'):
+                        # a view of the slot, the batch is not copied
+                        outputs[slot, :rows] = model.predict(inputs[slot, :rows])
+                except Exception as e:
+                    print(f"Error extracting features: {e}")
+                    instrumentation.count('errors', rows)
+                    embedded = False
+            results.put((slot, task_id, paths, hashes, rows, embedded, [stats, instrumentation.take()]))
+    finally:
+        del inputs, outputs
+        input_block.close()
+        output_block.close()
+
+
+class SharedMemoryExtractor(FeatureExtractor):
+    """FeatureExtractor with decoding and inference in separate processes
+
+    decoder processes write preprocessed (batch, 224, 224, 3) tensors into a
+    ring of shared memory slots, one inference process runs the model on a
+    slot in place and writes the embeddings into a shared output matrix.
+    only slot indices, paths and hex hashes cross the queues, the parent
+    hands a slot back once it has copied the embeddings out. `workers` is
+    the number of decoder processes
+    """
+
+    def __init__(self, workers=None, threads_per_worker=None, batch_size=DEFAULT_BATCH_SIZE, queue_size=None,
+                 backend=None, slots=None):
+        super().__init__(workers or max(1, cpu_count() - 1), threads_per_worker or cpu_count(), batch_size,
+                         queue_size, backend)
+        # every decoder fills one slot while the model works on another
+        self.slots = slots or 2 * self.workers + 2
+        self._free = None
+        self._filled = None
+        self._blocks = []
+        self._outputs = None
+
+    def _allocate(self, shape):
+        block = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 4)
+        self._blocks.append(block)
+        return block.name, np.ndarray(shape, dtype=np.float32, buffer=block.buf)
+
+    def start(self):
+        """allocate the ring and start the decoder and inference processes"""
+        with self._start_lock:
+            if self._processes:
+                return self
+            backend = create_backend(self.backend)
+            if backend.dim is None:
+                # onnx models only know their size once they are loaded
+                backend.load()
+            inputs_shape = (self.slots, self.batch_size, *backend.input_size, 3)
+            outputs_shape = (self.slots, self.batch_size, backend.dim)
+            inputs_name, _ = self._allocate(inputs_shape)
+            outputs_name, self._outputs = self._allocate(outputs_shape)
+            self._tasks = self._context.Queue(self.queue_size)
+            self._free = self._context.Queue()
+            self._filled = self._context.Queue()
+            self._results = self._context.Queue()
+            for slot in range(self.slots):
+                self._free.put(slot)
+            instrument = instrumentation.settings()
+            for _ in range(self.workers):
+                self._processes.append(self._context.Process(
+                    target=_decoder,
+                    args=(self._tasks, self._free, self._filled, inputs_name, inputs_shape, self.backend, instrument),
+                    daemon=True,
+                ))
+            self._processes.append(self._context.Process(
+                target=_inference,
+                args=(self._filled, self._results, inputs_name, inputs_shape, outputs_name, outputs_shape,
+                      self.threads_per_worker, self.backend, instrument),
+                daemon=True,
+            ))
+            for process in self._processes:
+                process.start()
+        return self
+
+    def _poll(self, timeout):
+        # a dead decoder may hold a slot of the ring, so the shared pipeline gives up instead of respawning
+        try:
+            return [self._results.get(timeout=timeout)], []
+        except queue.Empty:
+            if not all(process.is_alive() for process in self._processes):
+                raise RuntimeError('a feature extraction worker died')
+            return [], []
+
+    def _collect(self, message):
+        slot, task_id, paths, hashes, rows, embedded, stats = message
+        # copied out, the slot is reused as soon as it is handed back
+        features = self._outputs[slot, :rows].copy() if embedded else None
+        self._free.put(slot)
+        results = []
+        row = 0
+        for path, img_hash in zip(paths, hashes):
+            if img_hash is None:
+                results.append((path, None, None))
+                continue
+            results.append((path, imagehash.hex_to_hash(img_hash), features[row] if features is not None else None))
+            row += 1
+        for snapshot in stats:
+            instrumentation.merge(snapshot)
+        return task_id, results, None
+
+    def _release(self):
+        self._outputs = None
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def close(self):
+        """stop the processes after they finish the queued chunks"""
+        if not self._processes:
+            return
+        decoders, inference = self._processes[:-1], self._processes[-1]
+        for _ in decoders:
+            self._tasks.put(None)
+        for process in decoders:
+            process.join()
+        self._filled.put(None)
+        inference.join()
+        self._processes = []
+        self._release()
+
+    def terminate(self):
+        """stop the processes immediately"""
+        super().terminate()
+        self._release()
@@ -0,0 +1,171 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from ImageRecognition.image_processing.decode import decode_image
+
+# where the gui keeps thumbnails between runs
+DEFAULT_THUMBNAIL_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'image_duplicates', 'thumbnails')
+
+# the duplicate viewer shows images in 350x350 labels
+THUMBNAIL_SIZE = (350, 350)
+
+# bytes of thumbnails kept on disk, the least recently used are deleted first
+DEFAULT_DISK_LIMIT = 256 * 1024 * 1024
+
+# a prune goes this far below the limit, so not every new thumbnail prunes again
+PRUNE_TO = 0.9
+
+
+class ThumbnailCache:
+    """small rgb versions of images, kept in memory (lru) and optionally on disk
+
+    a thumbnail on disk is keyed by path, size and mtime of the image, so a
+    changed file gets a new one. the thumbnails on disk take up to
+    `disk_limit` bytes (None for no limit), a read marks one as used and
+    the least recently used go first. prefetch() decodes thumbnails in
+    background threads so they are ready when the viewer needs them
+    """
+
+    def __init__(self, size=THUMBNAIL_SIZE, capacity=512, disk_dir=None, workers=2, disk_limit=DEFAULT_DISK_LIMIT):
+        self.size = size
+        self.capacity = capacity
+        self.disk_dir = disk_dir
+        self.disk_limit = disk_limit
+        # bytes on disk, counted once and then kept up to date by every write and prune
+        self._disk_bytes = 0
+        self._disk_lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            with self._disk_lock:
+                self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+                self._prune()
+        self.hits = 0
+        self.misses = 0
+        self._thumbnails = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(workers)
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._thumbnails)
+
+    def _disk_path(self, path):
+        stat = os.stat(path)
+        key = f'{os.path.abspath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0{self.size}'
+        return os.path.join(self.disk_dir, hashlib.blake2b(key.encode(), digest_size=16).hexdigest() + '.jpg')
+
+    def _disk_files(self):
+        """(last use, size, path) of every thumbnail on disk"""
+        files = []
+        with os.scandir(self.disk_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.jpg'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    # pruned by another cache sharing the folder
+                    continue
+                # atime is not updated on many mounts, reads set the mtime too
+                files.append((max(stat.st_atime_ns, stat.st_mtime_ns), stat.st_size, entry.path))
+        return files
+
+    def _prune(self):
+        """delete the least recently used thumbnails once the disk limit is passed, called with the disk lock"""
+        if self.disk_limit is None or self._disk_bytes <= self.disk_limit:
+            return
+        files = sorted(self._disk_files())
+        # counted again, other caches may share the folder
+        self._disk_bytes = sum(size for _, size, _ in files)
+        for _, size, disk_path in files:
+            if self._disk_bytes <= self.disk_limit * PRUNE_TO:
+                break
+            try:
+                os.remove(disk_path)
+            except OSError:
+                pass
+            self._disk_bytes -= size
+
+    def _read_disk(self, disk_path):
+        """thumbnail stored on disk, None if there is none (or it was just pruned)"""
+        try:
+            with Image.open(disk_path) as img:
+                img.load()
+            os.utime(disk_path)
+            return img
+        except OSError:
+            return None
+
+    def _write_disk(self, disk_path, thumbnail):
+        thumbnail.save(disk_path + '.tmp', 'JPEG', quality=85)
+        os.replace(disk_path + '.tmp', disk_path)
+        with self._disk_lock:
+            self._disk_bytes += os.path.getsize(disk_path)
+            self._prune()
+
+    def _load(self, path):
+        """thumbnail from disk or decoded from the image, None if it can't be read"""
+        try:
+            disk_path = self._disk_path(path) if self.disk_dir else None
+            if disk_path:
+                thumbnail = self._read_disk(disk_path)
+                if thumbnail is not None:
+                    return thumbnail
+            thumbnail = decode_image(path, self.size)
+            thumbnail.thumbnail(self.size)
+            if disk_path:
+                self._write_disk(disk_path, thumbnail)
+            return thumbnail
+        except Exception as e:
+            print(f"Error creating thumbnail for {path}: {e}")
+            return None
+
+    def get(self, path):
+        """thumbnail of path as an rgb PIL image, None if the image can't be read"""
+        with self._lock:
+            thumbnail = self._thumbnails.get(path)
+            if thumbnail is not None:
+                self._thumbnails.move_to_end(path)
+                self.hits += 1
+                return thumbnail
+            self.misses += 1
+            pending = self._pending.get(path)
+        # wait for a prefetch of the same path instead of decoding it twice
+        thumbnail = pending.result() if pending is not None else self._load(path)
+        if thumbnail is not None:
+            self._put(path, thumbnail)
+        return thumbnail
+
+    def _put(self, path, thumbnail):
+        with self._lock:
+            self._thumbnails[path] = thumbnail
+            self._thumbnails.move_to_end(path)
+            while len(self._thumbnails) > self.capacity:
+                self._thumbnails.popitem(last=False)
+
+    def _prefetch_one(self, path):
+        thumbnail = self._load(path)
+        if thumbnail is not None:
+            self._put(path, thumbnail)
+        with self._lock:
+            self._pending.pop(path, None)
+        return thumbnail
+
+    def prefetch(self, paths):
+        """start decoding thumbnails of paths that are not cached yet"""
+        with self._lock:
+            for path in paths:
+                if path not in self._thumbnails and path not in self._pending:
+                    self._pending[path] = self._pool.submit(self._prefetch_one, path)
+
+    def close(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
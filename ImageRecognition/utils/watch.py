@@ -0,0 +1,381 @@
+import os
+import time
+from collections import namedtuple
+import numpy as np
+from ImageRecognition.image_processing.load_images import ImageRecord
+from ImageRecognition.image_processing.scanner import Scanner
+from ImageRecognition.utils.feature_index import FeatureIndex, DEFAULT_THRESHOLD
+from ImageRecognition.utils.hash_index import HashIndex, DEFAULT_MAX_DISTANCE
+from ImageRecognition.utils.worker_pool import FeatureExtractor
+
+# added, changed and removed paths found by one poll
+Changes = namedtuple('Changes', ['added', 'changed', 'removed'])
+
+# an image that turned out to duplicate images already in the index
+Match = namedtuple('Match', ['kind', 'path', 'duplicates'])
+
+
+def _list_dir(folder, root, scanner, known=None):
+    """image records and subfolders directly inside folder
+
+    files and folders are picked like the scanner picks them, a file in
+    `known` with the same size and mtime is not sniffed again
+    """
+    files = {}
+    folders = []
+    known = known or {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if scanner.excluded(root, entry.name, entry.path):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                    continue
+                if not entry.is_file() or not scanner.included(root, entry.name, entry.path):
+                    continue
+                stat = entry.stat()
+            except OSError:
+                # broken symlink or removed while listing
+                continue
+            record = ImageRecord(entry.path, stat.st_size, stat.st_mtime_ns)
+            old = known.get(entry.path)
+            if (old is not None and old[1:] == record[1:]) or scanner.is_image(entry.name, entry.path):
+                files[entry.path] = record
+    return files, folders
+
+
+class DirectoryPoller:
+    """finds added, changed and removed images by polling directory mtimes
+
+    a directory's mtime changes when entries are created, deleted or renamed
+    in it, so only those directories are listed again and a poll costs one
+    stat per directory instead of one per file. files rewritten in place
+    (same name, no rename) do not touch the directory, use InotifyWatcher to
+    catch those.
+
+    `include`, `exclude` and `sniff` pick the images like they do for the
+    Scanner
+    """
+
+    def __init__(self, folders, include=(), exclude=(), sniff=True):
+        self.scanner = Scanner(folders, include, exclude, sniff)
+        self.folders = self.scanner.roots
+        self._mtimes = {}
+        self._files = {}
+        self._subfolders = {}
+        # folder -> the root it was found below, the globs are relative to it
+        self._roots = {}
+
+    def scan(self):
+        """full walk of the folders, returns every ImageRecord"""
+        records = []
+        for folder in self.folders:
+            records.extend(self._add_tree(folder, folder))
+        return records
+
+    def _add_tree(self, folder, root):
+        records = []
+        stack = [folder]
+        while stack:
+            current = stack.pop()
+            try:
+                mtime = os.stat(current).st_mtime_ns
+                files, folders = _list_dir(current, root, self.scanner)
+            except OSError as e:
+                print(f"Could not read folder {current}: {e}")
+                continue
+            self._mtimes[current] = mtime
+            self._roots[current] = root
+            self._files[current] = files
+            self._subfolders[current] = set(folders)
+            self._watch(current)
+            records.extend(files.values())
+            stack.extend(folders)
+        return records
+
+    def _remove_tree(self, folder):
+        removed = []
+        stack = [folder]
+        while stack:
+            current = stack.pop()
+            self._mtimes.pop(current, None)
+            self._roots.pop(current, None)
+            self._unwatch(current)
+            removed.extend(self._files.pop(current, {}))
+            stack.extend(self._subfolders.pop(current, ()))
+        return removed
+
+    def _relist(self, folder, changes):
+        """compare a folder with what was seen before and record the differences"""
+        root = self._roots[folder]
+        old_files = self._files.get(folder, {})
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+            files, folders = _list_dir(folder, root, self.scanner, old_files)
+        except OSError:
+            changes.removed.extend(self._remove_tree(folder))
+            return
+        self._mtimes[folder] = mtime
+        for path, record in files.items():
+            old = old_files.get(path)
+            if old is None:
+                changes.added.append(record)
+            elif old[1:] != record[1:]:
+                changes.changed.append(record)
+        changes.removed.extend(path for path in old_files if path not in files)
+        self._files[folder] = files
+        old_folders = self._subfolders.get(folder, set())
+        for new_folder in set(folders) - old_folders:
+            changes.added.extend(self._add_tree(new_folder, root))
+        for gone in old_folders - set(folders):
+            changes.removed.extend(self._remove_tree(gone))
+        self._subfolders[folder] = set(folders)
+
+    def _watch(self, folder):
+        pass
+
+    def _unwatch(self, folder):
+        pass
+
+    def poll(self, timeout=None):
+        """changes since the last scan or poll, waits up to timeout seconds if there are none yet"""
+        changes = self._poll_once()
+        if timeout and not any(changes):
+            time.sleep(timeout)
+            changes = self._poll_once()
+        return changes
+
+    def _poll_once(self, full=False):
+        """changes of the folders whose mtime changed, or of every folder with `full`"""
+        changes = Changes([], [], [])
+        for folder in list(self._mtimes):
+            if folder not in self._mtimes:
+                # removed together with its parent during this poll
+                continue
+            try:
+                mtime = os.stat(folder).st_mtime_ns
+            except OSError:
+                mtime = None
+            if full or mtime != self._mtimes[folder]:
+                self._relist(folder, changes)
+        return changes
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(DirectoryPoller):
+    """like DirectoryPoller, but driven by inotify events
+
+    needs the optional inotify_simple package (linux only). every event
+    names one file, so only that file is looked at, and files rewritten in
+    place are reported as changed once they are closed. when the kernel
+    drops events because the queue overflowed, every folder is listed again
+    """
+
+    def __init__(self, folders, include=(), exclude=(), sniff=True):
+        from inotify_simple import INotify, flags
+        super().__init__(folders, include, exclude, sniff)
+        self._flags = flags
+        self._inotify = INotify()
+        self._mask = flags.CREATE | flags.DELETE | flags.MOVED_TO | flags.MOVED_FROM | flags.CLOSE_WRITE
+        # watch descriptor -> folder and back
+        self._watches = {}
+        self._descriptors = {}
+
+    def _watch(self, folder):
+        try:
+            descriptor = self._inotify.add_watch(folder, self._mask)
+        except OSError:
+            return
+        self._watches[descriptor] = folder
+        self._descriptors[folder] = descriptor
+
+    def _unwatch(self, folder):
+        # the kernel drops the watch of a deleted folder by itself
+        descriptor = self._descriptors.pop(folder, None)
+        self._watches.pop(descriptor, None)
+
+    def _update_file(self, folder, name, path, changes):
+        files = self._files[folder]
+        root = self._roots[folder]
+        old = files.get(path)
+        if old is None and (self.scanner.excluded(root, name, path) or not self.scanner.included(root, name, path)):
+            return
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+        if stat is not None:
+            record = ImageRecord(path, stat.st_size, stat.st_mtime_ns)
+            if old is not None and old[1:] == record[1:]:
+                return
+            if self.scanner.is_image(name, path):
+                files[path] = record
+                (changes.added if old is None else changes.changed).append(record)
+                return
+        # gone, or rewritten as something that is not an image
+        if files.pop(path, None) is not None:
+            changes.removed.append(path)
+
+    def poll(self, timeout=None):
+        """wait up to timeout seconds for events and return the changes"""
+        flags = self._flags
+        events = self._inotify.read(timeout=None if timeout is None else int(timeout * 1000))
+        if any(event.mask & flags.Q_OVERFLOW for event in events):
+            # events were lost, only listing every folder again finds what they were about
+            return self._poll_once(full=True)
+        changes = Changes([], [], [])
+        for event in events:
+            folder = self._watches.get(event.wd)
+            if folder is None or folder not in self._files or not event.name:
+                continue
+            path = os.path.join(folder, event.name)
+            if event.mask & flags.ISDIR:
+                if event.mask & (flags.CREATE | flags.MOVED_TO) and path not in self._files:
+                    if self.scanner.excluded(self._roots[folder], event.name, path):
+                        continue
+                    changes.added.extend(self._add_tree(path, self._roots[folder]))
+                    self._subfolders[folder].add(path)
+                elif event.mask & (flags.DELETE | flags.MOVED_FROM):
+                    changes.removed.extend(self._remove_tree(path))
+                    self._subfolders[folder].discard(path)
+            elif not event.mask & flags.CREATE:
+                # a created file is picked up once it is closed, not half written
+                self._update_file(folder, event.name, path, changes)
+        return changes
+
+    def close(self):
+        self._inotify.close()
+
+
+def create_watcher(folders, include=(), exclude=(), sniff=True):
+    """inotify based watcher when inotify_simple is installed, polling otherwise"""
+    try:
+        return InotifyWatcher(folders, include, exclude, sniff)
+    except (ImportError, OSError):
+        return DirectoryPoller(folders, include, exclude, sniff)
+
+
+class DuplicateIndex:
+    """hash and feature indexes that files can be added to and removed from
+
+    every add reports which images already in the index the new ones
+    duplicate. the feature index defaults to lsh so an update does not
+    compare against the whole corpus
+    """
+
+    def __init__(self, hash_distance=DEFAULT_MAX_DISTANCE, feature_threshold=DEFAULT_THRESHOLD, feature_mode='lsh'):
+        self.hash_index = HashIndex(max_distance=hash_distance)
+        self.feature_index = FeatureIndex(threshold=feature_threshold, mode=feature_mode)
+        # path -> id and id -> path for both indexes
+        self._ids = {'hash': {}, 'feature': {}}
+        self._paths = {'hash': [], 'feature': []}
+
+    def __len__(self):
+        return len(self._ids['hash'])
+
+    def _index(self, kind):
+        return self.hash_index if kind == 'hash' else self.feature_index
+
+    def remove(self, paths):
+        """forget the given paths, unknown paths are ignored"""
+        for kind, ids in self._ids.items():
+            removed = [ids.pop(path) for path in paths if path in ids]
+            if removed:
+                self._index(kind).remove(removed)
+
+    def add(self, results):
+        """add (path, hash, features) results and return a Match for every new duplicate
+
+        known paths are replaced, so changed files can simply be added again
+        """
+        self.remove([path for path, _, _ in results])
+        matches = []
+        for kind, position in (('hash', 1), ('feature', 2)):
+            entries = [(result[0], result[position]) for result in results if result[position] is not None]
+            if not entries:
+                continue
+            index = self._index(kind)
+            values = [value for _, value in entries]
+            ids = index.add(values if kind == 'hash' else np.stack(values))
+            paths = self._paths[kind]
+            for (path, _), i in zip(entries, ids.tolist()):
+                self._ids[kind][path] = i
+                paths.append(path)
+            left, right, _ = index.pairs_with(ids)
+            duplicates = {}
+            for i, j in zip(left.tolist(), right.tolist()):
+                duplicates.setdefault(j, []).append(paths[i])
+            matches.extend(Match(kind, paths[j], found) for j, found in sorted(duplicates.items()))
+        return matches
+
+    def clusters(self, kind):
+        """current duplicate groups of one kind as lists of paths"""
+        paths = self._paths[kind]
+        return [[paths[i] for i in cluster] for cluster in self._index(kind).clusters()]
+
+
+class DuplicateWatcher:
+    """keeps the duplicates of some folders up to date as files come and go
+
+    after the initial scan only added and changed files are hashed and run
+    through the model, the extractor stays warm between polls. without an
+    `extractor` one is started with the given `backend`. `include`, `exclude`
+    and `sniff` pick the images like they do for the Scanner
+    """
+
+    def __init__(self, folders, cache=None, extractor=None, interval=1.0, watcher=None,
+                 hash_distance=DEFAULT_MAX_DISTANCE, feature_threshold=DEFAULT_THRESHOLD, feature_mode='lsh',
+                 backend=None, include=(), exclude=(), sniff=True):
+        self.folders = list(folders)
+        self.cache = cache
+        self.interval = interval
+        self.extractor = extractor or FeatureExtractor(backend=backend)
+        self._owns_extractor = extractor is None
+        self.watcher = watcher or create_watcher(self.folders, include, exclude, sniff)
+        self.index = DuplicateIndex(hash_distance, feature_threshold, feature_mode)
+
+    def _process(self, paths):
+        """hash and features of paths, from the cache where possible"""
+        if self.cache is None:
+            return list(self.extractor.map(paths))
+        results = []
+        for result in self.extractor.map(self.cache.iter_missing(paths, results), self.cache.quarantine):
+            self.cache.store(*result)
+            results.append(result)
+        self.cache.commit()
+        return results
+
+    def initial_scan(self):
+        """index every image of the folders, returns (hash_duplicates, feature_duplicates)"""
+        records = self.watcher.scan()
+        self.index.add(self._process(record.path for record in records))
+        return self.index.clusters('hash'), self.index.clusters('feature')
+
+    def poll(self, timeout=None):
+        """apply the changes since the last poll, returns (Changes, matches)"""
+        changes = self.watcher.poll(timeout)
+        self.index.remove(changes.removed)
+        updated = [record.path for record in changes.added + changes.changed]
+        matches = self.index.add(self._process(updated)) if updated else []
+        return changes, matches
+
+    def run(self, on_match, stop=None):
+        """poll until the `stop` event is set (or forever), calling on_match for every match"""
+        while stop is None or not stop.is_set():
+            _, matches = self.poll(self.interval)
+            for match in matches:
+                on_match(match)
+
+    def close(self):
+        self.watcher.close()
+        if self._owns_extractor:
+            self.extractor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
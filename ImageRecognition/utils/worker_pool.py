@@ -0,0 +1,386 @@
+import os
+import itertools
+import queue
+import sys
+import threading
+import time
+import multiprocessing
+from collections import deque
+from multiprocessing import cpu_count
+from multiprocessing.connection import wait
+from ImageRecognition.image_processing.features import DEFAULT_BATCH_SIZE
+from ImageRecognition.model.model import backend_name
+from ImageRecognition.utils import instrumentation
+
+# seconds a worker may spend on one chunk before it counts as hung
+DEFAULT_TASK_TIMEOUT = 300
+# chunks a worker holds at once, the next one is already there when it finishes
+CHUNKS_PER_WORKER = 2
+
+
+def _limit_threads(threads):
+    """limit the threads of native libraries loaded later in this worker
+
+    the backend limits its own runtime in load(threads), this covers what it
+    pulls in, nothing is imported here so light backends stay light
+    """
+    for name in ('OMP_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS'):
+        os.environ[name] = str(threads)
+
+
+def _worker(tasks, results, slot, current, started, threads, batch_size, backend, instrument=None, process=None):
+    """worker loop - load the model once and process chunks until told to stop
+
+    the id of the chunk in hand is kept in current[slot], so the parent knows
+    which chunk to blame when the worker crashes or hangs. chunks and results
+    go through the worker's own pipes, so a worker killed at any point holds
+    no lock its replacement would wait on. results are in the pipe once send
+    returns
+    """
+    if instrument is not None:
+        instrumentation.enable(*instrument)
+    _limit_threads(threads)
+    if process is None:
+        from ImageRecognition.image_processing.hash_images import process_images as process
+    from ImageRecognition.model.model import initialize_model
+    with instrumentation.stage('model load'):
+        initialize_model(backend, threads)
+    while True:
+        start = time.perf_counter()
+        try:
+            task = tasks.recv()
+        except EOFError:
+            # the parent is gone
+            break
+        instrumentation.add_time('worker idle', time.perf_counter() - start)
+        if task is None:
+            break
+        task_id, paths = task
+        started[slot] = time.time()
+        current[slot] = task_id
+        processed = process(paths, batch_size=batch_size)
+        # a full pipe means the parent is busy with earlier results, that is not a hang
+        started[slot] = float('inf')
+        # the numbers of this chunk travel back with its results
+        results.send((task_id, processed, instrumentation.take()))
+        current[slot] = -1
+
+
+def _drain(reader):
+    """messages a finished worker left in its pipe"""
+    messages = []
+    try:
+        while reader.poll():
+            messages.append(reader.recv())
+    except (EOFError, OSError):
+        # the end of the pipe, or a message cut off by the kill
+        pass
+    reader.close()
+    return messages
+
+
+class FeatureExtractor:
+    """long-lived pool of worker processes that load the model once
+
+    chunks of paths wait in a bounded queue and are handed to the workers a
+    few at a time, so the whole run uses the same processes no matter how
+    many images there are.
+    a worker that crashes or spends more than `task_timeout` seconds on a
+    chunk is replaced, see map for what happens to its chunk. `process`
+    is the function the workers run on a chunk, process_images by default
+    """
+
+    def __init__(self, workers=None, threads_per_worker=None, batch_size=DEFAULT_BATCH_SIZE, queue_size=None, backend=None,
+                 task_timeout=DEFAULT_TASK_TIMEOUT, process=None):
+        self.backend = backend or backend_name()
+        self.workers = workers or cpu_count()
+        self.threads_per_worker = threads_per_worker or max(1, cpu_count() // self.workers)
+        self.batch_size = batch_size
+        self.queue_size = queue_size or 2 * self.workers
+        self.task_timeout = task_timeout
+        self._process = process
+        # tensorflow is not fork-safe, so the workers are always spawned
+        self._context = multiprocessing.get_context('spawn')
+        self._tasks = None
+        self._results = None
+        self._processes = []
+        # result pipe, task pipe, chunks sent without results yet, chunk in hand
+        # and its start time of every worker slot
+        self._readers = []
+        self._senders = []
+        self._sent = []
+        self._current = None
+        self._started = None
+        # chunks of dead workers that they had not started, they go out before the queued ones
+        self._returned = deque()
+        # deaths of every slot's workers since it last took a chunk
+        self._idle_deaths = []
+        # the gui warms the pool up from a background thread
+        self._start_lock = threading.Lock()
+
+    def _spawn(self, slot):
+        """start the worker of a slot, returns the process, the read end of its result pipe and the write end of its task pipe"""
+        reader, writer = self._context.Pipe(duplex=False)
+        tasks, sender = self._context.Pipe(duplex=False)
+        self._current[slot] = -1
+        process = self._context.Process(
+            target=_worker,
+            args=(tasks, writer, slot, self._current, self._started, self.threads_per_worker, self.batch_size,
+                  self.backend, instrumentation.settings(), self._process),
+            daemon=True,
+        )
+        process.start()
+        # the worker holds the only write end now, its death shows up as the end of the pipe
+        writer.close()
+        tasks.close()
+        return process, reader, sender
+
+    def start(self):
+        """start the worker processes"""
+        with self._start_lock:
+            if self._processes:
+                return self
+            # only the parent takes from the queue, _dispatch hands the chunks on
+            self._tasks = queue.Queue(self.queue_size)
+            self._returned = deque()
+            self._current = self._context.Array('q', self.workers, lock=False)
+            self._started = self._context.Array('d', self.workers, lock=False)
+            self._sent = [deque() for _ in range(self.workers)]
+            self._idle_deaths = [0] * self.workers
+            for slot in range(self.workers):
+                process, reader, sender = self._spawn(slot)
+                self._processes.append(process)
+                self._readers.append(reader)
+                self._senders.append(sender)
+        return self
+
+    def _dispatch(self):
+        """send queued chunks to the workers with room for them, returns whether every worker is full"""
+        for depth in range(CHUNKS_PER_WORKER):
+            for slot, sent in enumerate(self._sent):
+                if len(sent) > depth:
+                    continue
+                if self._returned:
+                    task = self._returned.popleft()
+                else:
+                    try:
+                        task = self._tasks.get_nowait()
+                    except queue.Empty:
+                        return False
+                sent.append(task)
+                try:
+                    self._senders[slot].send(task)
+                except OSError:
+                    # the worker is gone, _poll hands its chunks out again
+                    pass
+        return True
+
+    def _poll(self, timeout):
+        """(messages, failed chunks) that came in within timeout seconds
+
+        a failed chunk is the (task id, reason) of a worker that crashed or
+        hung while holding it, the worker is replaced by a new one. so is a
+        worker that died between chunks, e.g. killed for memory, unless the
+        one that replaced it died again before taking a chunk
+        """
+        messages = []
+        failed = []
+        full = self._dispatch()
+        # the feeder may queue more chunks any moment, workers with room are not kept waiting for long
+        ready = wait(self._readers, timeout if full else min(timeout, 0.05))
+        for slot, reader in enumerate(self._readers):
+            if reader not in ready:
+                continue
+            try:
+                messages.append(reader.recv())
+            except EOFError:
+                # the worker is gone, it is replaced below
+                continue
+            # results come back in the order the chunks were sent
+            self._sent[slot].popleft()
+            self._idle_deaths[slot] = 0
+        now = time.time()
+        for slot, process in enumerate(self._processes):
+            hung = (self.task_timeout is not None and self._current[slot] >= 0
+                    and now - self._started[slot] > self.task_timeout)
+            if process.is_alive() and not hung:
+                continue
+            if hung:
+                process.terminate()
+            process.join()
+            # results it sent before the end are still in the pipe
+            drained = _drain(self._readers[slot])
+            messages.extend(drained)
+            sent = self._sent[slot]
+            for _ in drained:
+                sent.popleft()
+            if drained:
+                self._idle_deaths[slot] = 0
+            # current may still name a chunk whose results came in before the end
+            if sent and sent[0][0] == self._current[slot]:
+                reason = f'timed out after {self.task_timeout}s' if hung else f'worker crashed with exit code {process.exitcode}'
+                failed.append((sent.popleft()[0], reason))
+                self._idle_deaths[slot] = 0
+            else:
+                self._idle_deaths[slot] += 1
+                if self._idle_deaths[slot] > 1:
+                    # not a bad file, e.g. the model does not load, the next worker would die the same way
+                    raise RuntimeError(f'a feature extraction worker died twice without taking a chunk '
+                                       f'(exit code {process.exitcode})')
+            # the chunks it had not started are not to blame
+            self._returned.extendleft(reversed(sent))
+            instrumentation.count('worker restarts')
+            self._readers[slot].close()
+            self._senders[slot].close()
+            self._processes[slot], self._readers[slot], self._senders[slot] = self._spawn(slot)
+            self._sent[slot] = deque()
+        return messages, failed
+
+    def map(self, paths, on_quarantine=None, cancel=None):
+        """process paths in chunks and yield (path, hash, features) as chunks finish
+
+        the workers are only started once there is at least one path. a
+        chunk whose worker crashed or hung is tried again one path at a time,
+        a path that fails on its own is quarantined: it is yielded without
+        hash and features and passed to on_quarantine(path, reason). once the
+        `cancel` event is set map stops within one poll, without the results
+        still due, even while the workers are loading the model
+        """
+        paths = iter(paths)
+        first = next(paths, None)
+        if first is None:
+            return
+        paths = itertools.chain([first], paths)
+        self.start()
+        task_ids = itertools.count()
+        # chunks that were submitted and have no results yet, by task id
+        pending = {}
+        retries = deque()
+        errors = []
+        feeding = threading.Event()
+        feeding.set()
+        stopped = threading.Event()
+
+        def put(task):
+            # blocks while the queue is full, gives up once the caller stopped reading
+            while not stopped.is_set():
+                try:
+                    self._tasks.put(task, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def submit(chunk):
+            task_id = next(task_ids)
+            pending[task_id] = chunk
+            return put((task_id, chunk))
+
+        def feed():
+            try:
+                chunk = []
+                for path in paths:
+                    chunk.append(path)
+                    if len(chunk) == self.batch_size:
+                        if not submit(chunk):
+                            return
+                        chunk = []
+                if chunk:
+                    submit(chunk)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                feeding.clear()
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        try:
+            waited = time.perf_counter()
+            while (feeding.is_set() or pending) and not (cancel is not None and cancel.is_set()):
+                # retries go in whenever the queue has room, the feeder may be waiting for it too
+                while retries:
+                    try:
+                        self._tasks.put_nowait(retries[0])
+                    except queue.Full:
+                        break
+                    retries.popleft()
+                messages, failed = self._poll(0.5)
+                if messages:
+                    instrumentation.add_time('wait for workers', time.perf_counter() - waited)
+                for message in messages:
+                    task_id, results, stats = self._collect(message)
+                    if pending.pop(task_id, None) is None:
+                        continue
+                    instrumentation.merge(stats)
+                    instrumentation.count('chunks')
+                    yield from results
+                for task_id, reason in failed:
+                    chunk = pending.pop(task_id, None)
+                    if chunk is None:
+                        continue
+                    if len(chunk) > 1:
+                        # one bad file takes the chunk down, find it by trying every path on its own
+                        for path in chunk:
+                            retry = (next(task_ids), [path])
+                            pending[retry[0]] = retry[1]
+                            retries.append(retry)
+                        continue
+                    # stdout may be the machine readable report
+                    print(f"Quarantined image {chunk[0]}: {reason}", file=sys.stderr)
+                    instrumentation.count('quarantined')
+                    if on_quarantine is not None:
+                        on_quarantine(chunk[0], reason)
+                    yield chunk[0], None, None
+                # the time the caller spends on the results is not waiting
+                if messages or failed:
+                    waited = time.perf_counter()
+        finally:
+            if feeding.is_set() or pending:
+                # stopped early (cancelled or failed), the results of the queued
+                # chunks must not leak into the next map, the workers restart then
+                stopped.set()
+                self.terminate()
+        feeder.join()
+        if errors:
+            raise errors[0]
+
+    def _collect(self, message):
+        """(task id, results, instrumentation snapshot) of a message from a worker"""
+        return message
+
+    def close(self):
+        """stop the workers after they finish the chunks they hold"""
+        for sender in self._senders:
+            try:
+                sender.send(None)
+            except OSError:
+                # already dead
+                pass
+        for process in self._processes:
+            process.join()
+        self._processes = []
+        self._close_pipes()
+
+    def terminate(self):
+        """stop the workers immediately"""
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join()
+        self._processes = []
+        self._close_pipes()
+
+    def _close_pipes(self):
+        for connection in self._readers + self._senders:
+            connection.close()
+        self._readers = []
+        self._senders = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
@@ -1,38 +1,21 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
+import os
+import sys
+from functools import partial
 
-chrome_driver_path = '../chromedriver.exe'
-
-# Chrome options
-options = Options()
-options.add_argument("--headless")  # launching without interface (no need)
-
-# web-driver init
-service = Service(chrome_driver_path)
-driver = webdriver.Chrome(service=service, options=options)
-
-try:
-    # open web page
-    driver.get('https://example.com')
-
-    # set value in Cookie
-    driver.add_cookie({'name': 'Cookieeee:)', 'value': 'someCookieVal'})
-
-    # get value from Cookie
-    cookie = driver.get_cookie('Cookieeee:)')
-    print("Cookie value:", cookie)
-
-    # remove value from Cookie
-    driver.delete_cookie('Cookieeee:)')
-
-    # removal check
-    cookie_after_remove = driver.get_cookie('Cookieeee:)')
-    print("Cookie value after remove:", cookie_after_remove)
-except Exception as err:
-    print(f"Error: ", err)
-
-finally:
-    driver.quit()
+# browser_pool.py is one folder up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from browser_pool import BrowserPool, check_cookie, make_driver
 
+chrome_driver_path = '../chromedriver.exe'
 
+# one warm session, the pool starts and quits Chrome
+with BrowserPool(1, factory=partial(make_driver, chrome_driver_path)) as pool:
+    try:
+        # set, get, remove and get again in one script on the open page
+        result = pool.run(check_cookie, 'https://example.com')
+        print("Cookie value:", result['value'])
+
+        # removal check
+        print("Cookie value after remove:", result['after_remove'])
+    except Exception as err:
+        print(f"Error: ", err)
@@ -1,41 +1,21 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
+import os
+import sys
+from functools import partial
 
-chrome_driver_path = '../chromedriver.exe'
-
-# Chrome options
-options = Options()
-options.add_argument("--headless")  # launching without interface (no need)
-
-# web-driver init
-service = Service(chrome_driver_path)
-driver = webdriver.Chrome(service=service, options=options)
-
-try:
-    # open web page
-    driver.get('https://example.com')
-
-    # set value in LocalStorage
-    script_set = "window.localStorage.setItem('Key', 'Value');"
-    driver.execute_script(script_set)
+# browser_pool.py is one folder up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from browser_pool import BrowserPool, check_local_storage, make_driver
 
-    # get value from LocalStorage
-    script_get = "return window.localStorage.getItem('Key');"
-    value = driver.execute_script(script_get)
-    print("LocalStorage value:", value)
-
-    # remove value from LocalStorage
-    script_remove = "window.localStorage.removeItem('Key');"
-    driver.execute_script(script_remove)
-
-    # removal check
-    value_after_remove = driver.execute_script(script_get)
-    print("Value after remove:", value_after_remove)
-except Exception as err:
-    print(f"Error: ", err)
-
-finally:
-    driver.quit()
+chrome_driver_path = '../chromedriver.exe'
 
-    
\ No newline at end of file
+# one warm session, the pool starts and quits Chrome
+with BrowserPool(1, factory=partial(make_driver, chrome_driver_path)) as pool:
+    try:
+        # set, get, remove and get again in one script on the open page
+        result = pool.run(check_local_storage, 'https://example.com')
+        print("LocalStorage value:", result['value'])
+
+        # removal check
+        print("Value after remove:", result['after_remove'])
+    except Exception as err:
+        print(f"Error: ", err)
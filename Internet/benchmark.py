@@ -0,0 +1,73 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from browser_pool import BrowserPool, check_cookie, check_local_storage, make_driver
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_pages(folder, count):
+    """a local static server with count small pages, returns the server and the page urls"""
+    for i in range(count):
+        with open(os.path.join(folder, f'page{i}.html'), 'w') as f:
+            f.write(f'<!doctype html><html><head><title>page {i}</title></head><body><p>page {i}</p></body></html>')
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=folder))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, [f'http://127.0.0.1:{server.server_port}/page{i}.html' for i in range(count)]
+
+
+def one_browser_per_check(url, driver_path):
+    """what LocalStorage/main.py used to do: a fresh Chrome and one execute_script per operation"""
+    driver = make_driver(driver_path)
+    try:
+        driver.get(url)
+        driver.execute_script("window.localStorage.setItem('Key', 'Value');")
+        value = driver.execute_script("return window.localStorage.getItem('Key');")
+        driver.execute_script("window.localStorage.removeItem('Key');")
+        after_remove = driver.execute_script("return window.localStorage.getItem('Key');")
+        return {'url': url, 'value': value, 'after_remove': after_remove}
+    finally:
+        driver.quit()
+
+
+def run(pages, sizes, driver_path):
+    with tempfile.TemporaryDirectory() as folder:
+        server, urls = serve_pages(folder, pages)
+        print(f"{'mode':<34} {'checks':>7} {'seconds':>9} {'checks/sec':>11}")
+
+        start = time.perf_counter()
+        results = [one_browser_per_check(url, driver_path) for url in urls]
+        elapsed = time.perf_counter() - start
+        assert all(result['value'] == 'Value' and result['after_remove'] is None for result in results)
+        print(f"{'one browser per check':<34} {len(urls):>7} {elapsed:>9.2f} {len(urls) / elapsed:>11.2f}")
+
+        for size in sizes:
+            for name, check in (('localStorage', check_local_storage), ('cookie', check_cookie)):
+                pool = BrowserPool(size, factory=partial(make_driver, driver_path))
+                start = time.perf_counter()
+                with pool:
+                    warm = time.perf_counter() - start
+                    results = pool.map(check, urls)
+                elapsed = time.perf_counter() - start
+                failed = [result for result in results if isinstance(result, Exception)]
+                assert not failed, failed[0]
+                assert all(result['value'] and result['after_remove'] is None for result in results)
+                label = f'pool of {size}, batched {name}'
+                print(f"{label:<34} {len(urls):>7} {elapsed:>9.2f} {len(urls) / elapsed:>11.2f}  (start {warm:.2f}s)")
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark storage checks on a local static server.')
+    parser.add_argument('--pages', type=int, default=50, help='Number of pages to check.')
+    parser.add_argument('--pool-sizes', type=int, nargs='+', default=[1, 4], help='Browser pool sizes to measure.')
+    parser.add_argument('--driver', type=str, default=None, help='Path to chromedriver (default: let selenium find it).')
+    args = parser.parse_args()
+    run(args.pages, args.pool_sizes, args.driver)
@@ -0,0 +1,196 @@
+import queue
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from selenium import webdriver
+from selenium.common.exceptions import JavascriptException, WebDriverException
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.chrome.options import Options
+
+# path to chromedriver, None lets selenium find or download a matching one
+CHROME_DRIVER_PATH = None
+
+# runs a list of [op, key, value] storage operations in one round-trip, returns one result per operation
+STORAGE_SCRIPT = """
+const storage = window[arguments[0]];
+return arguments[1].map(([op, key, value]) => {
+    if (op === 'set') { storage.setItem(key, value); return null; }
+    if (op === 'get') { return storage.getItem(key); }
+    if (op === 'remove') { storage.removeItem(key); return null; }
+    if (op === 'clear') { storage.clear(); return null; }
+    throw new Error('unknown storage operation ' + op);
+});
+"""
+
+# the same for cookies through document.cookie, so HttpOnly cookies are not visible to it
+COOKIE_SCRIPT = """
+const read = (key) => {
+    for (const pair of document.cookie.split('; ')) {
+        const at = pair.indexOf('=');
+        // a cookie set without '=' has only a name
+        const name = at === -1 ? pair : pair.slice(0, at);
+        if (name === key) { return at === -1 ? '' : decodeURIComponent(pair.slice(at + 1)); }
+    }
+    return null;
+};
+return arguments[0].map(([op, key, value]) => {
+    if (op === 'set') { document.cookie = key + '=' + encodeURIComponent(value) + '; path=/'; return null; }
+    if (op === 'get') { return read(key); }
+    if (op === 'remove') { document.cookie = key + '=; path=/; expires=Thu, 01 Jan 1970 00:00:00 GMT'; return null; }
+    throw new Error('unknown cookie operation ' + op);
+});
+"""
+
+
+def make_driver(driver_path=CHROME_DRIVER_PATH, headless=True):
+    """a new Chrome session"""
+    options = Options()
+    if headless:
+        options.add_argument("--headless")  # launching without interface (no need)
+    options.add_argument("--disable-gpu")
+    options.add_argument("--disable-extensions")
+    service = Service(driver_path) if driver_path else Service()
+    return webdriver.Chrome(service=service, options=options)
+
+
+def storage_batch(driver, operations, storage='localStorage'):
+    """run ('set', key, value), ('get', key) and ('remove', key) operations on the open page in one script"""
+    return driver.execute_script(STORAGE_SCRIPT, storage, [list(op) + [None] * (3 - len(op)) for op in operations])
+
+
+def cookie_batch(driver, operations):
+    """the same as storage_batch for the cookies of the open page"""
+    return driver.execute_script(COOKIE_SCRIPT, [list(op) + [None] * (3 - len(op)) for op in operations])
+
+
+def check_local_storage(driver, url, key='Key', value='Value'):
+    """set, read, remove and read again a localStorage value on url"""
+    driver.get(url)
+    _, stored, _, after_remove = storage_batch(driver, [('set', key, value), ('get', key), ('remove', key), ('get', key)])
+    return {'url': url, 'value': stored, 'after_remove': after_remove}
+
+
+def check_cookie(driver, url, key='Cookieeee:)', value='someCookieVal'):
+    """set, read, remove and read again a cookie on url"""
+    driver.get(url)
+    _, stored, _, after_remove = cookie_batch(driver, [('set', key, value), ('get', key), ('remove', key), ('get', key)])
+    return {'url': url, 'value': stored, 'after_remove': after_remove}
+
+
+class BrowserPool:
+    """a fixed number of warm browser sessions shared by many checks
+
+    starting Chrome costs far more than a page load, so the sessions are
+    started once and lent out one check at a time. a session that fails
+    with a WebDriverException is quit and the next borrower starts a new
+    one in its place. checks should clean up the storage they touch
+    """
+
+    def __init__(self, size=4, factory=make_driver):
+        self.size = size
+        self._factory = factory
+        self._idle = queue.Queue()
+        # one slot per session, a borrower takes an idle session or starts one in its slot
+        self._slots = threading.BoundedSemaphore(size)
+        self._drivers = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _new_driver(self):
+        driver = self._factory()
+        with self._lock:
+            self._drivers.append(driver)
+        return driver
+
+    def _discard(self, driver):
+        with self._lock:
+            if driver not in self._drivers:
+                # already quit by close
+                return
+            self._drivers.remove(driver)
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+
+    def start(self):
+        """start all the sessions at once instead of on first use"""
+        with ThreadPoolExecutor(self.size) as executor:
+            for driver in executor.map(lambda _: self._new_driver(), range(self.size - len(self._drivers))):
+                self._idle.put(driver)
+        return self
+
+    @contextmanager
+    def session(self):
+        """borrow a session, waits while all of them are in use"""
+        if self._closed:
+            raise RuntimeError('the browser pool is closed')
+        with self._slots:
+            # close may have run while this borrower waited for a slot
+            if self._closed:
+                raise RuntimeError('the browser pool is closed')
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                driver = self._new_driver()
+            broken = False
+            try:
+                yield driver
+            except JavascriptException:
+                # the page script failed, the session itself is fine
+                raise
+            except WebDriverException:
+                broken = True
+                raise
+            finally:
+                if broken:
+                    self._discard(driver)
+                else:
+                    self._idle.put(driver)
+
+    def run(self, check, url):
+        with self.session() as driver:
+            return check(driver, url)
+
+    def map(self, check, urls):
+        """check(driver, url) for every url on the pooled sessions, results in the order of urls
+
+        a check that fails is returned as its exception instead of stopping the others
+        """
+        def run(url):
+            try:
+                return self.run(check, url)
+            except Exception as err:
+                return err
+
+        with ThreadPoolExecutor(self.size) as executor:
+            return list(executor.map(run, urls))
+
+    def close(self):
+        """quit all the sessions, waits for the checks that still hold one"""
+        if self._closed:
+            return
+        self._closed = True
+        # every slot taken means no session is lent out any more
+        for _ in range(self.size):
+            self._slots.acquire()
+        try:
+            while True:
+                try:
+                    self._idle.get_nowait()
+                except queue.Empty:
+                    break
+            with self._lock:
+                drivers = list(self._drivers)
+            for driver in drivers:
+                self._discard(driver)
+        finally:
+            # borrowers still waiting wake up and see the pool is closed
+            for _ in range(self.size):
+                self._slots.release()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
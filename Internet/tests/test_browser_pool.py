@@ -0,0 +1,154 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+# browser_pool.py is one folder up, the scripts import it without a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from selenium.common.exceptions import JavascriptException, WebDriverException
+from browser_pool import (BrowserPool, COOKIE_SCRIPT, STORAGE_SCRIPT, check_cookie, check_local_storage,
+                          storage_batch)
+
+
+class FakeDriver:
+    """runs the storage and cookie scripts on dicts instead of a browser"""
+
+    def __init__(self):
+        self.url = None
+        self.storage = {'localStorage': {}, 'sessionStorage': {}}
+        self.cookies = {}
+        self.scripts = 0
+        self.quit_calls = 0
+
+    def get(self, url):
+        self.url = url
+
+    def execute_script(self, script, *args):
+        self.scripts += 1
+        if script == STORAGE_SCRIPT:
+            storage, operations = self.storage[args[0]], args[1]
+        elif script == COOKIE_SCRIPT:
+            storage, operations = self.cookies, args[0]
+        else:
+            raise JavascriptException('unknown script')
+        results = []
+        for op, key, value in operations:
+            if op == 'set':
+                storage[key] = value
+            elif op == 'clear':
+                storage.clear()
+            elif op == 'remove':
+                storage.pop(key, None)
+            elif op != 'get':
+                raise JavascriptException('unknown operation ' + op)
+            results.append(storage.get(key) if op == 'get' else None)
+        return results
+
+    def quit(self):
+        self.quit_calls += 1
+
+
+class FakeFactory:
+    def __init__(self):
+        self.drivers = []
+
+    def __call__(self):
+        driver = FakeDriver()
+        self.drivers.append(driver)
+        return driver
+
+
+def slow_check(driver, url):
+    time.sleep(0.2)
+    if driver.quit_calls:
+        raise AssertionError('the session was quit while it was lent out')
+    if url == 'broken':
+        raise WebDriverException('chrome went away')
+    if url == 'script':
+        raise JavascriptException('the page script failed')
+    return url
+
+
+class TestChecks(unittest.TestCase):
+
+    def test_local_storage_check_is_one_script(self):
+        driver = FakeDriver()
+        result = check_local_storage(driver, 'http://example.com')
+        self.assertEqual(result, {'url': 'http://example.com', 'value': 'Value', 'after_remove': None})
+        self.assertEqual(driver.scripts, 1)
+        self.assertEqual(driver.storage['localStorage'], {})
+
+    def test_cookie_check_is_one_script(self):
+        driver = FakeDriver()
+        result = check_cookie(driver, 'http://example.com')
+        self.assertEqual(result, {'url': 'http://example.com', 'value': 'someCookieVal', 'after_remove': None})
+        self.assertEqual(driver.scripts, 1)
+
+    def test_short_operations_are_padded(self):
+        driver = FakeDriver()
+        results = storage_batch(driver, [('set', 'a', '1'), ('get', 'a'), ('clear',), ('get', 'a')], 'sessionStorage')
+        self.assertEqual(results, [None, '1', None, None])
+
+
+class TestBrowserPool(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = FakeFactory()
+
+    def test_sessions_are_reused(self):
+        with BrowserPool(2, factory=self.factory) as pool:
+            results = pool.map(check_local_storage, [f'http://example.com/{i}' for i in range(6)])
+        self.assertEqual([result['url'] for result in results], [f'http://example.com/{i}' for i in range(6)])
+        # started up front, then only borrowed and returned
+        self.assertEqual(len(self.factory.drivers), 2)
+        self.assertTrue(all(driver.quit_calls == 1 for driver in self.factory.drivers))
+
+    def test_broken_session_is_replaced(self):
+        pool = BrowserPool(1, factory=self.factory).start()
+        with self.assertRaises(WebDriverException):
+            pool.run(slow_check, 'broken')
+        [broken] = self.factory.drivers
+        self.assertEqual(broken.quit_calls, 1)
+        self.assertEqual(pool.run(slow_check, 'ok'), 'ok')
+        self.assertEqual(len(self.factory.drivers), 2)
+        pool.close()
+        self.assertEqual(broken.quit_calls, 1)
+
+    def test_script_error_keeps_session(self):
+        with BrowserPool(1, factory=self.factory) as pool:
+            with self.assertRaises(JavascriptException):
+                pool.run(slow_check, 'script')
+            self.assertEqual(pool.run(slow_check, 'ok'), 'ok')
+        self.assertEqual(len(self.factory.drivers), 1)
+
+    def test_map_returns_failures_in_place(self):
+        with BrowserPool(2, factory=self.factory) as pool:
+            results = pool.map(slow_check, ['a', 'broken', 'c'])
+        self.assertEqual(results[0], 'a')
+        self.assertIsInstance(results[1], WebDriverException)
+        self.assertEqual(results[2], 'c')
+
+    def test_close_waits_for_borrowed_sessions(self):
+        pool = BrowserPool(2, factory=self.factory).start()
+        results = []
+        thread = threading.Thread(target=lambda: results.extend(pool.map(slow_check, ['a', 'broken', 'c'])))
+        thread.start()
+        time.sleep(0.05)
+        pool.close()
+        thread.join()
+        # the running checks kept their sessions, the one still waiting found the pool closed
+        self.assertEqual(results[0], 'a')
+        self.assertIsInstance(results[1], WebDriverException)
+        self.assertIsInstance(results[2], RuntimeError)
+        self.assertTrue(all(driver.quit_calls == 1 for driver in self.factory.drivers))
+        self.assertEqual(pool._drivers, [])
+        self.assertTrue(pool._idle.empty())
+        with self.assertRaises(RuntimeError):
+            pool.run(slow_check, 'a')
+        # a second close does nothing
+        pool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()